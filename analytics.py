@@ -0,0 +1,204 @@
+"""Подробная личная аналитика: ряды дистанции, серии, темп и рекорды"""
+import math
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+from periods import previous_period, resolve_period
+
+# Тренировки участника столбцами, по возрастанию даты:
+# время UTC (datetime64[s]), дистанция (км) и время (минуты)
+WorkoutArrays = namedtuple('WorkoutArrays', ['dates', 'distance', 'duration'])
+
+# Итоги периода
+PeriodTotals = namedtuple('PeriodTotals', ['workouts', 'distance', 'duration'])
+
+# Лучший темп в диапазоне дистанций
+PersonalBest = namedtuple('PersonalBest', ['band', 'pace', 'distance', 'date'])
+
+# Подробный отчет за период: итоги, ряды (начало недели/месяца, км),
+# серии дней подряд, перцентили темпа, лучшие темпы и итоги прошлого периода
+PersonalReport = namedtuple('PersonalReport', [
+    'totals', 'weekly', 'monthly', 'longest_streak', 'current_streak',
+    'pace_percentiles', 'bests', 'previous',
+])
+
+# Данные графиков прогресса: дистанция по неделям (начало недели, км)
+# и темп каждой тренировки периода (дата, мин/км)
+ProgressSeries = namedtuple('ProgressSeries', ['weekly', 'paces'])
+
+# Диапазоны дистанций для лучших темпов: от (включительно), до, название
+DISTANCE_BANDS = (
+    (0, 5, 'до 5 км'),
+    (5, 10, '5-10 км'),
+    (10, 21.1, '10 км - полумарафон'),
+    (21.1, 42.2, 'полумарафон - марафон'),
+    (42.2, math.inf, 'марафон и длиннее'),
+)
+
+# Перцентили темпа в отчете
+PACE_PERCENTILES = (10, 50, 90)
+
+# Длина рядов дистанции
+SERIES_WEEKS = 8
+SERIES_MONTHS = 6
+CHART_WEEKS = 12
+
+WORKOUT_DTYPE = np.dtype([('timestamp', 'i8'), ('distance', 'f8'), ('duration', 'f8')])
+
+
+def to_arrays(rows):
+    """Столбцы из строк (unix-время, дистанция, время), уже упорядоченных по дате"""
+    data = np.fromiter(rows, dtype=WORKOUT_DTYPE)
+    return WorkoutArrays(data['timestamp'].astype('datetime64[s]'), data['distance'], data['duration'])
+
+
+def period_bounds(period, today):
+    """Границы периода и прошлого периода как datetime64[s] (None для 'all').
+
+    Для текущего периода прошлый берется за тот же срок от начала,
+    чтобы незаконченный месяц не сравнивался с полным.
+    """
+    current = resolve_period(period, today)
+    previous = previous_period(current)
+    if previous is None:
+        return None, None
+    now = today.replace(tzinfo=None)
+    previous_end = previous.end
+    if current.start <= now < current.end:
+        previous_end = min(previous.start + (now - current.start), previous.end)
+    return tuple(np.datetime64(moment, 's') for moment in (current.start, current.end)), \
+        tuple(np.datetime64(moment, 's') for moment in (previous.start, previous_end))
+
+
+def select(arrays, bounds):
+    """Срез тренировок за [начало, конец) по упорядоченным датам"""
+    if bounds is None:
+        return slice(None)
+    first, last = np.searchsorted(arrays.dates, bounds)
+    return slice(first, last)
+
+
+def totals(arrays, part):
+    """Число тренировок, дистанция и время в срезе part (PeriodTotals)"""
+    return PeriodTotals(
+        int(arrays.dates[part].size), float(arrays.distance[part].sum()), float(arrays.duration[part].sum())
+    )
+
+
+def series(arrays, days, end_day, step, count):
+    """Сумма дистанции по count последним отрезкам, заканчивающимся днем end_day.
+
+    days - номера дней тренировок, step - 'W' (недели с понедельника) или 'M'.
+    """
+    if step == 'W':
+        # 1970-01-01 - четверг, сдвиг на 3 дня дает недели с понедельника
+        buckets = (days + 3) // 7
+        last = (end_day + 3) // 7
+    else:
+        buckets = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        last = np.datetime64(int(end_day), 'D').astype('datetime64[M]').astype(np.int64)
+    first = last - count + 1
+    mask = (buckets >= first) & (buckets <= last)
+    sums = np.bincount(buckets[mask] - first, weights=arrays.distance[mask], minlength=count)
+
+    if step == 'W':
+        starts = (np.arange(first, last + 1) * 7 - 3).astype('datetime64[D]')
+    else:
+        starts = np.arange(first, last + 1).astype('datetime64[M]').astype('datetime64[D]')
+    return [(start.item(), round(float(value), 2)) for start, value in zip(starts, sums)]
+
+
+def streaks(days, today):
+    """Самая длинная серия дней подряд с тренировками и текущая серия"""
+    unique = np.unique(days)
+    if not unique.size:
+        return 0, 0
+    # Границы серий - разрывы больше одного дня
+    breaks = np.flatnonzero(np.diff(unique) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks + 1, [unique.size]))
+    lengths = ends - starts
+    # Серия не прервана, если последняя тренировка сегодня или вчера
+    current = int(lengths[-1]) if unique[-1] >= today - 1 else 0
+    return int(lengths.max()), current
+
+
+def series_end(bounds, today):
+    """Последний день рядов: конец периода, для текущего периода - сегодня (номера дней)"""
+    today_day = np.datetime64(today.strftime('%Y-%m-%d'), 'D').astype(np.int64)
+    if bounds is None:
+        return today_day, today_day
+    return today_day, min(today_day, bounds[1].astype('datetime64[D]').astype(np.int64) - 1)
+
+
+def personal_bests(arrays, part):
+    """Лучший темп в каждом диапазоне дистанций"""
+    distance = arrays.distance[part]
+    duration = arrays.duration[part]
+    dates = arrays.dates[part]
+    valid = distance > 0
+    pace = np.divide(duration, distance, out=np.full(distance.shape, np.inf), where=valid)
+
+    bests = []
+    for low, high, band in DISTANCE_BANDS:
+        mask = valid & (distance >= low) & (distance < high)
+        if not mask.any():
+            continue
+        index = np.flatnonzero(mask)[np.argmin(pace[mask])]
+        bests.append(PersonalBest(band, float(pace[index]), float(distance[index]), dates[index].item()))
+    return bests
+
+
+def personal_report(arrays, period='all', today=None):
+    """Подробный отчет участника за период (None, если тренировок за период нет)"""
+    if today is None:
+        today = datetime.now(timezone.utc)
+    bounds, previous_bounds = period_bounds(period, today)
+    part = select(arrays, bounds)
+    period_totals = totals(arrays, part)
+    if not period_totals.workouts:
+        return None
+
+    days = arrays.dates.astype('datetime64[D]').astype(np.int64)
+    today_day, end_day = series_end(bounds, today)
+
+    distance = arrays.distance[part]
+    valid = distance > 0
+    pace = arrays.duration[part][valid] / distance[valid]
+    percentiles = np.percentile(pace, PACE_PERCENTILES) if pace.size else ()
+
+    longest, _ = streaks(days[part], today_day)
+    _, current = streaks(days, today_day)
+
+    return PersonalReport(
+        totals=period_totals,
+        weekly=series(arrays, days, end_day, 'W', SERIES_WEEKS),
+        monthly=series(arrays, days, end_day, 'M', SERIES_MONTHS),
+        longest_streak=longest,
+        current_streak=current,
+        pace_percentiles=[float(value) for value in percentiles],
+        bests=personal_bests(arrays, part),
+        previous=totals(arrays, select(arrays, previous_bounds)) if previous_bounds else None,
+    )
+
+
+def progress_series(arrays, period='all', today=None, weeks=CHART_WEEKS):
+    """Данные графиков прогресса за период (None, если тренировок за период нет)"""
+    if today is None:
+        today = datetime.now(timezone.utc)
+    bounds, _ = period_bounds(period, today)
+    part = select(arrays, bounds)
+    if not arrays.dates[part].size:
+        return None
+
+    days = arrays.dates.astype('datetime64[D]').astype(np.int64)
+    _, end_day = series_end(bounds, today)
+    distance = arrays.distance[part]
+    valid = distance > 0
+    paces = arrays.duration[part][valid] / distance[valid]
+    return ProgressSeries(
+        weekly=series(arrays, days, end_day, 'W', weeks),
+        paces=[(date.item(), round(float(pace), 3)) for date, pace in zip(arrays.dates[part][valid], paces)],
+    )
@@ -1,24 +1,343 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from database import Database
+import gzip
+import itertools
+import json
 import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import config
+from migrations import CAPTURED_TABLES, migrate
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def schedule_backup():
-    """Планировщик резервного копирования"""
-    scheduler = BackgroundScheduler()
-    db = Database()
-    
-    def perform_backup():
+# Время копии в имени: YYYYmmdd-HHMMSS и микросекунды (у старых копий их нет)
+BACKUP_STAMP = re.compile(r'-(\d{8})-(\d{6})(?:-(\d{6}))?\.db\.gz$')
+
+class BackupError(Exception):
+    """Ошибка создания или проверки резервной копии"""
+
+class BackupRestarted(Exception):
+    """Копирование по шагам начиналось заново слишком много раз"""
+
+def check_integrity(path):
+    """Проверка целостности файла базы данных"""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError(f"Integrity check failed for {path}: {result}")
+
+def get_change_seq(conn):
+    """Номер последнего изменения в журнале changes"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+def backup_time(name):
+    """Время создания копии (UTC) из имени <база>-YYYYmmdd-HHMMSS-ffffff.db.gz"""
+    match = BACKUP_STAMP.search(name)
+    if match is None:
+        raise ValueError(f"Not a backup name: {name}")
+    day, seconds, micros = match.groups()
+    return datetime.strptime(f"{day}{seconds}{micros or '000000'}", '%Y%m%d%H%M%S%f').replace(tzinfo=timezone.utc)
+
+def backup_key(name):
+    """Короткий ключ копии из цифр ее времени, например для callback_data"""
+    match = BACKUP_STAMP.search(name)
+    if match is None:
+        raise ValueError(f"Not a backup name: {name}")
+    return ''.join(part for part in match.groups() if part)
+
+def copy_online(source_path, target_path, pages=config.BACKUP_STEP_PAGES,
+                sleep=config.BACKUP_STEP_SLEEP, max_restarts=config.BACKUP_MAX_RESTARTS):
+    """Копирование базы через SQLite backup API.
+
+    Страницы копируются порциями по pages штук, между порциями блокировка
+    снимается и записи в базу продолжаются. Если запись меняет базу во время
+    копирования, SQLite начинает заново; после max_restarts перезапусков
+    база копируется за один шаг.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarted()
+        last_remaining = remaining
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except BackupRestarted:
+            logger.warning(f"Backup restarted {restarts} times, copying in one step")
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+class BackupManager:
+    """Резервные копии базы: создание, ротация, просмотр и восстановление.
+
+    Полные копии хранятся в backup_dir в виде <имя базы>-<YYYYmmdd-HHMMSS-ffffff>.db.gz
+    (время UTC с микросекундами). Изменения после полной копии собираются триггерами в таблицу
+    changes и периодически выгружаются в сжатые файлы
+    <имя базы>-delta-<первое>-<последнее>.jsonl.gz, что позволяет восстановить
+    базу на любой момент между копиями.
+    """
+    def __init__(self, db_name=config.DATABASE_NAME, backup_dir=config.BACKUP_DIR,
+                 keep=config.BACKUP_KEEP):
+        self.db_name = db_name
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.prefix = os.path.splitext(os.path.basename(db_name))[0] + '-'
+
+    def create_backup(self):
+        """Создание проверенной сжатой копии базы, возвращает имя файла"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        started = time.perf_counter()
+        name, reserved = self.reserve_name()
+        path = os.path.join(self.backup_dir, name)
+
+        fd, snapshot = tempfile.mkstemp(dir=self.backup_dir, suffix='.db.partial')
+        os.close(fd)
         try:
-            db.backup_database()
-            logger.info("Scheduled backup completed successfully")
-        except Exception as e:
-            logger.error(f"Backup error: {e}")
-    
-    # Ежедневное резервное копирование в 3:00 MSK (00:00 UTC)
-    scheduler.add_job(perform_backup, 'cron', hour=0, minute=0)
-    
-    scheduler.start()
-    return scheduler
+            copy_online(self.db_name, snapshot)
+            copied = time.perf_counter()
+            check_integrity(snapshot)
+            checked = time.perf_counter()
+            
+            conn = sqlite3.connect(snapshot)
+            snapshot_seq = get_change_seq(conn)
+            conn.close()
+
+            # Сжимаем во временный файл, чтобы в каталоге не появилась неполная копия
+            with open(snapshot, 'rb') as source, gzip.GzipFile(fileobj=reserved, mode='wb', compresslevel=6) as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            reserved.close()
+            os.replace(path + '.partial', path)
+        finally:
+            reserved.close()
+            for leftover in (snapshot, path + '.partial'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        finished = time.perf_counter()
+        logger.info(
+            f"Backup created: {path} (copy {copied - started:.2f}s, "
+            f"check {checked - copied:.2f}s, compress {finished - checked:.2f}s)"
+        )
+
+        # Изменения до снимка уже есть в копии: выгружаем их для восстановления
+        # на более ранние моменты и очищаем журнал
+        self.ship_delta(up_to=snapshot_seq)
+        self.prune_changes(snapshot_seq)
+        self.rotate()
+        return name
+
+    def reserve_name(self):
+        """Свободное имя новой копии и открытый файл <имя>.partial, занимающий его.
+
+        Две копии в одну микросекунду (или при грубых часах) получают
+        разные имена: время сдвигается, пока имя не окажется свободным.
+        """
+        moment = datetime.now(timezone.utc)
+        while True:
+            name = f"{self.prefix}{moment:%Y%m%d-%H%M%S-%f}.db.gz"
+            path = os.path.join(self.backup_dir, name)
+            if not os.path.exists(path):
+                try:
+                    return name, open(path + '.partial', 'xb')
+                except FileExistsError:
+                    pass
+            moment += timedelta(microseconds=1)
+
+    def find_backup(self, key):
+        """Имя копии по ключу backup_key или None"""
+        for name in self.list_backups():
+            if backup_key(name) == key:
+                return name
+        return None
+
+    def list_backups(self):
+        """Имена резервных копий, новые первыми"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        names = [
+            name for name in os.listdir(self.backup_dir)
+            if name.startswith(self.prefix) and BACKUP_STAMP.search(name)
+        ]
+        return sorted(names, reverse=True)
+
+    def list_deltas(self):
+        """Файлы изменений: список (первое изменение, последнее изменение, имя файла)"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        deltas = []
+        for name in os.listdir(self.backup_dir):
+            if name.startswith(self.prefix + 'delta-') and name.endswith('.jsonl.gz'):
+                first, last = name[len(self.prefix + 'delta-'):-len('.jsonl.gz')].split('-')
+                deltas.append((int(first), int(last), name))
+        return sorted(deltas)
+
+    def rotate(self):
+        """Удаление копий сверх лимита хранения и устаревших файлов изменений"""
+        backups = self.list_backups()
+        for name in backups[self.keep:]:
+            os.remove(os.path.join(self.backup_dir, name))
+            logger.info(f"Backup removed by rotation: {name}")
+
+        # Изменения до самой старой оставшейся копии для восстановления не нужны
+        if backups[:self.keep]:
+            oldest = backup_time(backups[:self.keep][-1]).timestamp()
+            for _, _, name in self.list_deltas():
+                path = os.path.join(self.backup_dir, name)
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+                    logger.info(f"Delta removed by rotation: {name}")
+
+    def ship_delta(self, up_to=None):
+        """Выгрузка новых изменений из журнала в файл, возвращает имя файла или None"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        last_shipped = max((last for _, last, _ in self.list_deltas()), default=0)
+
+        conn = sqlite3.connect(self.db_name)
+        try:
+            query = 'SELECT seq, changed_at, table_name, operation, row_id, data FROM changes WHERE seq > ?'
+            params = [last_shipped]
+            if up_to is not None:
+                query += ' AND seq <= ?'
+                params.append(up_to)
+            rows = conn.execute(query + ' ORDER BY seq', params).fetchall()
+        finally:
+            conn.close()
+
+        if not rows:
+            return None
+
+        name = f"{self.prefix}delta-{rows[0][0]:012d}-{rows[-1][0]:012d}.jsonl.gz"
+        path = os.path.join(self.backup_dir, name)
+        with gzip.open(path + '.partial', 'wt', encoding='utf-8') as file:
+            for seq, changed_at, table, operation, row_id, data in rows:
+                record = [seq, changed_at, table, operation, row_id, json.loads(data) if data else None]
+                file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        os.replace(path + '.partial', path)
+
+        logger.info(f"Delta shipped: {name} ({len(rows)} changes)")
+        return name
+
+    def prune_changes(self, up_to):
+        """Очистка журнала изменений, вошедших в полную копию"""
+        conn = sqlite3.connect(self.db_name)
+        with conn:
+            conn.execute('DELETE FROM changes WHERE seq <= ?', (up_to,))
+        conn.close()
+
+    def replay_deltas(self, path, until):
+        """Применение изменений после снимка вплоть до момента until (UTC) к файлу базы"""
+        until_text = f"{until:%Y-%m-%d %H:%M:%S}.999"
+        conn = sqlite3.connect(path)
+        start_seq = get_change_seq(conn)
+
+        records = []
+        for _, last, name in self.list_deltas():
+            if last <= start_seq:
+                continue
+            with gzip.open(os.path.join(self.backup_dir, name), 'rt', encoding='utf-8') as file:
+                for line in file:
+                    record = json.loads(line)
+                    if record[0] > start_seq and record[1] <= until_text:
+                        records.append(record)
+        records.sort(key=lambda record: record[0])
+
+        # Подряд идущие однотипные изменения применяются одним executemany
+        with conn:
+            for (table, operation), group in itertools.groupby(records, key=lambda record: (record[2], record[3])):
+                columns = CAPTURED_TABLES[table]
+                if operation == 'delete':
+                    conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(record[4],) for record in group])
+                else:
+                    updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+                    conn.executemany(
+                        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                        f'ON CONFLICT (id) DO UPDATE SET {updates}',
+                        [tuple(record[5][column] for column in columns) for record in group]
+                    )
+        conn.close()
+
+        logger.info(f"Replayed {len(records)} changes up to {until_text}")
+        return len(records)
+
+    def reset_change_log(self, path):
+        """Начало новой цепочки изменений в восстановленной базе.
+
+        Журнал очищается, а нумерация продолжается после уже выгруженных
+        изменений, чтобы новые файлы не смешивались со старой историей.
+        """
+        last_shipped = max((last for _, last, _ in self.list_deltas()), default=0)
+        conn = sqlite3.connect(path)
+        with conn:
+            seq = max(get_change_seq(conn), last_shipped)
+            conn.execute('DELETE FROM changes')
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'changes'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('changes', ?)", (seq,))
+        conn.close()
+
+    def restore(self, name=None, until=None):
+        """Восстановление базы из копии.
+        
+        По умолчанию берется последняя копия. Если задан момент until (UTC),
+        берется последняя копия до него и к ней применяются изменения до until.
+        """
+        # Изменения с последней выгрузки есть только в журнале живой базы,
+        # который восстановление перезапишет: выгружаем их до выбора копии
+        self.ship_delta()
+        backups = self.list_backups()
+        if until is not None:
+            # until точен до секунды, как и применение изменений
+            backups = [backup for backup in backups if backup_time(backup).replace(microsecond=0) <= until]
+        if name is None:
+            if not backups:
+                raise BackupError("No backups found")
+            name = backups[0]
+        elif name not in backups:
+            raise BackupError(f"Backup not found: {name}")
+
+        fd, snapshot = tempfile.mkstemp(dir=self.backup_dir, suffix='.db.partial')
+        os.close(fd)
+        try:
+            with gzip.open(os.path.join(self.backup_dir, name), 'rb') as source, open(snapshot, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            check_integrity(snapshot)
+
+            # Копия может быть сделана до последних миграций
+            conn = sqlite3.connect(snapshot)
+            migrate(conn)
+            conn.close()
+
+            if until is not None:
+                self.replay_deltas(snapshot, until)
+            self.reset_change_log(snapshot)
+
+            # Копия записывается поверх живой базы через backup API,
+            # открытые соединения сразу видят восстановленные данные
+            copy_online(snapshot, self.db_name, pages=-1)
+        finally:
+            os.remove(snapshot)
+
+        logger.info(f"Database restored from {name}" + (f" up to {until}" if until else ""))
+
+        # Новая цепочка изменений начинается с полной копии
+        self.create_backup()
+        return name
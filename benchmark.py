@@ -0,0 +1,505 @@
+"""Замеры производительности слоя данных
+
+Генерация синтетического клуба:
+    python benchmark.py generate --db synthetic.db --members 10000 --years 5
+Набор замеров (результаты в JSON для сравнения между коммитами):
+    python benchmark.py run [--db synthetic.db] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import bot
+from charts import ChartRenderer, render_chart
+from database import Database, AsyncDatabase, EXPORT_FORMATS
+
+# Память процесса после загрузки бота, до замеров
+STARTUP_RSS_MB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Периоды статистики, доступные в боте
+PERIODS = ('week', 'month', 'last_month', 'quarter', 'last_quarter', 'year', 'all')
+
+# Участник, от имени которого пишутся тренировки в замерах записи
+BENCHMARK_USER = 'benchmark_writer'
+
+# Шаг фоновой задачи, замеряющей задержки цикла событий, секунды
+STALL_TICK = 0.001
+
+
+class FakeUser:
+    def __init__(self, username):
+        self.username = username
+        self.id = 0
+
+
+class FakeQuery:
+    """Заглушка CallbackQuery: сообщение сохраняется вместо отправки"""
+    def __init__(self, username='user0'):
+        self.text = None
+        self.from_user = FakeUser(username)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.text = text
+
+
+def generate_club(db_name, members=1000, years=1.0, seed=42, end=None):
+    """Заполнение базы синтетическим клубом, возвращает число тренировок.
+
+    У каждого участника своя дата вступления (часть участников со временем
+    бросает), частота тренировок (гамма-распределение, в среднем 2-3 в неделю),
+    типичная дистанция (логнормальная около 7 км) и темп (нормальный около
+    6 мин/км). Тренировки идут утром и вечером и пишутся в порядке дат,
+    как при обычной работе бота.
+    """
+    rng = random.Random(seed)
+    end = end or datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    days = int(365 * years)
+    start = end - timedelta(days=days)
+
+    runners = []
+    for m in range(members):
+        joined = 0 if rng.random() < 0.3 else rng.randrange(days)
+        left = days if rng.random() < 0.8 else rng.randint(joined, days)
+        per_week = min(rng.gammavariate(2.0, 1.3), 10.0)
+        typical_distance = rng.lognormvariate(math.log(7.0), 0.35)
+        pace = max(rng.gauss(6.0, 0.8), 3.2)
+        runners.append((f"runner{m}", joined, left, per_week / 7, typical_distance, pace))
+
+    Database(db_name)
+    conn = sqlite3.connect(db_name)
+    insert = 'INSERT INTO workouts (record_date, distance, duration, telegram_username) VALUES (?, ?, ?, ?)'
+    total = 0
+    batch = []
+
+    for day in range(days):
+        date = start + timedelta(days=day)
+        rows = []
+        for username, joined, left, chance, typical_distance, pace in runners:
+            if joined <= day < left and rng.random() < chance:
+                hour = rng.choice((6, 7, 7, 8, 12, 18, 19, 19, 20, 21))
+                seconds = hour * 3600 + rng.randrange(3600)
+                distance = round(min(rng.lognormvariate(math.log(typical_distance), 0.3), 50.0), 2)
+                duration = max(int(distance * rng.gauss(pace, 0.35)), 1)
+                rows.append((seconds, distance, duration, username))
+
+        rows.sort()
+        for seconds, distance, duration, username in rows:
+            record_date = (date + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+            batch.append((record_date, distance, duration, username))
+
+        if len(batch) >= 50000 or day == days - 1:
+            with conn:
+                conn.executemany(insert, batch)
+            total += len(batch)
+            batch = []
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO nicknames (telegram_username, nickname) VALUES (?, ?) ON CONFLICT DO NOTHING',
+            [(runner[0], f"Бегун {i}") for i, runner in enumerate(runners) if rng.random() < 0.6]
+        )
+        # Синтетическим данным журнал изменений для резервных копий не нужен
+        conn.execute('DELETE FROM changes')
+    conn.close()
+    return total
+
+
+def fill_club(db_name, members, workouts_per_member=20):
+    """Заполнение базы участниками с никнеймами и тренировками"""
+    db = Database(db_name)
+    db.write_batch(
+        workouts=[(f"user{m}", 5.0 + m % 10, 30 + m % 40)
+                  for m in range(members) for _ in range(workouts_per_member)],
+        nicknames=[(f"user{m}", f"Бегун {m}") for m in range(members) if m % 2 == 0],
+    )
+
+
+def percentile(sorted_values, percent):
+    """Перцентиль по отсортированному списку"""
+    index = min(len(sorted_values) - 1, math.ceil(percent / 100 * len(sorted_values)) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def summarize(latencies, elapsed, peak_memory_mb):
+    """Сводка замера: перцентили задержки в мс, пропускная способность, пик памяти"""
+    latencies = sorted(latency * 1000 for latency in latencies)
+    return {
+        'iterations': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3),
+        'ops_per_sec': round(len(latencies) / elapsed, 1),
+        'peak_memory_mb': peak_memory_mb,
+    }
+
+
+def run_sync(func, iterations):
+    """Последовательные вызовы: задержки и общее время"""
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - call_started)
+    return latencies, time.perf_counter() - started
+
+
+def run_async(func, iterations, concurrency=1, db_name=None):
+    """Вызовы корутины с заданной конкурентностью в новом цикле событий"""
+    async def main():
+        db = AsyncDatabase(db_name) if db_name else None
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def call(i):
+            async with semaphore:
+                call_started = time.perf_counter()
+                await func(db, i)
+                latencies.append(time.perf_counter() - call_started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(call(i) for i in range(iterations)))
+        elapsed = time.perf_counter() - started
+        if db:
+            await db.close()
+        return latencies, elapsed
+
+    return asyncio.run(main())
+
+
+def run_charts(kind, data, iterations, concurrency=4, inline=False):
+    """Отрисовка графиков с замером задержек цикла событий.
+
+    Каждый вызов рисует новый график (заголовок с номером), поэтому кэш
+    не срабатывает. inline - отрисовка прямо в цикле событий, для сравнения
+    с пулом процессов. Возвращает задержки, общее время и задержки цикла.
+    """
+    async def main():
+        renderer = ChartRenderer(workers=concurrency, cache_size=1)
+        renderer.start()
+        # Процессы пула запускаются до замера
+        await asyncio.gather(*(renderer.render(kind, None, None, f"warmup {i}", data) for i in range(concurrency)))
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        stalls = []
+        done = asyncio.Event()
+
+        async def ticker():
+            while not done.is_set():
+                tick_started = time.perf_counter()
+                await asyncio.sleep(STALL_TICK)
+                stalls.append(time.perf_counter() - tick_started - STALL_TICK)
+
+        async def call(i):
+            async with semaphore:
+                call_started = time.perf_counter()
+                if inline:
+                    render_chart(kind, f"chart {i}", data)
+                else:
+                    await renderer.render(kind, None, None, f"chart {i}", data)
+                latencies.append(time.perf_counter() - call_started)
+
+        ticker_task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(call(i) for i in range(iterations)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await ticker_task
+        renderer.close()
+
+        stalls.sort()
+        return latencies, elapsed, {
+            'loop_stall_p99_ms': round(percentile(stalls, 99) * 1000, 3),
+            'loop_stall_max_ms': round(stalls[-1] * 1000, 3),
+        }
+
+    return asyncio.run(main())
+
+
+def measure_peak_memory(call):
+    """Пик выделенной памяти (МБ) за один вызов"""
+    tracemalloc.start()
+    try:
+        call()
+        return round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def build_operations(db_name, scale, seed):
+    """Операции набора: имя -> (прогон с замером задержек, одиночный вызов для замера памяти)"""
+    db = Database(db_name)
+    conn = sqlite3.connect(db_name)
+    usernames = [row[0] for row in conn.execute('SELECT DISTINCT telegram_username FROM monthly_stats')]
+    # Участник с наибольшим числом тренировок - худший случай личной аналитики
+    heaviest = conn.execute('''
+        SELECT telegram_username FROM monthly_stats
+        GROUP BY telegram_username ORDER BY SUM(workouts) DESC LIMIT 1
+    ''').fetchone()[0]
+    conn.close()
+    rng = random.Random(seed)
+
+    def pick(i):
+        return usernames[rng.randrange(len(usernames))]
+
+    def repeats(count):
+        return max(int(count * scale), 1)
+
+    operations = {}
+
+    operations['add_workout'] = (
+        lambda: run_sync(lambda i: db.add_workout(BENCHMARK_USER, 5.0, 30), repeats(200)),
+        lambda: db.add_workout(BENCHMARK_USER, 5.0, 30),
+    )
+
+    async def queued_add(async_db, i):
+        await async_db.add_workout(BENCHMARK_USER, 5.0, 30)
+
+    operations['add_workout_queued_x50'] = (
+        lambda: run_async(queued_add, repeats(2000), concurrency=50, db_name=db_name),
+        lambda: run_async(queued_add, 50, concurrency=50, db_name=db_name),
+    )
+
+    for period in PERIODS:
+        operations[f'get_statistics[{period}]'] = (
+            lambda period=period: run_sync(lambda i: db.get_statistics(period), repeats(20)),
+            lambda period=period: db.get_statistics(period),
+        )
+        operations[f'get_statistics[{period},user]'] = (
+            lambda period=period: run_sync(lambda i: db.get_statistics(period, pick(i)), repeats(200)),
+            lambda period=period: db.get_statistics(period, pick(0)),
+        )
+        operations[f'get_leaderboard_page[{period}]'] = (
+            lambda period=period: run_sync(lambda i: db.get_leaderboard_page(period, i % 5), repeats(20)),
+            lambda period=period: db.get_leaderboard_page(period),
+        )
+        operations[f'get_personal_report[{period}]'] = (
+            lambda period=period: run_sync(lambda i: db.get_personal_report(period, pick(i)), repeats(200)),
+            lambda period=period: db.get_personal_report(period, pick(0)),
+        )
+        operations[f'get_rank[{period}]'] = (
+            lambda period=period: run_sync(lambda i: db.get_rank(period, pick(i)), repeats(500)),
+            lambda period=period: db.get_rank(period, pick(0)),
+        )
+
+    operations['get_personal_report[all,heaviest]'] = (
+        lambda: run_sync(lambda i: db.get_personal_report('all', heaviest), repeats(100)),
+        lambda: db.get_personal_report('all', heaviest),
+    )
+
+    def cold_nickname(i):
+        db.invalidate_nicknames()
+        db.get_nickname(pick(i))
+
+    operations['get_nickname'] = (
+        lambda: run_sync(cold_nickname, repeats(500)),
+        lambda: cold_nickname(0),
+    )
+
+    # Обработчики бота целиком, без попаданий в кэш отчетов
+    async def show_rating(async_db, i):
+        bot.db = async_db
+        async_db.report_cache.invalidate()
+        await bot.show_rating(FakeQuery(), 'all')
+
+    async def show_personal_stats(async_db, i):
+        bot.db = async_db
+        async_db.report_cache.invalidate()
+        await bot.show_personal_stats(FakeQuery(pick(i)), 'all')
+
+    async def show_personal_report(async_db, i):
+        bot.db = async_db
+        async_db.report_cache.invalidate()
+        await bot.show_personal_report(FakeQuery(heaviest), 'all')
+
+    operations['show_rating[all]'] = (
+        lambda: run_async(show_rating, repeats(20), db_name=db_name),
+        lambda: run_async(show_rating, 1, db_name=db_name),
+    )
+    operations['show_personal_stats[all]'] = (
+        lambda: run_async(show_personal_stats, repeats(100), db_name=db_name),
+        lambda: run_async(show_personal_stats, 1, db_name=db_name),
+    )
+
+    operations['show_personal_report[all,heaviest]'] = (
+        lambda: run_async(show_personal_report, repeats(100), db_name=db_name),
+        lambda: run_async(show_personal_report, 1, db_name=db_name),
+    )
+
+    # Графики по данным самого активного участника: пул процессов и отрисовка в цикле событий
+    progress = db.get_progress_series('all', heaviest)
+    leaderboard = [(f"@{row.telegram_username}", row.distance) for row in db.get_leaderboard_page('all', 0, 15).rows]
+    chart_data = {'weekly': progress.weekly, 'pace': progress.paces, 'leaderboard': leaderboard}
+    for kind, data in chart_data.items():
+        operations[f'render_chart[{kind}]'] = (
+            lambda kind=kind, data=data: run_charts(kind, data, repeats(40)),
+            lambda kind=kind, data=data: run_charts(kind, data, 1, concurrency=1),
+        )
+    operations['render_chart[pace,inline]'] = (
+        lambda: run_charts('pace', progress.paces, repeats(40), inline=True),
+        lambda: run_charts('pace', progress.paces, 1, concurrency=1, inline=True),
+    )
+
+    for fmt in EXPORT_FORMATS:
+        def export(i, fmt=fmt):
+            os.remove(db.export(fmt))
+
+        operations[f'export[{fmt}]'] = (
+            lambda export=export: run_sync(export, 1),
+            lambda export=export: export(0),
+        )
+
+    return operations
+
+
+def cleanup(db_name):
+    """Удаление тренировок, записанных замерами"""
+    conn = sqlite3.connect(db_name)
+    with conn:
+        conn.execute('DELETE FROM workouts WHERE telegram_username = ?', (BENCHMARK_USER,))
+        conn.execute('DELETE FROM changes')
+    conn.close()
+
+
+def describe_environment(db_name):
+    """Параметры окружения и базы для файла результатов"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    conn = sqlite3.connect(db_name)
+    workouts, members = conn.execute(
+        'SELECT COUNT(*), COUNT(DISTINCT telegram_username) FROM workouts'
+    ).fetchone()
+    conn.close()
+
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'database': {
+            'workouts': workouts,
+            'members': members,
+            'size_mb': round(os.path.getsize(db_name) / 1024 / 1024, 1),
+        },
+        'startup_rss_mb': round(STARTUP_RSS_MB, 1),
+    }
+
+
+def print_result(name, result, baseline=None):
+    """Строка отчета по операции"""
+    line = (
+        f"{name:<34} p50 {result['p50_ms']:9.2f} мс  p95 {result['p95_ms']:9.2f} мс  "
+        f"p99 {result['p99_ms']:9.2f} мс  {result['ops_per_sec']:9.1f} оп/с"
+    )
+    if result['peak_memory_mb'] is not None:
+        line += f"  пик {result['peak_memory_mb']:7.2f} МБ"
+    if 'loop_stall_max_ms' in result:
+        line += f"  цикл событий: p99 {result['loop_stall_p99_ms']:.1f} мс, max {result['loop_stall_max_ms']:.1f} мс"
+    if baseline:
+        ratio = result['p50_ms'] / baseline['p50_ms'] if baseline['p50_ms'] else 1.0
+        marker = '⚠' if ratio > 1.2 else ' '
+        line += f"  {marker} x{ratio:.2f} к базе"
+    print(line)
+
+
+def run_suite(db_name, scale=1.0, only=None, memory=True, seed=42):
+    """Прогон набора замеров, возвращает отчет для JSON"""
+    results = {}
+    try:
+        for name, (timed, single) in build_operations(db_name, scale, seed).items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            latencies, elapsed, *extra = timed()
+            peak = measure_peak_memory(single) if memory else None
+            results[name] = summarize(latencies, elapsed, peak)
+            # Дополнительные показатели замера, например задержки цикла событий
+            for values in extra:
+                results[name].update(values)
+            print_result(name, results[name])
+    finally:
+        cleanup(db_name)
+
+    return {'environment': describe_environment(db_name), 'results': results}
+
+
+def compare(report, baseline_report):
+    """Сравнение с прошлым прогоном по медиане задержки, возвращает число регрессий"""
+    print(f"\nСравнение с {baseline_report['environment'].get('commit')}:")
+    regressions = 0
+    for name, result in report['results'].items():
+        baseline = baseline_report['results'].get(name)
+        if baseline:
+            print_result(name, result, baseline)
+            if baseline['p50_ms'] and result['p50_ms'] / baseline['p50_ms'] > 1.2:
+                regressions += 1
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='синтетическая база клуба')
+    generate.add_argument('--db', required=True)
+    generate.add_argument('--members', type=int, default=1000)
+    generate.add_argument('--years', type=float, default=1.0)
+    generate.add_argument('--seed', type=int, default=42)
+
+    run = commands.add_parser('run', help='набор замеров')
+    run.add_argument('--db', help='база для замеров (по умолчанию небольшой синтетический клуб)')
+    run.add_argument('--scale', type=float, default=1.0, help='множитель числа повторов')
+    run.add_argument('--only', nargs='+', help='замерять только операции, содержащие эти строки')
+    run.add_argument('--no-memory', action='store_true', help='без замера пика памяти')
+    run.add_argument('--output', help='файл JSON с результатами')
+    run.add_argument('--compare', help='файл JSON прошлого прогона для сравнения')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        started = time.perf_counter()
+        total = generate_club(args.db, args.members, args.years, args.seed)
+        print(f"✅ {total} тренировок, {args.members} участников за {time.perf_counter() - started:.1f} с")
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = args.db
+        if not db_name:
+            db_name = os.path.join(tmp, 'synthetic.db')
+            generate_club(db_name, members=200, years=1.0)
+        report = run_suite(db_name, args.scale, args.only, not args.no_memory)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(report, json.load(file))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
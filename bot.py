@@ -1,14 +1,27 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, ConversationHandler, filters
+    ContextTypes, ConversationHandler, TypeHandler, filters
 )
-from database import Database
+from telegram.helpers import escape_markdown
+from charts import ChartRenderer
+from dispatch import KeyedUpdateProcessor
+from database import EXPORT_FORMATS
+from importer import WorkoutImport
+from periods import explicit_key, get_period_bounds, period_title, resolve_period
+from backup import BackupManager, backup_key, backup_time
+from metrics import metrics, profiler, track, serve_metrics
+from tenants import TenantDatabase, TenantRegistry, current_tenant, tenant_for_chat, tenant_paths
 from utils import *
 import config
+import asyncio
 import os
-from datetime import datetime
+import secrets
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone, time as dt_time
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,14 +31,37 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler
-WAITING_TRAINING, WAITING_NICKNAME = range(2)
+WAITING_TRAINING, WAITING_NICKNAME, WAITING_IMPORT = range(3)
 
-# Инициализация базы данных
-db = Database()
+# Базы клубов: db обращается к базе клуба текущего обновления
+tenants = TenantRegistry()
+db = TenantDatabase(tenants)
+
+# Отрисовка графиков в отдельных процессах
+charts = ChartRenderer()
+
+# Параллельная обработка обновлений разных участников при UPDATE_CONCURRENCY > 1
+updates = KeyedUpdateProcessor()
+
+# Типы обновлений, которые обрабатывает бот
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Как часто обновлять сообщение о ходе импорта, секунды
+IMPORT_PROGRESS_INTERVAL = 3
 
 # Эмодзи для рейтинга
 MEDALS = ["🥇", "🥈", "🥉"]
 
+# Закончившиеся периоды, итоги которых рассылаются участникам
+SUMMARY_PERIODS = ('last_month', 'last_quarter')
+
+# Результаты отправки очереди исходящих с момента запуска
+OUTBOX_STATS = {'sent': 0, 'retried': 0, 'failed': 0}
+
+# Клубы с неотправленными сообщениями, в порядке обхода
+OUTBOX_TENANTS = {}
+
+@track('handler', profile=True)
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     welcome_text = """
@@ -47,6 +83,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(welcome_text, parse_mode='Markdown')
 
+@track('handler', profile=True)
 async def record_training_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало записи тренировки"""
     await update.message.reply_text(
@@ -58,6 +95,7 @@ async def record_training_start(update: Update, context: ContextTypes.DEFAULT_TY
     )
     return WAITING_TRAINING
 
+@track('handler', profile=True)
 async def handle_training_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода тренировки"""
     user_input = update.message.text
@@ -75,7 +113,7 @@ async def handle_training_input(update: Update, context: ContextTypes.DEFAULT_TY
         return WAITING_TRAINING
     
     # Сохраняем тренировку
-    db.add_workout(username, distance, duration)
+    await db.add_workout(username, distance, duration)
     
     await update.message.reply_text(
         f"✅ *Тренировка записана!*\n"
@@ -87,6 +125,7 @@ async def handle_training_input(update: Update, context: ContextTypes.DEFAULT_TY
     
     return ConversationHandler.END
 
+@track('handler', profile=True)
 async def timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Таймаут ввода"""
     await update.message.reply_text(
@@ -96,14 +135,34 @@ async def timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+@track('handler', profile=True)
 async def statistics_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Меню статистики"""
-    keyboard = [
-        [InlineKeyboardButton("📊 Рейтинг (все время)", callback_data='rating_all')],
-        [InlineKeyboardButton("📈 Рейтинг (квартал)", callback_data='rating_quarter')],
-        [InlineKeyboardButton("📅 Рейтинг (месяц)", callback_data='rating_month')],
-        [InlineKeyboardButton("👤 Моя статистика", callback_data='my_stats')],
-    ]
+    """Меню статистики: /статистика [период, например 2025, 2025-03, 2025-q1, 2025-w09, 2025-03-01..2025-03-15]"""
+    args = update.message.text.split()[1:]
+    if args:
+        try:
+            period = resolve_period(args[0].lower())
+        except ValueError:
+            await update.message.reply_text(
+                "❌ *Неизвестный период!*\n"
+                "*Примеры:* `2025`, `2025-03`, `2025-q1`, `2025-w09`, `2025-03-01..2025-03-15`",
+                parse_mode='Markdown'
+            )
+            return
+        title = period_title(period)
+        keyboard = [
+            [InlineKeyboardButton(f"📊 Рейтинг ({title})", callback_data=f'rating_{period.key}')],
+            [InlineKeyboardButton(f"👤 Моя статистика ({title})", callback_data=f'stats_{period.key}')],
+        ]
+    else:
+        keyboard = [
+            [InlineKeyboardButton("📊 Рейтинг (все время)", callback_data='rating_all')],
+            [InlineKeyboardButton("🗓 Рейтинг (год)", callback_data='rating_year')],
+            [InlineKeyboardButton("📈 Рейтинг (квартал)", callback_data='rating_quarter')],
+            [InlineKeyboardButton("📅 Рейтинг (месяц)", callback_data='rating_month')],
+            [InlineKeyboardButton("🏃 Рейтинг (неделя)", callback_data='rating_week')],
+            [InlineKeyboardButton("👤 Моя статистика", callback_data='my_stats')],
+        ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await update.message.reply_text(
@@ -112,57 +171,85 @@ async def statistics_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+@track('handler', profile=True)
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий кнопок"""
     query = update.callback_query
     await query.answer()
     
-    if query.data.startswith('rating_'):
-        period = query.data.split('_')[1]
-        await show_rating(query, period)
-    elif query.data == 'my_stats':
+    if query.data == 'my_stats':
         await show_my_stats_menu(query)
-    elif query.data.startswith('stats_'):
-        period = query.data.split('_')[1]
+        return
+    
+    # <действие>_<период>[:<страница>:<версия данных>], в ключе периода
+    # тоже бывает '_' (last_month), поэтому остальные поля отделены ':'
+    action, _, rest = query.data.partition('_')
+    period, *extra = rest.split(':')
+    try:
+        resolve_period(period)
+    except ValueError:
+        await query.edit_message_text("❌ *Неизвестный период*", parse_mode='Markdown')
+        return
+    
+    if action == 'rating':
+        page = int(extra[0]) if extra else 0
+        version = int(extra[1]) if len(extra) > 1 else None
+        await show_rating(query, period, page, version)
+    elif action == 'stats':
         await show_personal_stats(query, period)
+    elif action == 'report':
+        await show_personal_report(query, period)
+    elif action == 'chart':
+        await send_charts(query.message, query.from_user, period)
 
-async def show_rating(query, period):
-    """Показ рейтинга"""
-    if period == 'all':
-        period_name = "за все время"
-        df = db.get_statistics(period='all')
-    elif period == 'quarter':
-        period_name = "за текущий квартал"
-        df = db.get_statistics(period='quarter')
-    else:  # month
-        period_name = "за текущий месяц"
-        df = db.get_statistics(period='month')
-    
-    if df.empty:
-        await query.edit_message_text(
-            f"📊 *Рейтинг {period_name}*\n\n"
-            f"Пока нет данных о тренировках 😔",
-            parse_mode='Markdown'
-        )
-        return
+@track('handler')
+async def show_rating(query, period, page=0, version=None):
+    """Показ страницы рейтинга"""
+    # Готовая страница переиспользуется до следующей записи в базу
+    # или до начала нового периода
+    cache_key = ('rating', period, get_period_bounds(period), page)
+    # Кэш клуба берется один раз, чтобы поколение сверялось с тем же кэшем
+    report_cache = db.report_cache
+    generation = report_cache.generation
+    rendered = report_cache.get(cache_key)
+    if rendered is None:
+        rendered = await render_rating(period, page)
+        report_cache.put(cache_key, rendered, generation)
+    message, reply_markup, current_version = rendered
     
-    # Сортируем по дистанции
-    df = df.sort_values('общая_дистанция', ascending=False)
+    # Между перелистываниями рейтинг мог измениться: страница строится
+    # по текущим данным, а участник видит, что места сдвинулись
+    if version is not None and version != current_version:
+        message = "🔄 _Рейтинг обновился, места пересчитаны_\n\n" + message
+    
+    await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+@track('handler')
+async def render_rating(period, page=0):
+    """Формирование страницы рейтинга: текст, кнопки перелистывания и версия данных"""
+    period_name = f"за {period_title(resolve_period(period))}"
+    
+    leaderboard = await db.get_leaderboard_page(period=period, page=page)
+    
+    if not leaderboard.rows:
+        return (
+            f"📊 *Рейтинг {period_name}*\n\n"
+            f"Пока нет данных о тренировках 😔"
+        ), None, leaderboard.version
     
     message = f"🏆 *Рейтинг {period_name}*\n\n"
     
-    for i, (_, row) in enumerate(df.iterrows(), 1):
-        username = row['telegram_username']
-        nickname = db.get_nickname(username)
-        display_name = nickname if nickname else f"@{username}"
+    # Строки уже отсортированы по дистанции, равные дистанции делят место
+    for row in leaderboard.rows:
+        display_name = row.nickname[:64] if row.nickname else f"@{row.telegram_username}"
         
-        if i <= 3:
-            medal = MEDALS[i-1] + " "
+        if row.rank <= 3:
+            medal = MEDALS[row.rank-1] + " "
         else:
-            medal = f"{i}. "
+            medal = f"{row.rank}. "
         
-        total_km = row['общая_дистанция']
-        total_minutes = row['общее_время']
+        total_km = row.distance
+        total_minutes = row.duration
         avg_pace = total_minutes / total_km if total_km > 0 else 0
         
         message += (
@@ -172,15 +259,34 @@ async def show_rating(query, period):
             f"🏃 {format_time(avg_pace)} мин/км\n\n"
         )
     
-    await query.edit_message_text(message, parse_mode='Markdown')
+    reply_markup = None
+    if leaderboard.pages > 1:
+        message += f"Страница {leaderboard.page + 1} из {leaderboard.pages} (участников: {leaderboard.total})"
+        buttons = []
+        if leaderboard.page > 0:
+            buttons.append(InlineKeyboardButton(
+                "⬅️ Назад", callback_data=f'rating_{period}:{leaderboard.page - 1}:{leaderboard.version}'
+            ))
+        if leaderboard.page < leaderboard.pages - 1:
+            buttons.append(InlineKeyboardButton(
+                "Вперед ➡️", callback_data=f'rating_{period}:{leaderboard.page + 1}:{leaderboard.version}'
+            ))
+        reply_markup = InlineKeyboardMarkup([buttons])
+    
+    return message, reply_markup, leaderboard.version
 
+@track('handler')
 async def show_my_stats_menu(query):
     """Меню личной статистики"""
     keyboard = [
-        [InlineKeyboardButton("Текущий месяц", callback_data='stats_month')],
-        [InlineKeyboardButton("Прошлый месяц", callback_data='stats_last_month')],
-        [InlineKeyboardButton("Текущий квартал", callback_data='stats_quarter')],
-        [InlineKeyboardButton("Прошлый квартал", callback_data='stats_last_quarter')],
+        [InlineKeyboardButton("Текущая неделя", callback_data='stats_week'),
+         InlineKeyboardButton("Прошлая неделя", callback_data='stats_last_week')],
+        [InlineKeyboardButton("Текущий месяц", callback_data='stats_month'),
+         InlineKeyboardButton("Прошлый месяц", callback_data='stats_last_month')],
+        [InlineKeyboardButton("Текущий квартал", callback_data='stats_quarter'),
+         InlineKeyboardButton("Прошлый квартал", callback_data='stats_last_quarter')],
+        [InlineKeyboardButton("Текущий год", callback_data='stats_year'),
+         InlineKeyboardButton("Прошлый год", callback_data='stats_last_year')],
         [InlineKeyboardButton("За все время", callback_data='stats_all')],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -191,46 +297,150 @@ async def show_my_stats_menu(query):
         parse_mode='Markdown'
     )
 
+@track('handler')
 async def show_personal_stats(query, period):
     """Показ личной статистики"""
     username = query.from_user.username or str(query.from_user.id)
-    nickname = db.get_nickname(username)
+    nickname = await db.get_nickname(username)
     display_name = nickname if nickname else f"@{username}"
     
-    period_names = {
-        'month': 'текущий месяц',
-        'last_month': 'прошлый месяц',
-        'quarter': 'текущий квартал',
-        'last_quarter': 'прошлый квартал',
-        'all': 'все время'
-    }
+    period_name = period_title(resolve_period(period))
+    stats = await db.get_statistics(period=period, username=username)
     
-    df = db.get_statistics(period=period, username=username)
-    
-    if df.empty or df.iloc[0]['тренировки'] == 0:
+    if stats.workouts == 0:
         await query.edit_message_text(
-            f"📊 *Отчет по {display_name} за {period_names[period]}*\n\n"
+            f"📊 *Отчет по {display_name} за {period_name}*\n\n"
             f"Нет данных о тренировках за этот период 😔",
             parse_mode='Markdown'
         )
         return
     
-    data = df.iloc[0]
-    
     message = (
-        f"📊 *Отчет по {display_name} за {period_names[period]}*\n\n"
-        f"1️⃣ *Количество тренировок:* {int(data['тренировки'])} тренировок\n"
-        f"2️⃣ *Суммарная дистанция:* {data['дистанция']:.1f} км\n"
-        f"3️⃣ *Средняя дистанция:* {data['средняя_дистанция']:.1f} км\n"
-        f"4️⃣ *Длительность тренировок:* {format_duration(data['время_минуты'])}\n"
+        f"📊 *Отчет по {display_name} за {period_name}*\n\n"
+        f"1️⃣ *Количество тренировок:* {stats.workouts} тренировок\n"
+        f"2️⃣ *Суммарная дистанция:* {stats.distance:.1f} км\n"
+        f"3️⃣ *Средняя дистанция:* {stats.avg_distance:.1f} км\n"
+        f"4️⃣ *Длительность тренировок:* {format_duration(stats.duration)}\n"
     )
     
-    if data['дистанция'] > 0:
-        avg_pace = data['время_минуты'] / data['дистанция']
-        message += f"5️⃣ *Средняя скорость:* {format_time(avg_pace)} мин/км"
+    if stats.distance > 0:
+        avg_pace = stats.duration / stats.distance
+        message += f"5️⃣ *Средняя скорость:* {format_time(avg_pace)} мин/км\n"
+    
+    rank = await db.get_rank(period, username)
+    if rank:
+        message += f"6️⃣ *Место в клубе:* {rank.rank} из {rank.total} (топ {rank.top_percent}%)\n"
+        if rank.gap is None:
+            message += "   🏆 Лучший результат в клубе!"
+        else:
+            message += f"   До следующего места: {rank.gap:.1f} км"
+    
+    keyboard = [[InlineKeyboardButton("📈 Подробный отчет", callback_data=f'report_{period}'),
+                 InlineKeyboardButton("🖼 Графики", callback_data=f'chart_{period}')]]
+    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+@track('handler')
+async def show_personal_report(query, period):
+    """Подробный отчет: ряды дистанции, серии, темп, рекорды и сравнение с прошлым периодом"""
+    username = query.from_user.username or str(query.from_user.id)
+    nickname = await db.get_nickname(username)
+    display_name = nickname if nickname else f"@{username}"
+    
+    report = await db.get_personal_report(period, username)
+    resolved = resolve_period(period)
+    title = f"📈 *Подробный отчет {display_name} за {period_title(resolved)}*\n\n"
+    if report is None:
+        await query.edit_message_text(title + "Нет данных о тренировках за этот период", parse_mode='Markdown')
+        return
+    
+    weekly = [distance for _, distance in report.weekly]
+    monthly = [distance for _, distance in report.monthly]
+    message = title + (
+        f"*По неделям:* {format_sparkline(weekly)} {weekly[-1]:.1f} км за неделю с {report.weekly[-1][0]:%d.%m}\n"
+        f"*По месяцам:* {format_sparkline(monthly)} {monthly[-1]:.1f} км за {report.monthly[-1][0]:%m.%Y}\n"
+        f"*Серия дней подряд:* сейчас {report.current_streak}, лучшая за период {report.longest_streak}\n"
+    )
+    
+    if report.pace_percentiles:
+        fast, median, slow = report.pace_percentiles
+        message += (
+            f"*Темп:* медиана {format_time(median)} мин/км, "
+            f"быстрее {format_time(fast)} - 10% тренировок, медленнее {format_time(slow)} - 10%\n"
+        )
+    
+    if report.bests:
+        message += "\n🏅 *Лучший темп по дистанциям:*\n"
+        for best in report.bests:
+            message += f"   {best.band}: {format_time(best.pace)} мин/км ({best.distance:.2f} км, {best.date:%d.%m.%Y})\n"
+    
+    if report.previous is not None:
+        change = report.totals.distance - report.previous.distance
+        # Текущий период сравнивается с тем же сроком от начала прошлого
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        same_time = " за тот же срок" if resolved.start <= now < resolved.end else ""
+        message += (
+            f"\n*По сравнению с прошлым периодом{same_time}:* {change:+.1f} км"
+            + (f" ({change / report.previous.distance:+.0%})" if report.previous.distance else "")
+            + f", тренировок {report.totals.workouts - report.previous.workouts:+d}\n"
+        )
     
     await query.edit_message_text(message, parse_mode='Markdown')
 
+@track('handler', profile=True)
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Графики прогресса и рейтинга: /график [период, по умолчанию текущий год]"""
+    args = update.message.text.split()[1:]
+    period = args[0].lower() if args else 'year'
+    try:
+        resolve_period(period)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ *Неизвестный период!*\n"
+            "*Примеры:* `month`, `2025`, `2025-03`, `2025-q1`, `2025-03-01..2025-03-15`",
+            parse_mode='Markdown'
+        )
+        return
+    await send_charts(update.message, update.message.from_user, period)
+
+@track('handler')
+async def send_charts(message, user, period):
+    """Отправка графиков за период: дистанция по неделям, темп и рейтинг клуба"""
+    username = user.username or str(user.id)
+    nickname = await db.get_nickname(username)
+    display_name = nickname[:32] if nickname else f"@{username}"
+    title = period_title(resolve_period(period))
+    bounds = get_period_bounds(period)
+    
+    # (вид, владелец графика, заголовок, данные); рейтинг общий для всех
+    requests = []
+    progress = await db.get_progress_series(period, username)
+    if progress is not None:
+        requests.append(('weekly', username, f"{display_name}: км по неделям", progress.weekly))
+        if progress.paces:
+            requests.append(('pace', username, f"{display_name}: темп за {title}", progress.paces))
+    leaderboard = await db.get_leaderboard_page(period, 0, config.CHART_TOP)
+    if leaderboard.rows:
+        rows = [
+            (row.nickname[:32] if row.nickname else f"@{row.telegram_username}", row.distance)
+            for row in leaderboard.rows
+        ]
+        requests.append(('leaderboard', None, f"Рейтинг клуба за {title}", rows))
+    
+    if not requests:
+        await message.reply_text(f"📊 Нет данных о тренировках за {title} 😔")
+        return
+    
+    rendered = await asyncio.gather(*(
+        charts.render(kind, owner, bounds, chart_title, data) for kind, owner, chart_title, data in requests
+    ))
+    if len(rendered) == 1:
+        sent = [await message.reply_photo(rendered[0][1])]
+    else:
+        sent = await message.reply_media_group([InputMediaPhoto(photo) for _, photo in rendered])
+    for (key, _), sent_message in zip(rendered, sent):
+        charts.remember_file_id(key, sent_message.photo[-1].file_id)
+
+@track('handler', profile=True)
 async def choose_nick_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало выбора никнейма"""
     await update.message.reply_text(
@@ -241,12 +451,13 @@ async def choose_nick_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return WAITING_NICKNAME
 
+@track('handler', profile=True)
 async def handle_nickname_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка ввода никнейма"""
     nickname = update.message.text
     username = update.message.from_user.username or str(update.message.from_user.id)
     
-    db.add_nickname(username, nickname)
+    await db.add_nickname(username, nickname)
     
     await update.message.reply_text(
         f"✅ *Никнейм установлен!*\n"
@@ -257,8 +468,9 @@ async def handle_nickname_input(update: Update, context: ContextTypes.DEFAULT_TY
     
     return ConversationHandler.END
 
+@track('handler', profile=True)
 async def export_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Экспорт базы данных в Excel"""
+    """Экспорт базы данных: /database [xlsx|csv|csv.gz] [с YYYY-MM-DD] [по YYYY-MM-DD] или [период]"""
     user_id = update.message.from_user.id
     
     # Проверка прав администратора
@@ -267,12 +479,26 @@ async def export_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        filename = db.export_to_excel()
+        fmt, start, end = parse_export_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(
+            "❌ *Неверные параметры!*\n"
+            "*Формат:* `/database [xlsx|csv|csv.gz] [с YYYY-MM-DD] [по YYYY-MM-DD]` или `/database [формат] [период]`\n"
+            "*Примеры:* `/database csv 2025-01-01 2025-03-31`, `/database csv 2025-q1`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    filename = None
+    try:
+        # Выгрузка идет в пуле потоков базы данных во временный файл
+        filename = await db.export(fmt, start, end)
         
         with open(filename, 'rb') as file:
             await update.message.reply_document(
                 document=file,
-                caption="📁 *База данных экспортирована в Excel*",
+                filename=f"running_club_{datetime.now():%Y%m%d_%H%M}.{fmt}",
+                caption=f"📁 *База данных экспортирована* ({fmt})",
                 parse_mode='Markdown'
             )
     except Exception as e:
@@ -281,36 +507,265 @@ async def export_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"❌ *Ошибка экспорта:* {str(e)}",
             parse_mode='Markdown'
         )
+    finally:
+        if filename:
+            os.remove(filename)
+
+@track('handler', profile=True)
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начало импорта тренировок из файла: /import"""
+    user_id = update.message.from_user.id
+    
+    # Свои тренировки могут загружать все, если это разрешено настройкой
+    if user_id not in config.ADMIN_IDS and not config.IMPORT_SELF_SERVICE:
+        await update.message.reply_text("❌ *Доступ запрещен*", parse_mode='Markdown')
+        return ConversationHandler.END
+    
+    if user_id in context.application.bot_data.setdefault('imports', set()):
+        await update.message.reply_text("⏳ *Предыдущий импорт еще не закончен*", parse_mode='Markdown')
+        return ConversationHandler.END
+    
+    columns = "`record_date, distance, duration`"
+    if user_id in config.ADMIN_IDS:
+        columns += " и необязательный `telegram_username`"
+    await update.message.reply_text(
+        "📥 *Отправьте файл с тренировками:*\n"
+        f"• CSV со столбцами {columns} (как в выгрузке /database)\n"
+        "• GPX или TCX с тренировки\n"
+        "• zip-архив с такими файлами\n\n"
+        f"*Максимальный размер:* {config.IMPORT_MAX_FILE_MB} МБ\n"
+        "⏰ *У вас есть 2 минуты на отправку*",
+        parse_mode='Markdown'
+    )
+    return WAITING_IMPORT
 
+@track('handler', profile=True)
+async def handle_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Загрузка файла импорта и запуск фоновой записи"""
+    document = update.message.document
+    user_id = update.message.from_user.id
+    username = update.message.from_user.username or str(user_id)
+    
+    if document.file_size and document.file_size > config.IMPORT_MAX_FILE_MB * 1024 * 1024:
+        await update.message.reply_text(
+            f"❌ *Файл больше {config.IMPORT_MAX_FILE_MB} МБ*",
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
+    
+    name = document.file_name or 'import.csv'
+    fd, path = tempfile.mkstemp(suffix='_' + os.path.basename(name))
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+    except Exception as e:
+        os.remove(path)
+        logger.error(f"Import download error: {e}")
+        await update.message.reply_text(f"❌ *Ошибка загрузки файла:* {str(e)}", parse_mode='Markdown')
+        return ConversationHandler.END
+    
+    progress = await update.message.reply_text("⏳ *Импорт начат...*", parse_mode='Markdown')
+    
+    # Запись идет в фоне, бот тем временем обрабатывает другие обновления
+    workout_import = WorkoutImport(path, name, username, allow_usernames=user_id in config.ADMIN_IDS)
+    imports = context.application.bot_data.setdefault('imports', set())
+    imports.add(user_id)
+    task = context.application.create_task(run_import(workout_import, progress))
+    task.add_done_callback(lambda _: imports.discard(user_id))
+    return ConversationHandler.END
+
+async def run_import(workout_import, progress):
+    """Фоновый импорт: разбор файла и запись пачками с сообщениями о ходе"""
+    batches = workout_import.batches()
+    last_update = time.monotonic()
+    failure = None
+    try:
+        while True:
+            # Разбор очередной пачки тоже идет в пуле потоков базы данных
+            batch = await db.run(next, batches, None)
+            if batch is None:
+                break
+            added, duplicates = await db.import_workouts(batch)
+            workout_import.added += added
+            workout_import.duplicates += duplicates
+            
+            if time.monotonic() - last_update >= IMPORT_PROGRESS_INTERVAL:
+                last_update = time.monotonic()
+                await progress.edit_text(
+                    f"⏳ *Импорт...* прочитано {workout_import.read}, добавлено {workout_import.added}",
+                    parse_mode='Markdown'
+                )
+    except Exception as e:
+        logger.error(f"Import error in {workout_import.name}: {e}")
+        failure = e
+    finally:
+        batches.close()
+        os.remove(workout_import.path)
+    
+    logger.info(
+        f"Import of {workout_import.name} by {workout_import.username}: read {workout_import.read}, "
+        f"added {workout_import.added}, duplicates {workout_import.duplicates}, errors {workout_import.errors}"
+    )
+    
+    message = "❌ *Импорт прерван*\n" if failure else "✅ *Импорт завершен*\n"
+    message += (
+        f"*Прочитано:* {workout_import.read}\n"
+        f"*Добавлено:* {workout_import.added}\n"
+        f"*Уже были в базе:* {workout_import.duplicates}\n"
+        f"*С ошибками:* {workout_import.errors}"
+    )
+    # Текст ошибок не экранируется для Markdown, поэтому отправляется без разметки
+    details = [str(failure)] if failure else []
+    details += workout_import.error_samples
+    await progress.edit_text(message, parse_mode='Markdown')
+    if details:
+        await progress.reply_text('\n'.join(details)[:4000])
+
+def parse_export_args(args):
+    """Разбор формата и периода экспорта: две даты (окончание включительно), одна дата или ключ периода"""
+    fmt = 'xlsx'
+    if args and args[0].lower() in EXPORT_FORMATS:
+        fmt = args[0].lower()
+        args = args[1:]
+    
+    if len(args) > 2:
+        raise ValueError("Слишком много параметров")
+    
+    if not args:
+        return fmt, None, None
+    if len(args) == 2:
+        return (fmt,) + get_period_bounds(f"{args[0]}..{args[1]}")
+    
+    # Одна дата - выгрузка с этого дня, иначе ключ периода (2025, 2025-q1, last_month...)
+    try:
+        start = datetime.strptime(args[0], '%Y-%m-%d')
+    except ValueError:
+        return (fmt,) + get_period_bounds(args[0].lower())
+    return fmt, start.strftime('%Y-%m-%d %H:%M:%S'), None
+
+@track('handler', profile=True)
 async def restore_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Восстановление из резервной копии"""
+    """Список резервных копий для восстановления"""
     user_id = update.message.from_user.id
     
     if user_id not in config.ADMIN_IDS:
         await update.message.reply_text("❌ *Доступ запрещен*", parse_mode='Markdown')
         return
     
-    keyboard = [[
-        InlineKeyboardButton("✅ Да", callback_data='restore_confirm'),
-        InlineKeyboardButton("❌ Нет", callback_data='restore_cancel')
-    ]]
+    # /backup YYYY-MM-DD HH:MM - восстановление на момент времени
+    if context.args:
+        try:
+            until = datetime.strptime(' '.join(context.args), '%Y-%m-%d %H:%M')
+        except ValueError:
+            await update.message.reply_text(
+                "❌ *Неверный формат времени!*\n"
+                "*Пример:* `/backup 2025-01-31 18:30` (UTC)",
+                parse_mode='Markdown'
+            )
+            return
+        
+        keyboard = [[
+            InlineKeyboardButton("✅ Да", callback_data=f'restore_until_{until:%Y%m%d%H%M}'),
+            InlineKeyboardButton("❌ Нет", callback_data='restore_cancel')
+        ]]
+        await update.message.reply_text(
+            f"⚠️ *Вы точно уверены, что хотите восстановить данные на {until:%d.%m.%Y %H:%M} UTC?*\n"
+            "*Текущая база данных будет удалена и заменена backup!*",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        return
+    
+    backups = await db.list_backups()
+    
+    # Имя файла может не поместиться в 64 байта callback_data, поэтому
+    # копия передается коротким ключом из цифр ее времени
+    keyboard = [
+        [InlineKeyboardButton(f"📦 {format_backup_name(name)}", callback_data=f'restore_select_{backup_key(name)}')]
+        for name in backups[:10]
+    ]
+    keyboard.append([InlineKeyboardButton("💾 Создать копию сейчас", callback_data='restore_create')])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await update.message.reply_text(
-        "⚠️ *Вы точно уверены, что хотите восстановить данные?*\n"
-        "*Текущая база данных будет удалена и заменена backup!*",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    if backups:
+        text = (
+            "🗄 *Резервные копии*\nВыберите копию для восстановления:\n\n"
+            "Восстановить на любой момент: `/backup YYYY-MM-DD HH:MM` (UTC)"
+        )
+    else:
+        text = "🗄 *Резервных копий пока нет*"
+    
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+def format_backup_name(name):
+    """Дата резервной копии из имени файла"""
+    try:
+        return backup_time(name).strftime('%d.%m.%Y %H:%M:%S UTC')
+    except ValueError:
+        return name
 
+@track('handler', profile=True)
 async def restore_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Подтверждение восстановления"""
+    """Создание копии, выбор копии и подтверждение восстановления"""
     query = update.callback_query
     await query.answer()
     
-    if query.data == 'restore_confirm':
+    if query.from_user.id not in config.ADMIN_IDS:
+        await query.edit_message_text("❌ *Доступ запрещен*", parse_mode='Markdown')
+        return
+    
+    if query.data == 'restore_create':
+        try:
+            name = await db.backup_database()
+            await query.edit_message_text(
+                f"✅ *Резервная копия создана:* {format_backup_name(name)}",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.error(f"Backup error: {e}")
+            await query.edit_message_text(
+                f"❌ *Ошибка резервного копирования:* {str(e)}",
+                parse_mode='Markdown'
+            )
+    elif query.data.startswith('restore_select_'):
+        key = query.data[len('restore_select_'):]
+        name = await db.find_backup(key)
+        if name is None:
+            await query.edit_message_text("❌ *Резервная копия не найдена*", parse_mode='Markdown')
+            return
+        keyboard = [[
+            InlineKeyboardButton("✅ Да", callback_data=f'restore_confirm_{key}'),
+            InlineKeyboardButton("❌ Нет", callback_data='restore_cancel')
+        ]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.edit_message_text(
+            f"⚠️ *Вы точно уверены, что хотите восстановить данные на {format_backup_name(name)}?*\n"
+            "*Текущая база данных будет удалена и заменена backup!*",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    elif query.data.startswith('restore_until_'):
+        until = datetime.strptime(query.data[len('restore_until_'):], '%Y%m%d%H%M').replace(tzinfo=timezone.utc)
         try:
-            db.restore_from_backup()
+            await db.restore_from_backup(until=until)
+            await query.edit_message_text(
+                f"✅ *База данных восстановлена на {until:%d.%m.%Y %H:%M} UTC!*",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            await query.edit_message_text(
+                f"❌ *Ошибка восстановления:* {str(e)}",
+                parse_mode='Markdown'
+            )
+    elif query.data.startswith('restore_confirm_'):
+        name = await db.find_backup(query.data[len('restore_confirm_'):])
+        if name is None:
+            await query.edit_message_text("❌ *Резервная копия не найдена*", parse_mode='Markdown')
+            return
+        try:
+            await db.restore_from_backup(name)
             await query.edit_message_text(
                 "✅ *База данных успешно восстановлена из backup!*",
                 parse_mode='Markdown'
@@ -326,6 +781,300 @@ async def restore_confirmation(update: Update, context: ContextTypes.DEFAULT_TYP
             parse_mode='Markdown'
         )
 
+@track('handler')
+async def scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
+    """Ежедневное резервное копирование баз всех клубов"""
+    # Копии делаются по файлам, без открытия баз клубов в реестре
+    for tenant in tenants.tenants():
+        try:
+            name = await asyncio.to_thread(BackupManager(*tenant_paths(tenant)).create_backup)
+            logger.info(f"Scheduled backup completed successfully: {name}")
+        except Exception as e:
+            logger.error(f"Backup error for tenant {tenant}: {e}")
+
+@track('handler')
+async def scheduled_delta(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая выгрузка изменений между полными копиями"""
+    for tenant in tenants.tenants():
+        try:
+            await asyncio.to_thread(BackupManager(*tenant_paths(tenant)).ship_delta)
+        except Exception as e:
+            logger.error(f"Delta backup error for tenant {tenant}: {e}")
+
+@track('handler')
+async def scheduled_archive(context: ContextTypes.DEFAULT_TYPE):
+    """Ежедневный перенос тренировок старых лет в годовые архивы"""
+    # Переносятся только целые годы, поэтому работа есть раз в год, в остальные дни - один запрос
+    for tenant in tenants.tenants():
+        with tenants.use(tenant):
+            try:
+                moved = await db.archive_workouts()
+            except Exception as e:
+                logger.error(f"Archive error for tenant {tenant}: {e}")
+                continue
+        if moved:
+            logger.info(f"Workouts archived (tenant {tenant}): {moved}")
+
+async def route_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выбор базы клуба по чату и запоминание участника для рассылки итогов"""
+    # Выбранный клуб действует до конца обработки обновления,
+    # включая запущенные из обработчиков фоновые задачи
+    current_tenant.set(tenant_for_chat(update.effective_chat))
+    user = update.effective_user
+    if user is None:
+        return
+    try:
+        # Личный чат с участником имеет тот же id, что и сам участник
+        await db.remember_member(user.username or str(user.id), user.id)
+    except Exception as e:
+        logger.error(f"Member registration error: {e}")
+
+@track('handler', profile=True)
+async def toggle_summaries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подписка на итоги месяца и квартала клуба: /итоги [вкл|выкл]"""
+    args = update.message.text.split()[1:]
+    notify = not (args and args[0].lower() in ('выкл', 'off', 'нет'))
+    user = update.message.from_user
+    await db.set_notify(user.username or str(user.id), user.id, notify)
+    if notify:
+        await update.message.reply_text(
+            "🔔 *Итоги месяца и квартала будут приходить в личные сообщения*\n"
+            "Отключить: `/итоги выкл`",
+            parse_mode='Markdown'
+        )
+    else:
+        await update.message.reply_text("🔕 *Рассылка итогов отключена*", parse_mode='Markdown')
+
+def render_summary_leaderboard(leaderboard):
+    """Итоговый рейтинг периода для рассылки, общий для всех участников"""
+    if not leaderboard.rows:
+        return ""
+    message = f"🏆 *Итоговый рейтинг* (участников: {leaderboard.total})\n"
+    for row in leaderboard.rows:
+        display_name = escape_markdown(row.nickname[:64] if row.nickname else f"@{row.telegram_username}")
+        medal = MEDALS[row.rank-1] if row.rank <= 3 else f"{row.rank}."
+        message += f"{medal} {display_name} - {row.distance:.1f} км\n"
+    return message
+
+def render_period_summary(period, summary, leaderboard_text):
+    """Итоги закончившегося периода для участника: личные итоги и итоговый рейтинг"""
+    display_name = escape_markdown(summary.nickname[:64] if summary.nickname else f"@{summary.telegram_username}")
+    message = f"🏁 *Итоги за {period_title(period)}*\n\n👤 *{display_name}*\n"
+    
+    if summary.workouts:
+        message += (
+            f"Тренировок: {summary.workouts}, {summary.distance:.1f} км, {format_duration(summary.duration)}\n"
+            f"Средний темп: {format_time(summary.duration / summary.distance)} мин/км\n"
+            f"Место в клубе: {summary.rank} из {summary.total}\n"
+        )
+        if summary.previous_distance:
+            change = summary.distance - summary.previous_distance
+            message += f"По сравнению с прошлым периодом: {change:+.1f} км ({change / summary.previous_distance:+.0%})\n"
+    else:
+        message += "Тренировок за этот период не было 😔\n"
+    
+    if leaderboard_text:
+        message += "\n" + leaderboard_text
+    return message
+
+async def prepare_period_summaries(period):
+    """Постановка итогов периода в очередь исходящих.
+    
+    Итоги всех участников считаются одним запросом, рейтинг - еще одним.
+    Возвращает число сообщений или None, если рассылка уже подготовлена.
+    """
+    # Явный ключ: в тексте "сентябрь 2025" вместо "прошлый месяц"
+    period = resolve_period(explicit_key(period))
+    key = f"{period.kind}:{period.key}"
+    if await db.has_broadcast(key):
+        return None
+    summaries = await db.get_period_summaries(period.key)
+    leaderboard = await db.get_leaderboard_page(period.key, 0, config.SUMMARY_TOP)
+    leaderboard_text = render_summary_leaderboard(leaderboard)
+    messages = [
+        (summary.chat_id, render_period_summary(period, summary, leaderboard_text))
+        for summary in summaries
+    ]
+    return await db.prepare_broadcast(key, messages)
+
+@track('handler')
+async def scheduled_summaries(context: ContextTypes.DEFAULT_TYPE):
+    """Подготовка рассылки итогов закончившихся месяца и квартала.
+    
+    Задача запускается ежедневно и при старте бота: рассылка каждого
+    периода ставится в очередь один раз, поэтому пропущенный из-за
+    остановки бота запуск наверстывается в течение SUMMARY_CATCHUP_DAYS.
+    """
+    now = datetime.now(timezone.utc)
+    for tenant in tenants.tenants():
+        with tenants.use(tenant):
+            for key in SUMMARY_PERIODS:
+                period = resolve_period(key, now)
+                if now.replace(tzinfo=None) - period.end > timedelta(days=config.SUMMARY_CATCHUP_DAYS):
+                    continue
+                try:
+                    count = await prepare_period_summaries(period)
+                except Exception as e:
+                    logger.error(f"Summary preparation error for {key} (tenant {tenant}): {e}")
+                    continue
+                if count is not None:
+                    logger.info(f"Summaries for {explicit_key(period)} (tenant {tenant}) queued: {count} messages")
+            
+            try:
+                await db.prune_outbox()
+                # После перезапуска продолжается и недоотправленная рассылка
+                if await db.has_pending_messages():
+                    OUTBOX_TENANTS[tenant] = None
+            except Exception as e:
+                logger.error(f"Outbox cleanup error (tenant {tenant}): {e}")
+
+@track('handler')
+async def dispatch_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Отправка очереди исходящих не быстрее OUTBOX_RATE сообщений в секунду.
+    
+    Результат каждого сообщения сразу записывается в базу, поэтому после
+    падения бота отправка продолжается с первого неотправленного сообщения.
+    Ошибки сети повторяются с удваивающейся паузой, при ограничении
+    Telegram (RetryAfter) отправка приостанавливается на указанное время.
+    Очереди клубов обходятся по кругу с общим ограничением скорости.
+    """
+    if time.monotonic() < context.bot_data.get('outbox_paused_until', 0):
+        return
+    
+    # Запуск укладывается в свой интервал, чтобы не пересекаться со следующим
+    deadline = time.monotonic() + config.OUTBOX_INTERVAL * 0.9
+    budget = max(int(config.OUTBOX_RATE * config.OUTBOX_INTERVAL), 1)
+    for tenant in list(OUTBOX_TENANTS):
+        if budget <= 0 or time.monotonic() >= deadline:
+            break
+        # Обойденный клуб уходит в конец круга
+        del OUTBOX_TENANTS[tenant]
+        with tenants.use(tenant):
+            messages = await db.get_due_messages(budget)
+            if messages or await db.has_pending_messages():
+                OUTBOX_TENANTS[tenant] = None
+            budget -= len(messages)
+            if not await send_outbox(context, messages, deadline):
+                break
+
+async def send_outbox(context, messages, deadline):
+    """Отправка сообщений очереди клуба, False - если отправку нужно прервать"""
+    for message in messages:
+        started = time.monotonic()
+        if started >= deadline:
+            return False
+        try:
+            await context.bot.send_message(message.chat_id, message.text, parse_mode='Markdown')
+        except RetryAfter as e:
+            context.bot_data['outbox_paused_until'] = time.monotonic() + e.retry_after
+            await db.update_message(message.id, 'pending', str(e), delay=e.retry_after, attempt=False)
+            OUTBOX_STATS['retried'] += 1
+            logger.warning(f"Outbox paused for {e.retry_after} s by flood control")
+            return False
+        except Forbidden as e:
+            # Участник заблокировал бота: больше ему не пишем
+            await db.update_message(message.id, 'failed', str(e))
+            await db.unsubscribe_chat(message.chat_id)
+            OUTBOX_STATS['failed'] += 1
+        except BadRequest as e:
+            await db.update_message(message.id, 'failed', str(e))
+            OUTBOX_STATS['failed'] += 1
+            logger.error(f"Outbox message {message.id} rejected: {e}")
+        except NetworkError as e:
+            if message.attempts + 1 >= config.OUTBOX_MAX_ATTEMPTS:
+                await db.update_message(message.id, 'failed', str(e))
+                OUTBOX_STATS['failed'] += 1
+                logger.error(f"Outbox message {message.id} failed after {message.attempts + 1} attempts: {e}")
+            else:
+                await db.update_message(
+                    message.id, 'pending', str(e), delay=config.OUTBOX_BACKOFF * 2 ** message.attempts
+                )
+                OUTBOX_STATS['retried'] += 1
+        else:
+            await db.update_message(message.id, 'sent')
+            OUTBOX_STATS['sent'] += 1
+        
+        # Равномерный темп вместо пачки сообщений в начале интервала
+        await asyncio.sleep(max(1 / config.OUTBOX_RATE - (time.monotonic() - started), 0))
+    return True
+
+@track('handler', profile=True)
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка метрик с момента запуска: /metrics"""
+    if update.message.from_user.id not in config.ADMIN_IDS:
+        await update.message.reply_text("❌ *Доступ запрещен*", parse_mode='Markdown')
+        return
+    
+    message = "📈 *Метрики с момента запуска*\n"
+    for kind, title in (('handler', 'Обработчики'), ('db_query', 'Запросы к базе')):
+        rows = metrics.summary(kind)[:10]
+        message += f"\n*{title}:*\n"
+        if not rows:
+            message += "нет данных\n"
+        for name, count, errors, p50, p95, slowest in rows:
+            message += (
+                f"`{name}` {count} выз., ошибок {errors / count:.1%}\n"
+                f"   p50 {p50 * 1000:.1f} мс | p95 {p95 * 1000:.1f} мс | max {slowest * 1000:.1f} мс\n"
+            )
+    
+    cache = db.report_cache.stats()
+    lookups = cache['hits'] + cache['misses']
+    if lookups:
+        message += f"\n*Кэш отчетов:* попаданий {cache['hits'] / lookups:.0%}, записей {cache['size']}"
+    
+    await update.message.reply_text(message, parse_mode='Markdown')
+
+def collect_runtime_metrics():
+    """Состояние кэшей, очередей записи, баз клубов, обработки обновлений и рассылок для /metrics"""
+    handles = tenants.open_handles()
+    caches = [handle.report_cache.stats() for handle in handles]
+    chart_cache = charts.stats()
+    tenant_stats = tenants.stats()
+    states = [handle.db.state.stats() for handle in handles if handle.db.state is not None]
+    update_stats = updates.stats()
+    return [
+        ('bot_report_cache_entries', {}, sum(cache['size'] for cache in caches)),
+        ('bot_report_cache_hits_total', {}, sum(cache['hits'] for cache in caches)),
+        ('bot_report_cache_misses_total', {}, sum(cache['misses'] for cache in caches)),
+        ('bot_write_queue_depth', {}, sum(handle.write_queue.qsize() for handle in handles if handle.write_queue)),
+        ('bot_tenants_open', {}, tenant_stats['open']),
+        ('bot_tenants_opened_total', {}, tenant_stats['opened']),
+        ('bot_tenants_evicted_total', {}, tenant_stats['evicted']),
+        ('bot_memory_state_rows', {}, sum(state['rows'] for state in states)),
+        ('bot_memory_state_bytes', {}, sum(state['bytes'] for state in states)),
+        ('bot_chart_cache_entries', {}, chart_cache['size']),
+        ('bot_chart_cache_hits_total', {}, chart_cache['hits']),
+        ('bot_chart_renders_total', {}, chart_cache['rendered']),
+        ('bot_update_concurrency', {}, config.UPDATE_CONCURRENCY),
+        ('bot_updates_queued', {}, update_stats['queued']),
+        ('bot_updates_waiting', {}, update_stats['waiting']),
+        ('bot_updates_running', {}, update_stats['running']),
+        ('bot_update_keys_busy', {}, update_stats['keys']),
+        ('bot_updates_processed_total', {}, update_stats['processed']),
+    ] + [
+        ('bot_outbox_messages_total', {'status': status}, count) for status, count in OUTBOX_STATS.items()
+    ]
+
+async def post_init(application: Application):
+    """Запуск сервера метрик, профайлера медленных обновлений и загрузка базы в память"""
+    metrics.add_collector(collect_runtime_metrics)
+    if config.METRICS_PORT:
+        application.bot_data['metrics_server'] = await serve_metrics(config.METRICS_PORT)
+    profiler.start()
+    # Основная база загружается в память при запуске, базы клубов - при первом запросе
+    await db.warm_up()
+
+async def shutdown(application: Application):
+    """Завершение работы с базой данных при остановке бота"""
+    server = application.bot_data.pop('metrics_server', None)
+    if server:
+        server.close()
+        await server.wait_closed()
+    profiler.stop()
+    charts.close()
+    await tenants.close()
+
+@track('handler', profile=True)
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена операции"""
     await update.message.reply_text(
@@ -334,18 +1083,35 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
-def main():
-    """Запуск бота"""
-    # Создание приложения
-    application = Application.builder().token(config.TOKEN).build()
+def command_filter(name):
+    """Фильтр команды с кириллическим именем.
+
+    CommandHandler принимает только латинские имена команд,
+    поэтому такие команды распознаются по тексту сообщения.
+    """
+    return filters.Regex(rf'^/{name}(@\w+)?(\s|$)')
+
+def build_application(token=None, base_url=None):
+    """Создание приложения со всеми обработчиками и задачами"""
+    builder = Application.builder().token(token or config.TOKEN).post_init(post_init).post_shutdown(shutdown)
+    if base_url:
+        # Другой сервер Bot API, например локальный для нагрузочных проверок
+        builder = builder.base_url(base_url)
+    if config.UPDATE_CONCURRENCY > 1:
+        # Обновления разных участников обрабатываются одновременно, одного
+        # участника - по порядку; очередь приема сдерживает Updater, пока
+        # принятые обновления не обработаны
+        builder = builder.concurrent_updates(updates).update_queue(updates.queue)
+    application = builder.build()
     
     # ConversationHandler для записи тренировки
     training_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('записать_тренировку', record_training_start)],
+        entry_points=[MessageHandler(command_filter('записать_тренировку'), record_training_start)],
         states={
             WAITING_TRAINING: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_training_input)
             ],
+            ConversationHandler.TIMEOUT: [MessageHandler(filters.ALL, timeout)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
         conversation_timeout=15
@@ -353,35 +1119,106 @@ def main():
     
     # ConversationHandler для выбора никнейма
     nick_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('выбрать_ник', choose_nick_start)],
+        entry_points=[MessageHandler(command_filter('выбрать_ник'), choose_nick_start)],
         states={
             WAITING_NICKNAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_nickname_input)
             ],
+            ConversationHandler.TIMEOUT: [MessageHandler(filters.ALL, timeout)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
         conversation_timeout=15
     )
     
+    # ConversationHandler для импорта тренировок из файла
+    import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler('import', import_start)],
+        states={
+            WAITING_IMPORT: [
+                MessageHandler(filters.Document.ALL, handle_import_file)
+            ],
+            ConversationHandler.TIMEOUT: [MessageHandler(filters.ALL, timeout)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        conversation_timeout=120
+    )
+    
     # Добавление обработчиков
+    # База клуба выбирается до обработки любого обновления
+    application.add_handler(TypeHandler(Update, route_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(training_conv_handler)
     application.add_handler(nick_conv_handler)
-    application.add_handler(CommandHandler("статистика", statistics_menu))
+    application.add_handler(import_conv_handler)
+    application.add_handler(MessageHandler(command_filter('статистика'), statistics_menu))
+    application.add_handler(MessageHandler(command_filter('график'), chart_command))
     application.add_handler(CommandHandler("database", export_database))
     application.add_handler(CommandHandler("backup", restore_backup))
-    application.add_handler(CallbackQueryHandler(button_handler, pattern='^(rating_|my_stats|stats_)'))
+    application.add_handler(CommandHandler("metrics", show_metrics))
+    application.add_handler(MessageHandler(command_filter('итоги'), toggle_summaries))
+    application.add_handler(CallbackQueryHandler(button_handler, pattern='^(rating_|my_stats|stats_|report_|chart_)'))
     application.add_handler(CallbackQueryHandler(restore_confirmation, pattern='^restore_'))
     
-    # Обработка таймаута
-    application.add_handler(MessageHandler(filters.TEXT, timeout), group=1)
+    # Ежедневное резервное копирование в 3:00 MSK (00:00 UTC)
+    backup_hour, backup_minute = map(int, config.BACKUP_TIME.split(':'))
+    application.job_queue.run_daily(
+        scheduled_backup,
+        time=dt_time(backup_hour, backup_minute, tzinfo=timezone.utc),
+        name='backup'
+    )
+    application.job_queue.run_repeating(
+        scheduled_delta,
+        interval=config.DELTA_INTERVAL * 60,
+        name='delta_backup'
+    )
+    
+    # Перенос старых лет в архив
+    archive_hour, archive_minute = map(int, config.ARCHIVE_TIME.split(':'))
+    application.job_queue.run_daily(
+        scheduled_archive,
+        time=dt_time(archive_hour, archive_minute, tzinfo=timezone.utc),
+        name='archive'
+    )
     
-    # Запуск бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Итоги месяца и квартала: подготовка раз в день и сразу после запуска,
+    # отправка очереди исходящих продолжается и после перезапуска
+    summary_hour, summary_minute = map(int, config.SUMMARY_TIME.split(':'))
+    application.job_queue.run_daily(
+        scheduled_summaries,
+        time=dt_time(summary_hour, summary_minute, tzinfo=timezone.utc),
+        name='summaries'
+    )
+    application.job_queue.run_once(scheduled_summaries, when=30, name='summaries_startup')
+    application.job_queue.run_repeating(
+        dispatch_outbox,
+        interval=config.OUTBOX_INTERVAL,
+        name='outbox'
+    )
+    
+    return application
 
-if __name__ == '__main__':
-    # Запуск планировщика резервного копирования
-    from backup import schedule_backup
-    scheduler = schedule_backup()
+def main():
+    """Запуск бота"""
+    application = build_application()
     
+    if config.WEBHOOK_URL:
+        # Telegram сам присылает обновления на встроенный HTTP-сервер,
+        # запросы без секретного заголовка отклоняются
+        secret = config.WEBHOOK_SECRET
+        if not secret:
+            secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET is not set, using a random secret for this run")
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}",
+            secret_token=secret,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+if __name__ == '__main__':
     main()
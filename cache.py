@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+import config
+
+
+class ReportCache:
+    """Кэш статистики и готовых сообщений рейтинга.
+
+    Ключ включает границы периода, поэтому с началом нового месяца
+    или квартала старые записи перестают использоваться. Любая запись
+    в базу сбрасывает кэш целиком. Размер ограничен, при переполнении
+    вытесняются давно не использованные записи.
+
+    Отчет, прочитанный до записи, не должен попасть в кэш после ее сброса,
+    поэтому поколение кэша берется до чтения и передается в put.
+    """
+    def __init__(self, max_size=config.REPORT_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Значение из кэша или None"""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation):
+        """Сохранение значения, прочитанного в поколении generation, с вытеснением старых записей"""
+        # С начала чтения кэш сбрасывался: значение могло устареть
+        if generation != self.generation:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """Сброс кэша после изменения данных"""
+        self.generation += 1
+        self.entries.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
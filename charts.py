@@ -0,0 +1,175 @@
+"""PNG-графики прогресса и рейтинга, отрисовка в пуле процессов с кэшем"""
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+
+import config
+from cache import ReportCache
+
+# Размер изображения: 800x450 точек
+FIGURE_SIZE = (8, 4.5)
+FIGURE_DPI = 100
+
+BAR_COLOR = '#4c8bf5'
+POINT_COLOR = '#9bbcf7'
+TREND_COLOR = '#e8553d'
+
+# Сколько последних тренировок сглаживает линию темпа
+PACE_TREND_WINDOW = 5
+
+
+def new_figure(title):
+    """Фигура с одной областью графика и заголовком"""
+    figure = Figure(figsize=FIGURE_SIZE, dpi=FIGURE_DPI)
+    axes = figure.add_subplot()
+    axes.set_title(title)
+    axes.grid(axis='y', alpha=0.3)
+    return figure, axes
+
+
+def to_png(figure):
+    """Изображение фигуры в PNG"""
+    buffer = io.BytesIO()
+    figure.tight_layout()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def format_pace(value, _=None):
+    """Подпись оси темпа: минуты на км как М:СС"""
+    minutes = int(value)
+    return f"{minutes}:{int(round((value - minutes) * 60)):02d}"
+
+
+def render_weekly(title, weekly):
+    """Столбцы дистанции по неделям: weekly - пары (начало недели, км)"""
+    figure, axes = new_figure(title)
+    labels = [f"{start:%d.%m}" for start, _ in weekly]
+    values = [distance for _, distance in weekly]
+    bars = axes.bar(labels, values, color=BAR_COLOR)
+    axes.bar_label(bars, labels=[f"{value:.0f}" if value else '' for value in values], fontsize=8)
+    axes.set_ylabel('км за неделю')
+    axes.tick_params(axis='x', labelrotation=45, labelsize=8)
+    return to_png(figure)
+
+
+def render_pace(title, paces):
+    """Темп каждой тренировки и скользящая медиана: paces - пары (дата, мин/км)"""
+    figure, axes = new_figure(title)
+    dates = [date for date, _ in paces]
+    values = [pace for _, pace in paces]
+    axes.scatter(dates, values, s=12, color=POINT_COLOR, label='тренировки')
+
+    trend = []
+    for index in range(len(values)):
+        window = sorted(values[max(index - PACE_TREND_WINDOW + 1, 0):index + 1])
+        trend.append(window[len(window) // 2])
+    axes.plot(dates, trend, color=TREND_COLOR, linewidth=2, label=f'медиана {PACE_TREND_WINDOW} последних')
+
+    # Быстрее - выше
+    axes.invert_yaxis()
+    axes.yaxis.set_major_formatter(FuncFormatter(format_pace))
+    axes.set_ylabel('мин/км')
+    axes.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m.%y'))
+    axes.tick_params(axis='x', labelrotation=45, labelsize=8)
+    axes.legend(loc='lower left', fontsize=8)
+    return to_png(figure)
+
+
+def render_leaderboard(title, rows):
+    """Горизонтальные столбцы рейтинга: rows - пары (имя, км) по убыванию дистанции"""
+    figure, axes = new_figure(title)
+    names = [name for name, _ in reversed(rows)]
+    values = [distance for _, distance in reversed(rows)]
+    bars = axes.barh(names, values, color=BAR_COLOR)
+    axes.bar_label(bars, labels=[f"{value:.1f}" for value in values], fontsize=8, padding=2)
+    axes.set_xlabel('км')
+    # Место для подписи самого длинного столбца
+    axes.margins(x=0.1)
+    axes.grid(axis='y', visible=False)
+    axes.grid(axis='x', alpha=0.3)
+    axes.tick_params(axis='y', labelsize=8)
+    return to_png(figure)
+
+
+RENDERERS = {'weekly': render_weekly, 'pace': render_pace, 'leaderboard': render_leaderboard}
+
+
+def render_chart(kind, title, data):
+    """Отрисовка графика вида kind, выполняется в процессе пула"""
+    return RENDERERS[kind](title, data)
+
+
+def data_version(title, data):
+    """Версия данных графика - хэш всего, что попадает на изображение"""
+    return hashlib.sha1(pickle.dumps((title, data))).hexdigest()[:16]
+
+
+class ChartRenderer:
+    """Отрисовка графиков в пуле процессов с кэшем готовых изображений.
+
+    Отрисовка занимает десятки миллисекунд процессора и в цикле событий
+    задерживала бы все остальные обновления. Ключ кэша - вид графика,
+    владелец (None для общих), границы периода и версия данных, поэтому
+    график с теми же данными не перерисовывается. После первой отправки
+    вместо PNG хранится file_id Telegram, и изображение больше не загружается.
+    """
+    def __init__(self, workers=config.CHART_WORKERS, cache_size=config.CHART_CACHE_SIZE):
+        self.workers = workers
+        self.executor = None
+        self.cache = ReportCache(cache_size)
+        # Одновременные запросы одного графика ждут одну отрисовку
+        self.pending = {}
+        self.rendered = 0
+
+    def start(self):
+        """Запуск пула процессов"""
+        if self.executor is None:
+            # spawn: дочерний процесс не наследует потоки и соединения бота
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+
+    async def render(self, kind, owner, bounds, title, data):
+        """Ключ кэша и изображение (PNG или file_id) графика"""
+        key = (kind, owner, bounds, data_version(title, data))
+        photo = self.cache.get(key)
+        if photo is not None:
+            return key, photo
+
+        future = self.pending.get(key)
+        if future is None:
+            generation = self.cache.generation
+            self.start()
+            loop = asyncio.get_running_loop()
+            future = self.pending[key] = loop.run_in_executor(self.executor, render_chart, kind, title, data)
+            try:
+                photo = await future
+            finally:
+                del self.pending[key]
+            self.rendered += 1
+            self.cache.put(key, photo, generation)
+            return key, photo
+        return key, await future
+
+    def remember_file_id(self, key, file_id):
+        """Замена PNG в кэше на file_id отправленного изображения"""
+        if self.cache.entries.get(key) is not None:
+            self.cache.put(key, file_id, self.cache.generation)
+
+    def stats(self):
+        """Счетчики кэша и число отрисовок"""
+        return dict(self.cache.stats(), rendered=self.rendered)
+
+    def close(self):
+        """Остановка пула процессов"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,207 @@
+"""Состояние клуба в памяти: тренировки и никнеймы в столбцах NumPy"""
+import calendar
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+import config
+
+# Основные столбцы тренировок по возрастанию даты: код участника, unix-время,
+# дистанция и время тренировки. user_order - номера строк, упорядоченные по
+# участнику (внутри участника - по дате), строки участника с кодом c -
+# user_order[user_offsets[c]:user_offsets[c + 1]]
+Columns = namedtuple('Columns', ['users', 'timestamps', 'distances', 'durations', 'user_order', 'user_offsets'])
+
+# Тренировки, записанные после сборки основных столбцов
+TAIL_DTYPE = np.dtype([('user', 'i4'), ('timestamp', 'i8'), ('distance', 'f8'), ('duration', 'i4')])
+
+# Итоги участников за период, массивы по кодам участников
+Totals = namedtuple('Totals', ['workouts', 'distance', 'duration'])
+
+
+def to_timestamp(moment):
+    """unix-время datetime в UTC без tzinfo или строки даты тренировки"""
+    if isinstance(moment, str):
+        moment = datetime.strptime(moment, '%Y-%m-%d %H:%M:%S')
+    return calendar.timegm(moment.timetuple())
+
+
+def build_columns(users, timestamps, distances, durations, user_count):
+    """Сортировка строк по дате и индекс строк по участникам"""
+    order = np.argsort(timestamps, kind='stable')
+    users = users[order]
+    # Устойчивая сортировка сохраняет порядок дат внутри участника
+    user_order = np.argsort(users, kind='stable').astype(np.int32)
+    user_offsets = np.zeros(user_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(users, minlength=user_count), out=user_offsets[1:])
+    return Columns(users, timestamps[order], distances[order], durations[order], user_order, user_offsets)
+
+
+class ClubState:
+    """Тренировки и никнеймы клуба в памяти.
+
+    Строка тренировки занимает 28 байт в столбцах вместо объекта Python
+    на каждое значение. Итоги периода - срез столбцов по дате двоичным
+    поиском и суммирование по участникам np.bincount, тренировки
+    участника - срез по его смещениям. Новые тренировки копятся в хвосте
+    и раз в tail_size записей вливаются в основные столбцы. Запросы берут
+    снимок столбцов под блокировкой и считают без нее.
+    """
+    def __init__(self, tail_size=config.MEMORY_TAIL_SIZE):
+        self.tail_size = tail_size
+        self.lock = threading.Lock()
+        self.usernames = []
+        self.codes = {}
+        self.nicknames = []
+        # Порядок участников по имени для равных мест в рейтинге
+        self.name_ranks = None
+        self.main = build_columns(
+            np.zeros(0, np.int32), np.zeros(0, np.int64), np.zeros(0, np.float64), np.zeros(0, np.int32), 0
+        )
+        self.tail = np.zeros(tail_size, dtype=TAIL_DTYPE)
+        self.tail_rows = 0
+        # Номер изменения в журнале changes, до которого включительно данные уже загружены
+        self.loaded_version = 0
+        self.version = 0
+        self.warmup_seconds = None
+
+    def code(self, username):
+        """Код участника, новый участник получает следующий код"""
+        code = self.codes.get(username)
+        if code is None:
+            code = self.codes[username] = len(self.usernames)
+            self.usernames.append(username)
+            self.nicknames.append(None)
+            self.name_ranks = None
+        return code
+
+    def load(self, usernames, timestamps, distances, durations, nicknames, version):
+        """Заполнение из строк базы: столбцы тренировок и пары (пользователь, никнейм)"""
+        names, users = np.unique(np.asarray(usernames, dtype=str), return_inverse=True)
+        with self.lock:
+            for name in names.tolist():
+                self.code(name)
+            for username, nickname in nicknames:
+                self.nicknames[self.code(username)] = nickname
+            self.main = build_columns(
+                users.astype(np.int32), np.asarray(timestamps, dtype=np.int64),
+                np.asarray(distances, dtype=np.float64), np.asarray(durations, dtype=np.int32),
+                len(self.usernames)
+            )
+            self.loaded_version = self.version = version
+
+    def add_workouts(self, workouts, version):
+        """Запись тренировок (пользователь, дата, дистанция, время), уже сохраненных в базе.
+
+        version - номер последнего изменения записи в журнале; тренировки,
+        вошедшие в загруженный снимок базы, повторно не учитываются.
+        """
+        with self.lock:
+            if version <= self.loaded_version:
+                return
+            self.version = max(self.version, version)
+            for username, record_date, distance, duration in workouts:
+                if self.tail_rows == self.tail_size:
+                    self.merge_tail()
+                self.tail[self.tail_rows] = (self.code(username), to_timestamp(record_date), distance, duration)
+                self.tail_rows += 1
+
+    def set_nicknames(self, nicknames, version):
+        """Запись никнеймов (пользователь, никнейм), уже сохраненных в базе"""
+        with self.lock:
+            if version <= self.loaded_version:
+                return
+            self.version = max(self.version, version)
+            for username, nickname in nicknames:
+                self.nicknames[self.code(username)] = nickname
+
+    def merge_tail(self):
+        """Перенос хвоста в основные столбцы (вызывается под блокировкой)"""
+        tail = self.tail[:self.tail_rows]
+        self.main = build_columns(
+            np.concatenate([self.main.users, tail['user']]),
+            np.concatenate([self.main.timestamps, tail['timestamp']]),
+            np.concatenate([self.main.distances, tail['distance']]),
+            np.concatenate([self.main.durations, tail['duration']]),
+            len(self.usernames)
+        )
+        self.tail = np.zeros(self.tail_size, dtype=TAIL_DTYPE)
+        self.tail_rows = 0
+
+    def snapshot(self):
+        """Основные столбцы, копия хвоста, число участников и версия данных"""
+        with self.lock:
+            return self.main, self.tail[:self.tail_rows].copy(), len(self.usernames), self.version
+
+    def totals(self, period, snapshot=None):
+        """Итоги всех участников за период (Totals) и версия данных"""
+        main, tail, user_count, version = snapshot or self.snapshot()
+        if period.kind == 'all':
+            first, last = 0, len(main.timestamps)
+            in_tail = np.ones(len(tail), dtype=bool)
+        else:
+            start, end = to_timestamp(period.start), to_timestamp(period.end)
+            first, last = np.searchsorted(main.timestamps, (start, end))
+            in_tail = (tail['timestamp'] >= start) & (tail['timestamp'] < end)
+
+        # Срез основных столбцов - представление без копирования
+        totals = [
+            np.bincount(users, weights=weights, minlength=user_count)
+            for users, weights in ((main.users[first:last], None),
+                                   (main.users[first:last], main.distances[first:last]),
+                                   (main.users[first:last], main.durations[first:last]))
+        ]
+        tail = tail[in_tail]
+        if len(tail):
+            for column, weights in zip(totals, (None, tail['distance'], tail['duration'])):
+                column += np.bincount(tail['user'], weights=weights, minlength=user_count)
+        workouts, distance, duration = totals
+        return Totals(workouts, distance, duration.astype(np.int64)), version
+
+    def user_workouts(self, username):
+        """Тренировки участника по возрастанию даты: unix-время, дистанция, время"""
+        main, tail, _, _ = self.snapshot()
+        code = self.codes.get(username)
+        if code is None:
+            return np.zeros(0, np.int64), np.zeros(0, np.float64), np.zeros(0, np.int32)
+        # Участник, появившийся после сборки столбцов, есть только в хвосте
+        rows = np.zeros(0, dtype=np.int32)
+        if code + 1 < len(main.user_offsets):
+            rows = main.user_order[main.user_offsets[code]:main.user_offsets[code + 1]]
+        mine = tail[tail['user'] == code]
+        timestamps = np.concatenate([main.timestamps[rows], mine['timestamp']])
+        # Хвост может содержать импортированные тренировки прошлых дат
+        order = np.argsort(timestamps, kind='stable')
+        return (
+            timestamps[order],
+            np.concatenate([main.distances[rows], mine['distance']])[order],
+            np.concatenate([main.durations[rows], mine['duration']])[order],
+        )
+
+    def ranked(self, totals):
+        """Коды участников с тренировками по убыванию дистанции, при равенстве - по имени"""
+        codes = np.flatnonzero(totals.workouts)
+        if self.name_ranks is None or len(self.name_ranks) < len(self.usernames):
+            names = self.usernames[:]
+            ranks = np.empty(len(names), dtype=np.int64)
+            ranks[sorted(range(len(names)), key=names.__getitem__)] = np.arange(len(names))
+            self.name_ranks = ranks
+        # Дистанции округляются до метров, как в рейтинге SQL и RankIndex
+        rounded = np.round(totals.distance[codes], 3)
+        order = np.lexsort((self.name_ranks[codes], -rounded))
+        return codes[order], rounded[order]
+
+    def stats(self):
+        """Строк, участников, байт в столбцах и время загрузки"""
+        with self.lock:
+            rows = len(self.main.timestamps) + self.tail_rows
+            size = sum(column.nbytes for column in self.main) + self.tail.nbytes
+            return {
+                'rows': rows,
+                'users': len(self.usernames),
+                'bytes': size,
+                'bytes_per_row': size / rows if rows else 0,
+                'warmup_seconds': self.warmup_seconds,
+            }
@@ -6,7 +6,52 @@ load_dotenv()
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 BACKUP_TIME = '00:00'  # 3:00 MSK (полночь UTC)
 ADMIN_IDS = list(map(int, os.getenv('ADMIN_IDS', '').split(','))) if os.getenv('ADMIN_IDS') else []
-DATABASE_NAME = 'running_club.db'
-BACKUP_NAME = 'backup_running_club.db'
+DATABASE_NAME = os.getenv('DATABASE_NAME', 'running_club.db')  # Файл базы данных
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')  # Каталог резервных копий
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '14'))  # Сколько последних копий хранить
+BACKUP_STEP_PAGES = int(os.getenv('BACKUP_STEP_PAGES', '1024'))  # Страниц за один шаг копирования
+BACKUP_STEP_SLEEP = float(os.getenv('BACKUP_STEP_SLEEP', '0.005'))  # Пауза между шагами, секунды
+DELTA_INTERVAL = int(os.getenv('DELTA_INTERVAL', '15'))  # Выгрузка изменений между копиями, минуты
+BACKUP_MAX_RESTARTS = int(os.getenv('BACKUP_MAX_RESTARTS', '3'))  # Перезапусков до копирования за один шаг
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))  # Потоки для запросов к базе данных
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '100'))  # Максимум записей в одной транзакции
+WRITE_BATCH_DELAY = float(os.getenv('WRITE_BATCH_DELAY', '0'))  # Доп. ожидание пачки, секунды (0 - без ожидания)
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '5000'))  # Строк за одно чтение при экспорте
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '256'))  # Записей в кэше отчетов
 
 
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Порт /metrics для Prometheus на 127.0.0.1 (0 - выключено)
+PROFILE_SLOW_UPDATE = float(os.getenv('PROFILE_SLOW_UPDATE', '0'))  # Профилировать обновления дольше, секунды (0 - выключено)
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))  # Шаг сэмплирования профайлера, секунды
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')  # Каталог профилей медленных обновлений
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес бота для webhook (не задан - long polling)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')  # Адрес встроенного HTTP-сервера webhook
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))  # Порт встроенного HTTP-сервера webhook
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')  # Путь webhook на сервере
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Секрет заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # Одновременных запросов от Telegram
+LEADERBOARD_PAGE_SIZE = int(os.getenv('LEADERBOARD_PAGE_SIZE', '10'))  # Участников на странице рейтинга
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '2000'))  # Тренировок в одной транзакции импорта
+IMPORT_MAX_FILE_MB = int(os.getenv('IMPORT_MAX_FILE_MB', '20'))  # Максимальный размер файла импорта, МБ
+IMPORT_SELF_SERVICE = os.getenv('IMPORT_SELF_SERVICE', '0') == '1'  # Импорт своих тренировок для всех участников
+SUMMARY_TIME = os.getenv('SUMMARY_TIME', '06:00')  # Подготовка итогов закончившихся месяца и квартала, UTC (9:00 MSK)
+SUMMARY_CATCHUP_DAYS = int(os.getenv('SUMMARY_CATCHUP_DAYS', '3'))  # Сколько дней после конца периода итоги еще рассылаются
+SUMMARY_TOP = int(os.getenv('SUMMARY_TOP', '10'))  # Участников в итоговом рейтинге рассылки
+OUTBOX_RATE = float(os.getenv('OUTBOX_RATE', '20'))  # Исходящих сообщений рассылки в секунду (лимит Telegram - 30)
+OUTBOX_INTERVAL = float(os.getenv('OUTBOX_INTERVAL', '1'))  # Период отправки очереди исходящих, секунды
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))  # Попыток отправки сообщения до отказа
+OUTBOX_BACKOFF = int(os.getenv('OUTBOX_BACKOFF', '30'))  # Пауза перед повторной отправкой, секунды (удваивается)
+OUTBOX_KEEP_DAYS = int(os.getenv('OUTBOX_KEEP_DAYS', '30'))  # Сколько дней хранить отправленные сообщения
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))  # Процессы отрисовки графиков
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', '256'))  # Графиков в кэше
+CHART_TOP = int(os.getenv('CHART_TOP', '15'))  # Участников на графике рейтинга
+MULTI_CLUB = os.getenv('MULTI_CLUB', '0') == '1'  # Отдельная база и рейтинг у каждого группового чата
+TENANTS_DIR = os.getenv('TENANTS_DIR', 'clubs')  # Каталог баз клубов групповых чатов
+TENANTS_MAX_OPEN = int(os.getenv('TENANTS_MAX_OPEN', '256'))  # Одновременно открытых баз клубов
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')  # Каталог годовых архивов тренировок рядом с базой
+ARCHIVE_KEEP_YEARS = int(os.getenv('ARCHIVE_KEEP_YEARS', '2'))  # Последних календарных лет в основной базе, более старые - в архив
+ARCHIVE_TIME = os.getenv('ARCHIVE_TIME', '01:00')  # Перенос старых лет в архив, UTC (4:00 MSK)
+MEMORY_STATE = os.getenv('MEMORY_STATE', '0') == '1'  # Статистика и рейтинги из столбцов в памяти, запись - в базу и в память
+MEMORY_TAIL_SIZE = int(os.getenv('MEMORY_TAIL_SIZE', '4096'))  # Новых тренировок до пересборки столбцов в памяти
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '1'))  # Обновлений разных участников в обработке одновременно (1 - строго по одному)
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '256'))  # Принятых обновлений в обработке и ожидании, остальные ждут в очереди приема
@@ -1,74 +1,343 @@
 import sqlite3
-import pandas as pd
-from datetime import datetime, timedelta
+import asyncio
+import csv
+import functools
+import gzip
 import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import config
+from analytics import WorkoutArrays, personal_report, progress_series, to_arrays
+from backup import BackupManager, get_change_seq
+from cache import ReportCache
+from columnar import ClubState, to_timestamp
+from metrics import track
+from migrations import migrate, rebuild_monthly_stats
+from periods import get_period_bounds, month_range, period_params, previous_period, resolve_period, RELATIVE_PERIODS
+from ranking import RankIndex
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Признак отсутствия пользователя в кэше никнеймов
+NOT_CACHED = object()
+
+# Поддерживаемые форматы экспорта
+EXPORT_FORMATS = ('xlsx', 'csv', 'csv.gz')
+
+# Файл годового архива тренировок
+ARCHIVE_FILE = re.compile(r'^(\d{4})\.db$')
+
+def get_date_filter(start=None, end=None, column='workouts.record_date'):
+    """Условие по дате тренировки [start, end) и его параметры"""
+    conditions = []
+    params = []
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"{column} < ?")
+        params.append(end)
+    return ' AND '.join(conditions) or '1=1', tuple(params)
+
+def iter_chunks(cursor, size=config.EXPORT_CHUNK_SIZE):
+    """Чтение результата запроса порциями"""
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield rows
+
+def iter_rows(cursor, size=config.EXPORT_CHUNK_SIZE):
+    """Построчное чтение результата запроса порциями"""
+    for rows in iter_chunks(cursor, size):
+        yield from rows
+
+# Строка рейтинга за период
+LeaderboardRow = namedtuple(
+    'LeaderboardRow', ['telegram_username', 'nickname', 'distance', 'duration', 'workouts']
+)
+
+# Личная статистика за период
+PersonalStats = namedtuple(
+    'PersonalStats', ['workouts', 'distance', 'duration', 'avg_distance', 'avg_duration']
+)
+
+# Строка страницы рейтинга: место с учетом равенства дистанций
+RankedRow = namedtuple(
+    'RankedRow', ['rank', 'telegram_username', 'nickname', 'distance', 'duration', 'workouts']
+)
+
+# Страница рейтинга и версия данных, по которым она построена
+LeaderboardPage = namedtuple(
+    'LeaderboardPage', ['rows', 'page', 'pages', 'total', 'version']
+)
+
+# Итоги участника за закрытый период для рассылки: место среди всех
+# участников периода и итоги предыдущего периода (None, если тренировок не было)
+MemberSummary = namedtuple('MemberSummary', [
+    'chat_id', 'telegram_username', 'nickname', 'rank', 'total',
+    'workouts', 'distance', 'duration', 'previous_workouts', 'previous_distance',
+])
+
+# Сообщение из очереди исходящих
+OutboxMessage = namedtuple('OutboxMessage', ['id', 'chat_id', 'text', 'attempts'])
+
+def split_archived(period, years):
+    """Архивные годы периода: попавшие в него целиком и частично"""
+    whole, partial = [], []
+    for year in sorted(years):
+        start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+        if period.kind == 'all' or (period.start <= start and end <= period.end):
+            whole.append(year)
+        elif period.start < end and start < period.end:
+            partial.append(year)
+    return whole, partial
+
+def get_totals_query(period, username=None, archived=()):
+    """Подзапрос итогов участников за период и его параметры.
+    
+    Столбцы: telegram_username, workouts, distance, duration. Периоды,
+    кратные месяцу, собираются из помесячных итогов, остальные (недели,
+    диапазоны дат) - из тренировок. Границы [начало, конец) передаются
+    параметрами, поэтому условие читает только нужный диапазон индекса.
+    
+    archived - годы, перенесенные в архив: годы, целиком попавшие в период,
+    берутся из годовых итогов, частично - из файлов архива, подключенных
+    как archive_<год> (см. Database.begin_totals).
+    """
+    user_conditions = []
+    user_params = []
+    if username is not None:
+        user_conditions.append("telegram_username = ?")
+        user_params.append(username)
+    
+    months = month_range(period)
+    if months is None:
+        conditions = user_conditions + ["record_date >= ? AND record_date < ?"]
+        params = user_params + list(period_params(period))
+        source, workouts = 'workouts', 'COUNT(*)'
+    else:
+        conditions, params = list(user_conditions), list(user_params)
+        source, workouts = 'monthly_stats', 'SUM(workouts)'
+        if period.kind != 'all':
+            conditions.append("month >= ? AND month < ?")
+            params.extend(months)
+    
+    query = f'''
+        SELECT
+            telegram_username,
+            {workouts} AS workouts,
+            SUM(distance) AS distance,
+            SUM(duration) AS duration
+        FROM {source}
+        WHERE {' AND '.join(conditions) or '1=1'}
+        GROUP BY telegram_username
+    '''
+    whole, partial = split_archived(period, archived)
+    if not whole and not partial:
+        return query, tuple(params)
+    
+    # Итоги каждого источника складываются по участникам. Тренировки
+    # архивных лет, добавленные после переноса (импорт), остаются
+    # в основной базе и учитываются запросом выше
+    parts = [query]
+    if whole:
+        year_conditions = list(user_conditions)
+        if period.kind != 'all':
+            year_conditions.append("year >= ? AND year <= ?")
+            params.extend(user_params + [whole[0], whole[-1]])
+        else:
+            params.extend(user_params)
+        parts.append(f'''
+            SELECT telegram_username, SUM(workouts), SUM(distance), SUM(duration)
+            FROM yearly_summaries
+            WHERE {' AND '.join(year_conditions) or '1=1'}
+            GROUP BY telegram_username
+        ''')
+    for year in partial:
+        parts.append(f'''
+            SELECT telegram_username, COUNT(*), SUM(distance), SUM(duration)
+            FROM archive_{year}.workouts
+            WHERE {' AND '.join(user_conditions + ["record_date >= ? AND record_date < ?"])}
+            GROUP BY telegram_username
+        ''')
+        params.extend(user_params + list(period_params(period)))
+    
+    return f'''
+        SELECT
+            telegram_username,
+            SUM(workouts) AS workouts,
+            SUM(distance) AS distance,
+            SUM(duration) AS duration
+        FROM ({' UNION ALL '.join(parts)})
+        GROUP BY telegram_username
+    ''', tuple(params)
+
 class Database:
-    def __init__(self, db_name='running_club.db'):
+    def __init__(self, db_name='running_club.db', backup_dir=config.BACKUP_DIR, memory=config.MEMORY_STATE):
         self.db_name = db_name
+        self.backup_dir = backup_dir
+        
+        # Кэш никнеймов: telegram_username -> nickname (или None, если ник не задан).
+        # Сбрасывается при записи никнеймов и восстановлении базы
+        self.nickname_cache = {}
+        self.nickname_cache_generation = 0
+        self.nickname_cache_lock = threading.Lock()
+        
+        # Индексы мест по периодам: (начало, конец) -> RankIndex.
+        # Обновляются при записи тренировок, сбрасываются при пересчете итогов
+        self.rank_indexes = {}
+        self.rank_generation = 0
+        self.rank_lock = threading.Lock()
+        
+        # Годовые архивы тренировок: <каталог базы>/archive/<имя базы>/<год>.db
+        self.archive_dir = os.path.join(
+            os.path.dirname(db_name), config.ARCHIVE_DIR, os.path.splitext(os.path.basename(db_name))[0]
+        )
+        
+        # Режим memory: статистика и рейтинги считаются по столбцам в памяти
+        # (ClubState), загруженным при первом запросе; записи идут в базу,
+        # затем в память. Сбрасывается при восстановлении из копии
+        self.memory = memory
+        self.state = None
+        self.state_lock = threading.Lock()
+        
         self.init_db()
     
     def get_connection(self):
         return sqlite3.connect(self.db_name)
     
-    def init_db(self):
-        """Инициализация базы данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица никнеймов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS nicknames (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_username TEXT NOT NULL,
-                nickname TEXT,
-                registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица тренировок
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS workouts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                record_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                distance REAL NOT NULL,
-                duration INTEGER NOT NULL,
-                telegram_username TEXT NOT NULL
+    def archive_path(self, year):
+        """Файл архива тренировок года"""
+        return os.path.join(self.archive_dir, f"{year}.db")
+    
+    def archive_files(self):
+        """Годы, для которых есть файл архива"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(int(match.group(1)) for match in map(ARCHIVE_FILE.match, os.listdir(self.archive_dir)) if match)
+    
+    def get_archived_years(self, conn, username=None):
+        """Годы, тренировки которых перенесены в архив (всех или одного участника)"""
+        if username is None:
+            cursor = conn.execute('SELECT DISTINCT year FROM yearly_summaries ORDER BY year')
+        else:
+            cursor = conn.execute(
+                'SELECT year FROM yearly_summaries WHERE telegram_username = ? ORDER BY year', (username,)
             )
-        ''')
+        return [row[0] for row in cursor]
+    
+    def attach_archive(self, conn, year):
+        """Подключение файла архива года к соединению как archive_<год>"""
+        path = self.archive_path(year)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Нет файла архива {path}")
+        conn.execute(f'ATTACH DATABASE ? AS archive_{int(year)}', (path,))
+    
+    def begin_totals(self, conn, *periods):
+        """Начало чтения итогов за периоды с учетом архива, возвращает архивные годы.
         
-        conn.commit()
-        conn.close()
+        Внутри транзакции ATTACH недоступен, поэтому файлы архива лет,
+        частично попавших в периоды, подключаются до BEGIN, а список
+        архивных лет читается уже в транзакции, из одного снимка с итогами.
+        """
+        files = self.archive_files()
+        attach = set()
+        for period in periods:
+            if period is not None and files:
+                attach.update(split_archived(period, files)[1])
+        for year in sorted(attach):
+            self.attach_archive(conn, year)
+        conn.execute('BEGIN')
+        return self.get_archived_years(conn)
     
-    def add_nickname(self, telegram_username, nickname):
-        """Добавление или обновление никнейма"""
+    def get_state(self):
+        """Состояние клуба в памяти, при первом обращении загружается из базы"""
+        with self.state_lock:
+            if self.state is None:
+                self.state = self.load_state()
+            return self.state
+    
+    def load_state(self):
+        """Загрузка всех тренировок (включая архивные) и никнеймов в столбцы ClubState"""
+        started = time.perf_counter()
+        query = '''
+            SELECT id, telegram_username, CAST(strftime('%s', record_date) AS INTEGER), distance, duration
+            FROM {table}
+        '''
         conn = self.get_connection()
-        cursor = conn.cursor()
+        rows = []
+        for year in self.get_archived_years(conn):
+            self.attach_archive(conn, year)
+            rows.extend(conn.execute(query.format(table=f'archive_{year}.workouts')))
+            conn.execute(f'DETACH DATABASE archive_{year}')
         
-        # Проверяем, есть ли уже запись
-        cursor.execute('SELECT id FROM nicknames WHERE telegram_username = ?', (telegram_username,))
-        existing = cursor.fetchone()
+        # Тренировки, никнеймы и номер последнего изменения - из одного снимка
+        conn.execute('BEGIN')
+        version = get_change_seq(conn)
+        archived = len(rows)
+        rows.extend(conn.execute(query.format(table='workouts')))
+        nicknames = conn.execute('SELECT telegram_username, nickname FROM nicknames').fetchall()
+        conn.close()
         
-        if existing:
-            cursor.execute('''
-                UPDATE nicknames 
-                SET nickname = ?, registration_date = CURRENT_TIMESTAMP 
-                WHERE telegram_username = ?
-            ''', (nickname, telegram_username))
-        else:
-            cursor.execute('''
-                INSERT INTO nicknames (telegram_username, nickname) 
-                VALUES (?, ?)
-            ''', (telegram_username, nickname))
+        ids, usernames, timestamps, distances, durations = zip(*rows) if rows else ((),) * 5
+        if archived:
+            # Перенос в архив, идущий во время загрузки, мог оставить строку в обоих местах
+            _, last = np.unique(np.asarray(ids)[::-1], return_index=True)
+            keep = np.sort(len(ids) - 1 - last)
+            if len(keep) < len(ids):
+                usernames = np.asarray(usernames)[keep]
+                timestamps, distances, durations = (np.asarray(column)[keep] for column in (timestamps, distances, durations))
         
-        conn.commit()
+        state = ClubState()
+        state.load(usernames, timestamps, distances, durations, nicknames, version)
+        state.warmup_seconds = time.perf_counter() - started
+        stats = state.stats()
+        logger.info(
+            f"Memory state loaded: {stats['rows']} workouts, {stats['users']} users, "
+            f"{stats['bytes'] / 1024 / 1024:.1f} MB ({stats['bytes_per_row']:.0f} B/row) "
+            f"in {state.warmup_seconds:.2f}s"
+        )
+        return state
+    
+    def update_state(self, version, workouts=(), nicknames=()):
+        """Запись в состояние в памяти того, что уже сохранено в базе"""
+        with self.state_lock:
+            if self.state is None:
+                return
+            if workouts:
+                self.state.add_workouts(workouts, version)
+            if nicknames:
+                self.state.set_nicknames(nicknames, version)
+    
+    def init_db(self):
+        """Инициализация базы данных и обновление схемы до последней версии"""
+        conn = self.get_connection()
+        # В режиме WAL чтение и резервное копирование не блокируют запись
+        conn.execute('PRAGMA journal_mode=WAL')
+        migrate(conn)
         conn.close()
     
+    def add_nickname(self, telegram_username, nickname):
+        """Добавление или обновление никнейма"""
+        self.write_batch(nicknames=[(telegram_username, nickname)])
+    
+    @track('db_query')
     def get_nickname(self, telegram_username):
         """Получение никнейма пользователя"""
+        nickname = self.nickname_cache.get(telegram_username, NOT_CACHED)
+        if nickname is not NOT_CACHED:
+            return nickname
+        
+        generation = self.nickname_cache_generation
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -80,100 +349,1013 @@ class Database:
         result = cursor.fetchone()
         conn.close()
         
-        return result[0] if result else None
+        nickname = result[0] if result else None
+        with self.nickname_cache_lock:
+            # Не кэшируем значение, прочитанное до параллельной смены ника
+            if generation == self.nickname_cache_generation:
+                self.nickname_cache[telegram_username] = nickname
+        
+        return nickname
+    
+    def invalidate_nicknames(self, usernames=None):
+        """Сброс кэша никнеймов (всех или указанных пользователей)"""
+        with self.nickname_cache_lock:
+            self.nickname_cache_generation += 1
+            if usernames is None:
+                self.nickname_cache.clear()
+            else:
+                for telegram_username in usernames:
+                    self.nickname_cache.pop(telegram_username, None)
     
     def add_workout(self, telegram_username, distance, duration):
         """Добавление тренировки"""
+        self.write_batch(workouts=[(telegram_username, distance, duration)])
+    
+    @track('db_query')
+    def write_batch(self, workouts=(), nicknames=(), members=()):
+        """Запись пачки тренировок, никнеймов и чатов участников одной транзакцией"""
+        # Тренировки записываются с текущим временем UTC, как CURRENT_TIMESTAMP
+        record_date = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        workouts = [(username, record_date, distance, duration) for username, distance, duration in workouts]
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO workouts (telegram_username, distance, duration)
-            VALUES (?, ?, ?)
-        ''', (telegram_username, distance, duration))
+        if workouts:
+            cursor.executemany('''
+                INSERT INTO workouts (telegram_username, record_date, distance, duration)
+                VALUES (?, ?, ?, ?)
+            ''', workouts)
+        
+        if nicknames:
+            cursor.executemany('''
+                INSERT INTO nicknames (telegram_username, nickname) 
+                VALUES (?, ?)
+                ON CONFLICT (telegram_username) DO UPDATE
+                SET nickname = excluded.nickname, registration_date = CURRENT_TIMESTAMP
+            ''', nicknames)
+        
+        if members:
+            # Отписка от рассылок сохраняется при смене чата
+            cursor.executemany('''
+                INSERT INTO members (telegram_username, chat_id)
+                VALUES (?, ?)
+                ON CONFLICT (telegram_username) DO UPDATE
+                SET chat_id = excluded.chat_id, updated_at = CURRENT_TIMESTAMP
+            ''', members)
+        
+        version = get_change_seq(conn)
+        conn.commit()
+        conn.close()
+        
+        self.update_state(version, workouts, nicknames)
+        if workouts:
+            self.update_rank_indexes((username, record_date, distance) for username, record_date, distance, _ in workouts)
+        if nicknames:
+            self.invalidate_nicknames(username for username, _ in nicknames)
+    
+    @track('db_query')
+    def import_workouts(self, workouts):
+        """Запись пачки импортированных тренировок одной транзакцией.
+        
+        workouts - строки (пользователь, дата, дистанция, время). Тренировки,
+        уже записанные с той же датой и дистанцией, пропускаются, поэтому
+        повторный импорт того же файла ничего не добавляет.
+        Возвращает (добавлено, дубликатов).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Дубликаты ищутся точечно по индексу (пользователь, дата): в файле
+        # за несколько лет выборка по диапазону дат пачки читала бы
+        # в десятки раз больше строк, чем в самой пачке
+        new_workouts = []
+        seen = set()
+        for workout in workouts:
+            key = workout[:3]
+            if key in seen:
+                continue
+            seen.add(key)
+            cursor.execute('''
+                SELECT 1 FROM workouts
+                WHERE telegram_username = ? AND record_date = ? AND ROUND(distance, 2) = ?
+            ''', key)
+            if cursor.fetchone() is None:
+                new_workouts.append(workout)
         
+        cursor.executemany('''
+            INSERT INTO workouts (telegram_username, record_date, distance, duration)
+            VALUES (?, ?, ?, ?)
+        ''', new_workouts)
+        version = get_change_seq(conn)
         conn.commit()
         conn.close()
+        
+        self.update_state(version, new_workouts)
+        self.update_rank_indexes(
+            (username, record_date, distance) for username, record_date, distance, _ in new_workouts
+        )
+        return len(new_workouts), len(workouts) - len(new_workouts)
     
+    @track('db_query')
     def get_statistics(self, period='all', username=None):
-        """Получение статистики"""
-        conn = self.get_connection()
-        
-        # Определяем период
-        if period == 'month':
-            date_filter = "record_date >= date('now', 'start of month')"
-        elif period == 'quarter':
-            # Текущий квартал
-            today = datetime.now()
-            quarter_month = ((today.month - 1) // 3) * 3 + 1
-            quarter_start = today.replace(month=quarter_month, day=1)
-            date_filter = f"record_date >= '{quarter_start.strftime('%Y-%m-%d')}'"
-        elif period == 'last_month':
-            date_filter = "record_date >= date('now', 'start of month', '-1 month') AND record_date < date('now', 'start of month')"
-        elif period == 'last_quarter':
-            today = datetime.now()
-            quarter_month = ((today.month - 1) // 3) * 3 + 1
-            quarter_start = today.replace(month=quarter_month, day=1)
-            last_quarter_start = quarter_start - timedelta(days=90)
-            date_filter = f"record_date >= '{last_quarter_start.strftime('%Y-%m-%d')}' AND record_date < '{quarter_start.strftime('%Y-%m-%d')}'"
-        else:
-            date_filter = "1=1"
+        """Получение статистики.
         
-        # Формируем запрос
+        Для пользователя возвращает PersonalStats, иначе список LeaderboardRow
+        по убыванию дистанции.
+        """
+        period = resolve_period(period)
+        if self.memory:
+            return self.get_state_statistics(period, username)
+        conn = self.get_connection()
+        try:
+            archived = self.begin_totals(conn, period)
+            totals_query, params = get_totals_query(period, username, archived)
+            
+            # Формируем запрос
+            if username:
+                cursor = conn.execute(f'''
+                    SELECT 
+                        COALESCE(SUM(workouts), 0),
+                        COALESCE(SUM(distance), 0),
+                        COALESCE(SUM(duration), 0),
+                        SUM(distance) / SUM(workouts),
+                        SUM(duration) * 1.0 / SUM(workouts)
+                    FROM ({totals_query})
+                ''', params)
+                result = PersonalStats._make(cursor.fetchone())
+            else:
+                # Никнеймы подтягиваются тем же запросом
+                cursor = conn.execute(f'''
+                    SELECT 
+                        totals.telegram_username,
+                        nicknames.nickname,
+                        totals.distance,
+                        totals.duration,
+                        totals.workouts
+                    FROM ({totals_query}) AS totals
+                    LEFT JOIN nicknames ON nicknames.telegram_username = totals.telegram_username
+                    ORDER BY totals.distance DESC
+                ''', params)
+                result = list(map(LeaderboardRow._make, cursor.fetchall()))
+        finally:
+            conn.close()
+        return result
+    
+    def get_state_statistics(self, period, username=None):
+        """Статистика за период по столбцам в памяти (как get_statistics)"""
+        state = self.get_state()
         if username:
-            query = f'''
-                SELECT 
-                    COUNT(*) as тренировки,
-                    SUM(distance) as дистанция,
-                    SUM(duration) as время_минуты,
-                    AVG(distance) as средняя_дистанция,
-                    AVG(duration) as среднее_время
-                FROM workouts 
-                WHERE telegram_username = ? AND {date_filter}
-            '''
-            params = (username,)
-        else:
-            query = f'''
-                SELECT 
+            timestamps, distances, durations = state.user_workouts(username)
+            if period.kind != 'all':
+                first, last = np.searchsorted(timestamps, (to_timestamp(period.start), to_timestamp(period.end)))
+                distances, durations = distances[first:last], durations[first:last]
+            workouts = len(distances)
+            if not workouts:
+                return PersonalStats(0, 0, 0, None, None)
+            distance, duration = float(distances.sum()), int(durations.sum())
+            return PersonalStats(workouts, distance, duration, distance / workouts, duration / workouts)
+        
+        totals, _ = state.totals(period)
+        codes, _ = state.ranked(totals)
+        return [
+            LeaderboardRow(state.usernames[code], state.nicknames[code], float(totals.distance[code]),
+                           int(totals.duration[code]), int(totals.workouts[code]))
+            for code in codes.tolist()
+        ]
+
+    @track('db_query')
+    def get_leaderboard_page(self, period='all', page=0, page_size=config.LEADERBOARD_PAGE_SIZE):
+        """Страница рейтинга за период (LeaderboardPage).
+        
+        Места считаются RANK() по всем участникам периода, поэтому равные
+        (с точностью до метра) дистанции делят одно место на любой странице. При равенстве порядок
+        задается именем пользователя, чтобы границы страниц не плавали.
+        Номер страницы за пределами рейтинга заменяется последней страницей.
+        """
+        period = resolve_period(period)
+        if self.memory:
+            return self.get_state_leaderboard_page(period, page, page_size)
+        conn = self.get_connection()
+        try:
+            # Страница и версия данных читаются из одного снимка базы
+            archived = self.begin_totals(conn, period)
+            totals_query, params = get_totals_query(period, archived=archived)
+            version = get_change_seq(conn)
+            page = max(page, 0)
+            rows, total = self.fetch_leaderboard_rows(conn, totals_query, params, page, page_size)
+            
+            # Рейтинг мог сократиться (восстановление копии): берем последнюю страницу
+            if not rows and page > 0:
+                total = conn.execute(f'SELECT COUNT(*) FROM ({totals_query})', params).fetchone()[0]
+                page = max((total + page_size - 1) // page_size - 1, 0)
+                rows, total = self.fetch_leaderboard_rows(conn, totals_query, params, page, page_size)
+        finally:
+            conn.close()
+        
+        pages = max((total + page_size - 1) // page_size, 1)
+        return LeaderboardPage(rows, page, pages, total, version)
+    
+    def get_state_leaderboard_page(self, period, page, page_size):
+        """Страница рейтинга по столбцам в памяти (как get_leaderboard_page)"""
+        state = self.get_state()
+        totals, version = state.totals(period)
+        codes, rounded = state.ranked(totals)
+        total = len(codes)
+        pages = max((total + page_size - 1) // page_size, 1)
+        page = min(max(page, 0), pages - 1)
+        
+        # Место - число участников с большей дистанцией плюс один, как RANK()
+        first = page * page_size
+        ranks = np.searchsorted(-rounded, -rounded[first:first + page_size], side='left') + 1
+        rows = [
+            RankedRow(int(rank), state.usernames[code], state.nicknames[code], float(totals.distance[code]),
+                      int(totals.duration[code]), int(totals.workouts[code]))
+            for rank, code in zip(ranks.tolist(), codes[first:first + page_size].tolist())
+        ]
+        return LeaderboardPage(rows, page, pages, total, version)
+    
+    def fetch_leaderboard_rows(self, conn, totals_query, params, page, page_size):
+        """Строки страницы рейтинга и общее число участников периода"""
+        # Никнеймы подтягиваются только для строк страницы
+        cursor = conn.execute(f'''
+            SELECT
+                ranked.rank,
+                ranked.telegram_username,
+                nicknames.nickname,
+                ranked.distance,
+                ranked.duration,
+                ranked.workouts,
+                ranked.total
+            FROM (
+                SELECT
                     telegram_username,
-                    SUM(distance) as общая_дистанция,
-                    SUM(duration) as общее_время,
-                    COUNT(*) as тренировки
-                FROM workouts 
-                WHERE {date_filter}
-                GROUP BY telegram_username
-                ORDER BY общая_дистанция DESC
-            '''
-            params = ()
+                    distance,
+                    duration,
+                    workouts,
+                    RANK() OVER (ORDER BY ROUND(distance, 3) DESC) AS rank,
+                    COUNT(*) OVER () AS total
+                FROM ({totals_query})
+                ORDER BY rank, telegram_username
+                LIMIT ? OFFSET ?
+            ) AS ranked
+            LEFT JOIN nicknames ON nicknames.telegram_username = ranked.telegram_username
+            ORDER BY ranked.rank, ranked.telegram_username
+        ''', params + (page_size, page * page_size))
+        rows = cursor.fetchall()
+        total = rows[0][-1] if rows else 0
+        return [RankedRow._make(row[:-1]) for row in rows], total
+    
+    @track('db_query')
+    def get_rank(self, period, username):
+        """Место участника за период (MemberRank) или None, если тренировок нет"""
+        key = get_period_bounds(period)
+        index = self.rank_indexes.get(key)
+        if index is None:
+            index = self.build_rank_index(period)
+        return index.rank(username)
+    
+    @track('db_query')
+    def get_workout_arrays(self, username):
+        """Все тренировки участника, включая архивные, столбцами NumPy (WorkoutArrays)"""
+        if self.memory:
+            timestamps, distances, durations = self.get_state().user_workouts(username)
+            return WorkoutArrays(timestamps.astype('datetime64[s]'), distances, durations.astype(np.float64))
+        query = '''
+            SELECT CAST(strftime('%s', record_date) AS INTEGER), distance, duration
+            FROM {source}
+            WHERE telegram_username = ?
+            ORDER BY record_date
+        '''
+        conn = self.get_connection()
+        years = self.get_archived_years(conn, username)
+        if not years:
+            arrays = to_arrays(conn.execute(query.format(source='workouts'), (username,)))
+            conn.close()
+            return arrays
         
-        df = pd.read_sql_query(query, conn, params=params)
+        # Файлы архива подключаются по одному: их может быть больше лимита ATTACH
+        rows = []
+        for year in years:
+            self.attach_archive(conn, year)
+            rows.extend(conn.execute(query.format(source=f'archive_{year}.workouts'), (username,)))
+            conn.execute(f'DETACH DATABASE archive_{year}')
+        rows.extend(conn.execute(query.format(source='workouts'), (username,)))
         conn.close()
-        return df
+        # Импортированные после переноса тренировки архивных лет лежат в основной базе
+        rows.sort()
+        return to_arrays(rows)
     
-    def export_to_excel(self):
-        """Экспорт данных в Excel"""
+    @track('db_query')
+    def get_personal_report(self, period, username):
+        """Подробный отчет участника за период (PersonalReport) или None"""
+        return personal_report(self.get_workout_arrays(username), period)
+    
+    @track('db_query')
+    def get_progress_series(self, period, username):
+        """Данные графиков прогресса участника за период (ProgressSeries) или None"""
+        return progress_series(self.get_workout_arrays(username), period)
+    
+    @track('db_query')
+    def get_period_summaries(self, period):
+        """Итоги всех участников рассылки за период (MemberSummary) одним запросом.
+        
+        Места, итоги периода, итоги предыдущего периода и никнеймы
+        собираются одним проходом по помесячным итогам вместо отдельных
+        запросов статистики и никнейма на каждого участника.
+        """
+        period = resolve_period(period)
+        previous = previous_period(period)
         conn = self.get_connection()
+        archived = self.begin_totals(conn, period, previous)
+        totals_query, params = get_totals_query(period, archived=archived)
+        previous_query, previous_params = get_totals_query(previous, archived=archived)
         
-        with pd.ExcelWriter('database_export.xlsx', engine='openpyxl') as writer:
-            # Экспорт никнеймов
-            df_nicknames = pd.read_sql_query('SELECT * FROM nicknames', conn)
-            df_nicknames.to_excel(writer, sheet_name='Никнеймы', index=False)
-            
-            # Экспорт тренировок
-            df_workouts = pd.read_sql_query('SELECT * FROM workouts', conn)
-            df_workouts.to_excel(writer, sheet_name='Тренировки', index=False)
+        cursor = conn.execute(f'''
+            SELECT
+                members.chat_id,
+                members.telegram_username,
+                nicknames.nickname,
+                ranked.rank,
+                ranked.total,
+                ranked.workouts,
+                ranked.distance,
+                ranked.duration,
+                previous.workouts,
+                previous.distance
+            FROM members
+            LEFT JOIN (
+                SELECT
+                    telegram_username,
+                    workouts,
+                    distance,
+                    duration,
+                    RANK() OVER (ORDER BY ROUND(distance, 3) DESC) AS rank,
+                    COUNT(*) OVER () AS total
+                FROM ({totals_query})
+            ) AS ranked ON ranked.telegram_username = members.telegram_username
+            LEFT JOIN ({previous_query}) AS previous ON previous.telegram_username = members.telegram_username
+            LEFT JOIN nicknames ON nicknames.telegram_username = members.telegram_username
+            WHERE members.notify = 1
+            ORDER BY members.telegram_username
+        ''', params + previous_params)
+        summaries = list(map(MemberSummary._make, cursor.fetchall()))
+        conn.close()
+        return summaries
+    
+    def has_broadcast(self, key):
+        """Подготовлена ли рассылка с ключом key"""
+        conn = self.get_connection()
+        row = conn.execute('SELECT 1 FROM broadcasts WHERE key = ?', (key,)).fetchone()
+        conn.close()
+        return row is not None
+    
+    @track('db_query')
+    def prepare_broadcast(self, key, messages):
+        """Постановка рассылки в очередь исходящих одной транзакцией.
+        
+        messages - пары (chat_id, текст). Рассылка с тем же ключом ставится
+        только один раз: повторный вызов (например, после перезапуска бота)
+        ничего не добавляет и возвращает None, иначе - число сообщений.
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO broadcasts (key, messages) VALUES (?, ?)
+                ON CONFLICT (key) DO NOTHING
+            ''', (key, len(messages)))
+            if not cursor.rowcount:
+                conn.rollback()
+                return None
+            cursor.executemany('''
+                INSERT OR IGNORE INTO outbox (broadcast, chat_id, text) VALUES (?, ?, ?)
+            ''', [(key, chat_id, text) for chat_id, text in messages])
+            conn.commit()
+        finally:
+            conn.close()
+        return len(messages)
+    
+    @track('db_query')
+    def get_due_messages(self, limit):
+        """Неотправленные сообщения, время попытки которых наступило, в порядке очереди"""
+        conn = self.get_connection()
+        cursor = conn.execute('''
+            SELECT id, chat_id, text, attempts FROM outbox
+            WHERE status = 'pending' AND next_attempt <= datetime('now')
+            ORDER BY next_attempt, id
+            LIMIT ?
+        ''', (limit,))
+        messages = list(map(OutboxMessage._make, cursor.fetchall()))
+        conn.close()
+        return messages
+    
+    def has_pending_messages(self):
+        """Есть ли неотправленные сообщения, в том числе отложенные"""
+        conn = self.get_connection()
+        row = conn.execute("SELECT 1 FROM outbox WHERE status = 'pending' LIMIT 1").fetchone()
+        conn.close()
+        return row is not None
+    
+    def update_message(self, message_id, status, error=None, delay=0, attempt=True):
+        """Результат отправки: 'sent', 'failed' или 'pending' с новой попыткой через delay секунд"""
+        conn = self.get_connection()
+        conn.execute('''
+            UPDATE outbox
+            SET status = ?, error = ?, attempts = attempts + ?,
+                next_attempt = datetime('now', ?),
+                sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP END
+            WHERE id = ?
+        ''', (status, error, int(attempt), f'+{int(delay)} seconds', status, message_id))
+        conn.commit()
+        conn.close()
+    
+    def unsubscribe_chat(self, chat_id):
+        """Отключение рассылок для чата, который заблокировал бота"""
+        conn = self.get_connection()
+        conn.execute('UPDATE members SET notify = 0 WHERE chat_id = ?', (chat_id,))
+        conn.commit()
+        conn.close()
+    
+    def set_notify(self, telegram_username, chat_id, notify):
+        """Подписка участника на рассылку итогов или отписка"""
+        conn = self.get_connection()
+        conn.execute('''
+            INSERT INTO members (telegram_username, chat_id, notify)
+            VALUES (?, ?, ?)
+            ON CONFLICT (telegram_username) DO UPDATE
+            SET chat_id = excluded.chat_id, notify = excluded.notify, updated_at = CURRENT_TIMESTAMP
+        ''', (telegram_username, chat_id, int(notify)))
+        conn.commit()
+        conn.close()
+    
+    def prune_outbox(self, days=config.OUTBOX_KEEP_DAYS):
+        """Удаление обработанных сообщений старше days дней"""
+        conn = self.get_connection()
+        cursor = conn.execute('''
+            DELETE FROM outbox
+            WHERE status != 'pending' AND next_attempt < datetime('now', ?)
+        ''', (f'-{int(days)} days',))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+    
+    def build_rank_index(self, period):
+        """Построение индекса мест за период по итогам участников"""
+        period = resolve_period(period)
+        generation = self.rank_generation
         
+        if self.memory:
+            state = self.get_state()
+            state_totals, _ = state.totals(period)
+            totals = [(state.usernames[code], state_totals.distance[code])
+                      for code in np.flatnonzero(state_totals.workouts).tolist()]
+        else:
+            conn = self.get_connection()
+            archived = self.begin_totals(conn, period)
+            totals_query, params = get_totals_query(period, archived=archived)
+            totals = conn.execute(f'SELECT telegram_username, distance FROM ({totals_query})', params).fetchall()
+            conn.close()
+        
+        start, end = period_params(period)
+        index = RankIndex(start, end, totals)
+        with self.rank_lock:
+            # Не сохраняем индекс, прочитанный до параллельной записи
+            if generation == self.rank_generation:
+                # Индексы прошедших и явно заданных периодов больше не понадобятся
+                current = {get_period_bounds(name) for name in ('all', *RELATIVE_PERIODS)}
+                for key in set(self.rank_indexes) - current:
+                    del self.rank_indexes[key]
+                self.rank_indexes[(start, end)] = index
+        return index
+    
+    def update_rank_indexes(self, workouts):
+        """Учет новых тренировок (участник, дата, дистанция) в индексах мест"""
+        with self.rank_lock:
+            self.rank_generation += 1
+            for username, record_date, distance in workouts:
+                for index in self.rank_indexes.values():
+                    if index.covers(record_date):
+                        index.add(username, distance)
+    
+    def invalidate_ranks(self):
+        """Сброс индексов мест после пересчета итогов или восстановления"""
+        with self.rank_lock:
+            self.rank_generation += 1
+            self.rank_indexes.clear()
+    
+    @track('db_query')
+    def rebuild_rollups(self):
+        """Пересчет помесячных итогов по всем тренировкам"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        rebuild_monthly_stats(cursor)
+        conn.commit()
         conn.close()
-        return 'database_export.xlsx'
+        self.invalidate_ranks()
+        logger.info("Monthly stats rebuilt")
     
+    @track('db_query')
+    def check_rollups(self):
+        """Сверка помесячных итогов с полным подсчетом по тренировкам.
+        
+        Возвращает список расхождений (пользователь, месяц, итог, подсчет).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT telegram_username, strftime('%Y-%m', record_date), COUNT(*), SUM(distance), SUM(duration)
+            FROM workouts
+            GROUP BY telegram_username, strftime('%Y-%m', record_date)
+        ''')
+        scanned = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+        
+        cursor.execute('SELECT telegram_username, month, workouts, distance, duration FROM monthly_stats')
+        rollups = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
+        conn.close()
+        
+        mismatches = []
+        for key in sorted(scanned.keys() | rollups.keys()):
+            expected = scanned.get(key)
+            actual = rollups.get(key)
+            if (expected is None or actual is None
+                    or expected[0] != actual[0]
+                    or abs(expected[1] - actual[1]) > 1e-6
+                    or expected[2] != actual[2]):
+                mismatches.append((key[0], key[1], actual, expected))
+        
+        return mismatches
+    
+    @track('db_query')
+    def archive_workouts(self, keep_years=config.ARCHIVE_KEEP_YEARS, vacuum=True):
+        """Перенос тренировок старых лет в годовые архивы.
+        
+        Тренировки лет до последних keep_years календарных лет переносятся
+        в файл архива года, в основной базе вместо них остаются годовые
+        итоги участников. После переноса VACUUM возвращает освободившееся
+        место. Возвращает словарь год -> перенесено тренировок.
+        """
+        first_hot = f"{datetime.now(timezone.utc).year - keep_years + 1}-01-01"
+        moved = {}
+        conn = self.get_connection()
+        try:
+            while True:
+                oldest = conn.execute('SELECT MIN(record_date) FROM workouts').fetchone()[0]
+                if oldest is None or oldest >= first_hot:
+                    break
+                year = int(oldest[:4])
+                moved[year] = self.archive_year(conn, year)
+            
+            if moved and vacuum:
+                conn.execute('VACUUM')
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        return moved
+    
+    def archive_year(self, conn, year):
+        """Перенос тренировок года в файл архива, возвращает число тренировок.
+        
+        Копирование в архив и удаление из основной базы - отдельные
+        транзакции, удаляются только строки, уже записанные в архив,
+        поэтому прерванный перенос безопасно повторяется. Годовые итоги
+        записываются в одной транзакции с удалением.
+        """
+        bounds = (f"{year}-01-01", f"{year + 1}-01-01")
+        os.makedirs(self.archive_dir, exist_ok=True)
+        conn.execute('ATTACH DATABASE ? AS archive', (self.archive_path(year),))
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS archive.workouts (
+                    id INTEGER PRIMARY KEY,
+                    record_date TIMESTAMP NOT NULL,
+                    distance REAL NOT NULL,
+                    duration INTEGER NOT NULL,
+                    telegram_username TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS archive.idx_workouts_username_date
+                ON workouts (telegram_username, record_date)
+            ''')
+            with conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO archive.workouts (id, record_date, distance, duration, telegram_username)
+                    SELECT id, record_date, distance, duration, telegram_username
+                    FROM main.workouts
+                    WHERE record_date >= ? AND record_date < ?
+                ''', bounds)
+            
+            with conn:
+                conn.execute('''
+                    INSERT INTO main.yearly_summaries (telegram_username, year, workouts, distance, duration)
+                    SELECT telegram_username, ?, COUNT(*), SUM(distance), SUM(duration)
+                    FROM main.workouts
+                    WHERE record_date >= ? AND record_date < ? AND id IN (SELECT id FROM archive.workouts)
+                    GROUP BY telegram_username
+                    ON CONFLICT (telegram_username, year) DO UPDATE SET
+                        workouts = workouts + excluded.workouts,
+                        distance = distance + excluded.distance,
+                        duration = duration + excluded.duration
+                ''', (year, *bounds))
+                # Помесячные итоги года удаляются триггерами вместе с тренировками
+                cursor = conn.execute('''
+                    DELETE FROM main.workouts
+                    WHERE record_date >= ? AND record_date < ? AND id IN (SELECT id FROM archive.workouts)
+                ''', bounds)
+        finally:
+            conn.execute('DETACH DATABASE archive')
+        
+        logger.info(f"Archived {cursor.rowcount} workouts of {year} to {self.archive_path(year)}")
+        return cursor.rowcount
+    
+    @track('db_query')
+    def export(self, fmt='xlsx', start=None, end=None):
+        """Потоковый экспорт данных во временный файл.
+        
+        start и end ограничивают дату тренировок ('YYYY-MM-DD', конец не включительно).
+        Возвращает путь к файлу, удалить файл должен вызывающий.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+        
+        # Отдельный файл на каждый запрос, чтобы параллельные выгрузки не мешали друг другу
+        fd, path = tempfile.mkstemp(prefix='running_club_export_', suffix=f'.{fmt}')
+        os.close(fd)
+        
+        conn = self.get_connection()
+        try:
+            if fmt == 'xlsx':
+                self.write_xlsx(conn, path, start, end)
+            else:
+                self.write_csv(conn, path, start, end, compress=(fmt == 'csv.gz'))
+        except Exception:
+            os.remove(path)
+            raise
+        finally:
+            conn.close()
+        
+        return path
+    
+    def export_to_excel(self, start=None, end=None):
+        """Экспорт данных в Excel"""
+        return self.export('xlsx', start, end)
+    
+    def iter_workout_tables(self, conn, start=None, end=None):
+        """Таблицы тренировок для экспорта за [start, end): архивы по годам, затем основная.
+        
+        Файл архива подключается на время чтения своей таблицы, поэтому
+        число лет в архиве не упирается в лимит ATTACH.
+        """
+        for year in self.get_archived_years(conn):
+            if (start and f"{year + 1}-01-01" <= start) or (end and end <= f"{year}-01-01"):
+                continue
+            self.attach_archive(conn, year)
+            yield f'archive_{year}.workouts'
+            conn.execute(f'DETACH DATABASE archive_{year}')
+        yield 'workouts'
+    
+    def write_xlsx(self, conn, path, start, end):
+        """Запись листов никнеймов и тренировок в Excel построчно"""
+        from openpyxl import Workbook
+        
+        # В режиме write_only строки сразу уходят в файл, а не копятся в памяти
+        workbook = Workbook(write_only=True)
+        workouts_filter, params = get_date_filter(start, end)
+        
+        sheet = workbook.create_sheet('Никнеймы')
+        cursor = conn.execute('SELECT * FROM nicknames ORDER BY id')
+        sheet.append([column[0] for column in cursor.description])
+        for row in iter_rows(cursor):
+            sheet.append(row)
+        
+        sheet = workbook.create_sheet('Тренировки')
+        header = False
+        for table in self.iter_workout_tables(conn, start, end):
+            cursor = conn.execute(f'SELECT * FROM {table} AS workouts WHERE {workouts_filter} ORDER BY id', params)
+            if not header:
+                sheet.append([column[0] for column in cursor.description])
+                header = True
+            for row in iter_rows(cursor):
+                sheet.append(row)
+        
+        workbook.save(path)
+    
+    def write_csv(self, conn, path, start, end, compress=False):
+        """Запись тренировок с никнеймами в CSV построчно"""
+        workouts_filter, params = get_date_filter(start, end)
+        
+        if compress:
+            file = gzip.open(path, 'wt', encoding='utf-8', newline='')
+        else:
+            # BOM нужен, чтобы Excel правильно открыл кириллицу
+            file = open(path, 'w', encoding='utf-8-sig', newline='')
+        
+        with file:
+            writer = csv.writer(file)
+            header = False
+            for table in self.iter_workout_tables(conn, start, end):
+                cursor = conn.execute(f'''
+                    SELECT workouts.id, workouts.record_date, workouts.telegram_username,
+                           nicknames.nickname, workouts.distance, workouts.duration
+                    FROM {table} AS workouts
+                    LEFT JOIN nicknames ON nicknames.telegram_username = workouts.telegram_username
+                    WHERE {workouts_filter}
+                    ORDER BY workouts.id
+                ''', params)
+                if not header:
+                    writer.writerow([column[0] for column in cursor.description])
+                    header = True
+                for rows in iter_chunks(cursor):
+                    writer.writerows(rows)
+    
+    @track('db_query')
     def backup_database(self):
         """Создание резервной копии базы данных"""
-        import shutil
-        shutil.copy2(self.db_name, BACKUP_NAME)
-        logger.info(f"Backup created: {BACKUP_NAME}")
+        return BackupManager(self.db_name, self.backup_dir).create_backup()
+    
+    def list_backups(self):
+        """Список резервных копий, новые первыми"""
+        return BackupManager(self.db_name, self.backup_dir).list_backups()
+    
+    def find_backup(self, key):
+        """Имя резервной копии по короткому ключу или None"""
+        return BackupManager(self.db_name, self.backup_dir).find_backup(key)
+    
+    @track('db_query')
+    def ship_delta(self):
+        """Выгрузка изменений с последней выгрузки в файл"""
+        return BackupManager(self.db_name, self.backup_dir).ship_delta()
+    
+    @track('db_query')
+    def restore_from_backup(self, name=None, until=None):
+        """Восстановление из резервной копии (по умолчанию из последней) или на момент until"""
+        name = BackupManager(self.db_name, self.backup_dir).restore(name, until)
+        # Копия может быть сделана до последних миграций
+        self.init_db()
+        self.invalidate_nicknames()
+        self.invalidate_ranks()
+        with self.state_lock:
+            self.state = None
+        return name
+
+
+class AsyncDatabase:
+    """Асинхронный доступ к базе данных.
+
+    Все запросы Database выполняются в отдельном пуле потоков,
+    поэтому медленный запрос не блокирует цикл событий бота.
+    """
+    def __init__(self, db_name=config.DATABASE_NAME, max_workers=config.DB_WORKERS,
+                 batch_size=config.WRITE_BATCH_SIZE, batch_delay=config.WRITE_BATCH_DELAY,
+                 backup_dir=config.BACKUP_DIR):
+        self.db = Database(db_name, backup_dir)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='db')
+        
+        # Очередь записи: тренировки и никнеймы сбрасываются пачками
+        # по достижении batch_size записей или через batch_delay секунд
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.write_queue = None
+        self.writer_task = None
+        
+        # Кэш отчетов, сбрасывается при каждой записи
+        self.report_cache = ReportCache()
+        
+        # Уже записанные чаты участников: telegram_username -> chat_id
+        self.known_members = {}
+    
+    async def run(self, func, *args, **kwargs):
+        """Выполнение синхронного вызова в пуле потоков базы данных"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    async def enqueue_write(self, kind, params):
+        """Постановка записи в очередь и ожидание фиксации транзакции"""
+        if self.writer_task is None:
+            self.write_queue = asyncio.Queue()
+            self.writer_task = asyncio.create_task(self.writer())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((kind, params, future))
+        return await future
+    
+    async def writer(self):
+        """Сбор записей из очереди в пачки и их запись в базу"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        
+        while not stopping:
+            item = await self.write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.batch_delay
+            
+            while len(batch) < self.batch_size:
+                try:
+                    if self.write_queue.empty():
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        item = await asyncio.wait_for(self.write_queue.get(), timeout)
+                    else:
+                        item = self.write_queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self.flush(batch)
+    
+    async def flush(self, batch):
+        """Запись пачки одной транзакцией и уведомление ожидающих"""
+        workouts = [params for kind, params, _ in batch if kind == 'workout']
+        nicknames = [params for kind, params, _ in batch if kind == 'nickname']
+        members = [params for kind, params, _ in batch if kind == 'member']
+        
+        try:
+            await self.run(self.db.write_batch, workouts, nicknames, members)
+        except Exception as e:
+            logger.error(f"Batch write error: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self.report_cache.invalidate()
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+    
+    async def add_nickname(self, telegram_username, nickname):
+        """Добавление или обновление никнейма"""
+        return await self.enqueue_write('nickname', (telegram_username, nickname))
+    
+    async def get_nickname(self, telegram_username):
+        """Получение никнейма пользователя"""
+        # Попадание в кэш не требует обращения к пулу потоков
+        nickname = self.db.nickname_cache.get(telegram_username, NOT_CACHED)
+        if nickname is not NOT_CACHED:
+            return nickname
+        return await self.run(self.db.get_nickname, telegram_username)
+    
+    async def add_workout(self, telegram_username, distance, duration):
+        """Добавление тренировки"""
+        return await self.enqueue_write('workout', (telegram_username, distance, duration))
+    
+    async def remember_member(self, telegram_username, chat_id):
+        """Запись чата участника для рассылок (только при первом обращении или смене чата)"""
+        if self.known_members.get(telegram_username) == chat_id:
+            return
+        await self.enqueue_write('member', (telegram_username, chat_id))
+        self.known_members[telegram_username] = chat_id
+    
+    async def set_notify(self, telegram_username, chat_id, notify):
+        """Подписка на рассылку итогов или отписка"""
+        await self.run(self.db.set_notify, telegram_username, chat_id, notify)
+        self.known_members[telegram_username] = chat_id
+    
+    async def get_period_summaries(self, period):
+        """Итоги всех участников рассылки за период"""
+        return await self.run(self.db.get_period_summaries, period)
+    
+    async def has_broadcast(self, key):
+        """Подготовлена ли рассылка"""
+        return await self.run(self.db.has_broadcast, key)
+    
+    async def prepare_broadcast(self, key, messages):
+        """Постановка рассылки в очередь исходящих"""
+        return await self.run(self.db.prepare_broadcast, key, messages)
+    
+    async def get_due_messages(self, limit):
+        """Сообщения очереди, готовые к отправке"""
+        return await self.run(self.db.get_due_messages, limit)
+    
+    async def has_pending_messages(self):
+        """Есть ли неотправленные сообщения"""
+        return await self.run(self.db.has_pending_messages)
+    
+    async def update_message(self, message_id, status, error=None, delay=0, attempt=True):
+        """Запись результата отправки сообщения"""
+        await self.run(self.db.update_message, message_id, status, error, delay, attempt)
+    
+    async def unsubscribe_chat(self, chat_id):
+        """Отключение рассылок для заблокировавшего бота чата"""
+        await self.run(self.db.unsubscribe_chat, chat_id)
+    
+    async def prune_outbox(self):
+        """Удаление старых обработанных сообщений"""
+        return await self.run(self.db.prune_outbox)
+    
+    async def import_workouts(self, workouts):
+        """Запись пачки импортированных тренировок"""
+        try:
+            return await self.run(self.db.import_workouts, workouts)
+        finally:
+            self.report_cache.invalidate()
+    
+    async def get_statistics(self, period='all', username=None):
+        """Получение статистики (с кэшированием до следующей записи)"""
+        key = ('statistics', period, get_period_bounds(period), username)
+        generation = self.report_cache.generation
+        stats = self.report_cache.get(key)
+        if stats is None:
+            stats = await self.run(self.db.get_statistics, period=period, username=username)
+            self.report_cache.put(key, stats, generation)
+        return stats
+    
+    async def get_leaderboard_page(self, period='all', page=0, page_size=config.LEADERBOARD_PAGE_SIZE):
+        """Страница рейтинга (с кэшированием до следующей записи)"""
+        key = ('leaderboard', period, get_period_bounds(period), page, page_size)
+        generation = self.report_cache.generation
+        result = self.report_cache.get(key)
+        if result is None:
+            result = await self.run(self.db.get_leaderboard_page, period, page, page_size)
+            self.report_cache.put(key, result, generation)
+        return result
+    
+    async def get_rank(self, period, username):
+        """Место участника за период"""
+        return await self.run(self.db.get_rank, period, username)
+    
+    async def get_personal_report(self, period, username):
+        """Подробный отчет участника (с кэшированием до следующей записи)"""
+        # Текущая серия зависит от сегодняшней даты
+        key = ('personal_report', period, get_period_bounds(period), username,
+               datetime.now(timezone.utc).date())
+        generation = self.report_cache.generation
+        report = self.report_cache.get(key)
+        if report is None:
+            report = await self.run(self.db.get_personal_report, period, username)
+            self.report_cache.put(key, report, generation)
+        return report
+    
+    async def get_progress_series(self, period, username):
+        """Данные графиков прогресса (с кэшированием до следующей записи)"""
+        key = ('progress_series', period, get_period_bounds(period), username,
+               datetime.now(timezone.utc).date())
+        generation = self.report_cache.generation
+        series = self.report_cache.get(key)
+        if series is None:
+            series = await self.run(self.db.get_progress_series, period, username)
+            self.report_cache.put(key, series, generation)
+        return series
+    
+    async def export(self, fmt='xlsx', start=None, end=None):
+        """Потоковый экспорт данных во временный файл"""
+        return await self.run(self.db.export, fmt, start, end)
+    
+    async def export_to_excel(self, start=None, end=None):
+        """Экспорт данных в Excel"""
+        return await self.run(self.db.export_to_excel, start, end)
+    
+    async def archive_workouts(self):
+        """Перенос тренировок старых лет в годовые архивы"""
+        try:
+            return await self.run(self.db.archive_workouts)
+        finally:
+            self.report_cache.invalidate()
+    
+    async def warm_up(self):
+        """Загрузка состояния клуба в память до первого запроса (режим memory)"""
+        if self.db.memory:
+            await self.run(self.db.get_state)
+    
+    async def backup_database(self):
+        """Создание резервной копии базы данных"""
+        return await self.run(self.db.backup_database)
+    
+    async def list_backups(self):
+        """Список резервных копий, новые первыми"""
+        return await self.run(self.db.list_backups)
+    
+    async def find_backup(self, key):
+        """Имя резервной копии по короткому ключу или None"""
+        return await self.run(self.db.find_backup, key)
     
-    def restore_from_backup(self):
+    async def ship_delta(self):
+        """Выгрузка изменений с последней выгрузки в файл"""
+        return await self.run(self.db.ship_delta)
+    
+    async def restore_from_backup(self, name=None, until=None):
         """Восстановление из резервной копии"""
-        import shutil
-        shutil.copy2(BACKUP_NAME, self.db_name)
-        logger.info(f"Database restored from {BACKUP_NAME}")
+        try:
+            return await self.run(self.db.restore_from_backup, name, until)
+        finally:
+            self.report_cache.invalidate()
+            self.known_members.clear()
+    
+    async def close(self, wait=True):
+        """Запись оставшейся очереди и остановка пула потоков.
+        
+        С wait=False уже начатые запросы дорабатывают в фоне, цикл событий не ждет их.
+        """
+        if self.writer_task is not None:
+            await self.write_queue.put(None)
+            await self.writer_task
+            self.writer_task = None
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,114 @@
+"""Параллельная обработка обновлений с сохранением порядка для каждого участника"""
+import asyncio
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+import config
+from metrics import metrics
+
+
+def update_key(update):
+    """Ключ очереди обновления: участник, для обновлений без участника - чат, иначе None"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return 'user', user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return 'chat', chat.id
+    return None
+
+
+class UpdateQueue(asyncio.Queue):
+    """Очередь приема обновлений, которая отдает обновление, только когда процессор готов его принять.
+
+    Пока процессор занят, обновления копятся здесь, а когда очередь
+    заполнена, Updater перестает забирать их у Telegram (long polling) или
+    задерживает ответ на запрос webhook.
+    """
+    def __init__(self, admission, maxsize):
+        super().__init__(maxsize)
+        self.admission = admission
+
+    async def get(self):
+        await self.admission.acquire()
+        try:
+            return await super().get()
+        except BaseException:
+            self.admission.release()
+            raise
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных участников.
+
+    Обновления одного участника обрабатываются по одному в порядке
+    поступления, поэтому состояния диалогов ConversationHandler
+    (WAITING_TRAINING, WAITING_NICKNAME) меняются так же, как при
+    последовательной обработке. Обработчиков одновременно не больше
+    concurrency, а обновление, ждущее предыдущих обновлений своего
+    участника, слот не занимает и других участников не задерживает.
+    Принятых обновлений не больше max_pending: следующие остаются в queue.
+    """
+    def __init__(self, concurrency=config.UPDATE_CONCURRENCY, max_pending=config.UPDATE_MAX_PENDING):
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        self.admission = asyncio.Semaphore(max_pending)
+        self.queue = UpdateQueue(self.admission, max_pending)
+        # Ключ -> [блокировка очереди участника, его принятых обновлений]
+        self.keys = {}
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+
+    async def initialize(self):
+        """Подготовка не нужна: семафоры и очередь создаются в конструкторе"""
+
+    async def shutdown(self):
+        """Освобождать нечего"""
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        received = time.perf_counter()
+        self.pending += 1
+        try:
+            if key is None:
+                await self.run(coroutine, 'other', received)
+                return
+            entry = self.keys.get(key)
+            if entry is None:
+                entry = self.keys[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                # asyncio.Lock пропускает ожидающих по очереди, в порядке поступления
+                async with entry[0]:
+                    await self.run(coroutine, key[0], received)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.keys[key]
+        finally:
+            self.pending -= 1
+            self.admission.release()
+
+    async def run(self, coroutine, kind, received):
+        """Обработка обновления, когда подошла очередь участника и освободился слот"""
+        async with self.slots:
+            metrics.observe('update_wait', kind, time.perf_counter() - received)
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    def stats(self):
+        """Обновления в очереди приема, в ожидании, в обработке и обработанные"""
+        return {
+            'queued': self.queue.qsize(),
+            'waiting': self.pending - self.running,
+            'running': self.running,
+            'keys': len(self.keys),
+            'processed': self.processed,
+        }
@@ -0,0 +1,275 @@
+"""Локальная замена Telegram Bot API для нагрузочных проверок
+
+Сервер понимает методы, которыми пользуется бот: отдает обновления через
+getUpdates или, после setWebhook, отправляет их POST-запросами на адрес
+бота, и записывает ответы бота (sendMessage, editMessageText,
+sendDocument), чтобы их можно было дождаться по чату.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Telegram размечает командами только латинские имена
+COMMAND_PATTERN = re.compile(r'^/[A-Za-z0-9_]+(@\w+)?')
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Running Club', 'username': 'running_club_bot'}
+
+
+def user_dict(user_id, username=None):
+    """Пользователь Telegram в формате Bot API"""
+    return {'id': user_id, 'is_bot': False, 'first_name': username or str(user_id), 'username': username}
+
+
+def chat_dict(chat_id):
+    """Чат в формате Bot API: положительный id - личный чат, отрицательный - группа"""
+    if chat_id > 0:
+        return {'id': chat_id, 'type': 'private'}
+    return {'id': chat_id, 'type': 'group', 'title': f"Club {-chat_id}"}
+
+
+def parse_body(content_type, body):
+    """Параметры запроса из form-urlencoded, multipart или JSON"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            # Файлы сохраняются только размером, содержимое проверкам не нужно
+            if part.get_filename():
+                params[name] = {'file_name': part.get_filename(), 'file_size': len(payload)}
+            else:
+                params[name] = payload.decode('utf-8')
+        return params
+    return dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+
+
+class FakeBotAPI:
+    """HTTP-сервер с поведением Bot API для одного бота.
+
+    Обновления добавляются через send_message и press_button, ответы бота
+    ждутся через wait_reply. Каждому личному чату соответствует своя очередь
+    ответов, в группе ответ попадает в очередь участника, которому отвечает бот.
+    latency - задержка ответа на запросы бота, кроме getUpdates, как у сети до Telegram.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.server = None
+        self.updates = []
+        self.new_updates = asyncio.Condition()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.replies = defaultdict(asyncio.Queue)
+        # Сообщения в группах: message_id -> участник, к которому относится сообщение
+        self.owners = {}
+        self.calls = Counter()
+        self.delivered = 0
+        self.connections = set()
+        self.webhook = None
+        self.client = None
+
+    @property
+    def url(self):
+        """Адрес для ApplicationBuilder.base_url"""
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        """Запуск сервера на свободном порту"""
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Fake Bot API listening on {self.url}")
+
+    async def stop(self):
+        """Остановка сервера вместе с открытыми соединениями"""
+        self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await self.server.wait_closed()
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def handle_connection(self, reader, writer):
+        """Обработка HTTP/1.1 запросов одного соединения (keep-alive)"""
+        self.connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                url = urlsplit(target)
+                params = dict(parse_qsl(url.query))
+                params.update(parse_body(headers.get('content-type', ''), body))
+
+                status, result = await self.dispatch(url.path.rsplit('/', 1)[-1], params)
+                payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1') + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Соединение закрыто клиентом или сервер останавливается
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def dispatch(self, method, params):
+        """Вызов метода Bot API, возвращает HTTP-статус и тело ответа"""
+        self.calls[method] += 1
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+        if self.latency and method != 'getUpdates':
+            await asyncio.sleep(self.latency)
+        return 200, {'ok': True, 'result': await handler(params)}
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_setWebhook(self, params):
+        """Доставка обновлений POST-запросами вместо getUpdates"""
+        self.webhook = (params['url'], params.get('secret_token'))
+        logger.info(f"Webhook set to {params['url']}")
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    async def api_getUpdates(self, params):
+        """Длинный опрос: ждет новые обновления не дольше timeout секунд"""
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        timeout = float(params.get('timeout', 0))
+
+        async with self.new_updates:
+            # Обновления до offset подтверждены ботом
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self.new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self.updates[:limit]
+
+        self.delivered += len(batch)
+        return batch
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+    async def api_sendMessage(self, params):
+        return self.record_reply('sendMessage', params, {'text': params['text']})
+
+    async def api_editMessageText(self, params):
+        return self.record_reply('editMessageText', params, {'text': params['text']})
+
+    async def api_sendDocument(self, params):
+        document = dict(params['document'], file_id=f"file{next(self.message_ids)}", file_unique_id='u')
+        return self.record_reply('sendDocument', params, {'document': document, 'caption': params.get('caption')})
+
+    def record_reply(self, method, params, content):
+        """Сообщение бота в чат: сохраняется в очередь ответов этого чата"""
+        chat_id = int(params['chat_id'])
+        message_id = int(params['message_id']) if 'message_id' in params else next(self.message_ids)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': chat_dict(chat_id),
+            'from': BOT_USER,
+            **content,
+        }
+        if 'reply_markup' in params:
+            message['reply_markup'] = json.loads(params['reply_markup'])
+        recipient = chat_id
+        if chat_id < 0:
+            # В группе бот отвечает на сообщение участника или правит свое
+            recipient = self.owners.get(int(params.get('reply_to_message_id') or message_id))
+            self.owners[message_id] = recipient
+        self.replies[recipient].put_nowait((method, message, time.perf_counter()))
+        return message
+
+    async def push_update(self, update):
+        """Новое обновление для бота"""
+        update['update_id'] = next(self.update_ids)
+        if self.webhook:
+            await self.post_update(update)
+            return update
+        async with self.new_updates:
+            self.updates.append(update)
+            self.new_updates.notify_all()
+        return update
+
+    async def post_update(self, update):
+        """Отправка обновления на webhook бота, как это делает Telegram"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=40))
+        url, secret = self.webhook
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        response = await self.client.post(url, json=update, headers=headers)
+        response.raise_for_status()
+        self.delivered += 1
+
+    async def send_message(self, user_id, username, text, chat_id=None):
+        """Сообщение пользователя в личном чате с ботом или в группе chat_id"""
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': chat_dict(chat_id or user_id),
+            'from': user_dict(user_id, username),
+            'text': text,
+        }
+        if chat_id:
+            self.owners[message['message_id']] = user_id
+        command = COMMAND_PATTERN.match(text)
+        if command:
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': command.end()}]
+        return await self.push_update({'message': message})
+
+    async def press_button(self, user_id, username, message, data):
+        """Нажатие инлайн-кнопки под сообщением бота"""
+        return await self.push_update({'callback_query': {
+            'id': str(next(self.callback_ids)),
+            'from': user_dict(user_id, username),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        }})
+
+    async def wait_reply(self, chat_id, timeout=30):
+        """Следующий ответ бота в чат: (метод, сообщение, время получения)"""
+        return await asyncio.wait_for(self.replies[chat_id].get(), timeout)
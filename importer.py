@@ -0,0 +1,259 @@
+"""Потоковый импорт тренировок из CSV и GPX/TCX-файлов (в том числе в zip)"""
+import codecs
+import csv
+import gzip
+import io
+import math
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+
+import config
+
+# Названия столбцов CSV: столбец экспорта -> допустимые заголовки
+CSV_COLUMNS = {
+    'record_date': ('record_date', 'date', 'дата', 'дата тренировки'),
+    'distance': ('distance', 'distance_km', 'дистанция', 'км'),
+    'duration': ('duration', 'duration_min', 'время', 'минуты'),
+    'telegram_username': ('telegram_username', 'username', 'пользователь'),
+}
+
+# Форматы дат в CSV, кроме ISO 8601
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d.%m.%Y %H:%M', '%d.%m.%Y')
+
+# Границы правдоподобной тренировки
+MAX_DISTANCE = 300  # км
+MAX_DURATION = 3000  # минут
+
+# Сколько ошибок показывать в отчете
+ERROR_SAMPLES = 10
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def parse_date(text):
+    """Дата тренировки в UTC в формате базы 'YYYY-MM-DD HH:MM:SS'"""
+    text = text.strip()
+    try:
+        moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        for date_format in DATE_FORMATS:
+            try:
+                moment = datetime.strptime(text, date_format)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"непонятная дата '{text}'")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Расстояние между точками в километрах"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def local_name(tag):
+    """Имя XML-элемента без пространства имен"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def iterparse_pruned(file, prune):
+    """События разбора XML: ('start' или 'end', элемент, имя без пространства имен).
+
+    Элементы с именами из prune после события 'end' удаляются из родителя.
+    element.clear() оставляет в дереве пустой элемент на каждую точку,
+    а удаленный элемент освобождается целиком, поэтому память не растет
+    с длиной трека.
+    """
+    parents = []
+    for event, element in ElementTree.iterparse(file, events=('start', 'end')):
+        name = local_name(element.tag)
+        if event == 'start':
+            parents.append(element)
+            yield event, element, name
+            continue
+        parents.pop()
+        yield event, element, name
+        if name in prune and parents:
+            parents[-1].remove(element)
+
+
+def read_csv(file, source):
+    """Строки CSV: (источник, дата, дистанция, время, пользователь или None)"""
+    reader = csv.reader(codecs.getreader('utf-8-sig')(file))
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = {}
+    for column, names in CSV_COLUMNS.items():
+        for index, name in enumerate(header):
+            if name in names:
+                columns[column] = index
+                break
+    missing = {'record_date', 'distance', 'duration'} - set(columns)
+    if missing:
+        raise ValueError(f"нет столбцов {', '.join(sorted(missing))}")
+
+    for line, row in enumerate(reader, 2):
+        if not any(row):
+            continue
+        try:
+            username = row[columns['telegram_username']].strip() if 'telegram_username' in columns else None
+            yield (f"{source}:{line}", row[columns['record_date']],
+                   row[columns['distance']], row[columns['duration']], username or None)
+        except IndexError:
+            yield f"{source}:{line}", None, None, None, None
+
+
+def read_gpx(file, source):
+    """Трек GPX: начало, дистанция по точкам и время от первой до последней точки"""
+    distance = 0.0
+    previous = None
+    started = finished = None
+    point = None
+    for event, element, name in iterparse_pruned(file, {'trkpt'}):
+        if event == 'start' and name == 'trkpt':
+            lat, lon = element.get('lat'), element.get('lon')
+            if lat is None or lon is None:
+                raise ValueError("точка трека без координат")
+            point = (float(lat), float(lon))
+        elif event == 'end' and name == 'time' and point is not None:
+            if not element.text:
+                raise ValueError("точка трека без времени")
+            moment = datetime.fromisoformat(element.text.strip().replace('Z', '+00:00'))
+            started = started or moment
+            finished = moment
+        elif event == 'end' and name == 'trkpt':
+            if previous is not None:
+                distance += haversine(*previous, *point)
+            previous, point = point, None
+    if started is None:
+        yield source, None, None, None, None
+        return
+    yield source, started.isoformat(), distance, (finished - started).total_seconds() / 60, None
+
+
+def read_tcx(file, source):
+    """Активность TCX: сумма дистанции и времени по кругам"""
+    distance = duration = 0.0
+    started = None
+    laps = 0
+    for event, element, name in iterparse_pruned(file, {'Lap', 'Trackpoint'}):
+        if event == 'start' and name == 'Lap' and started is None:
+            started = element.get('StartTime')
+        elif event == 'end' and name == 'Lap':
+            for child in element:
+                if local_name(child.tag) == 'TotalTimeSeconds':
+                    duration += float(child.text)
+                elif local_name(child.tag) == 'DistanceMeters':
+                    distance += float(child.text) / 1000
+            laps += 1
+    if not laps or started is None:
+        yield source, None, None, None, None
+        return
+    yield source, started, distance, duration / 60, None
+
+
+READERS = {'.csv': read_csv, '.gpx': read_gpx, '.tcx': read_tcx}
+
+
+def read_file(file, name):
+    """Записи одного файла по его расширению"""
+    lower = name.lower()
+    if lower.endswith('.csv.gz'):
+        with gzip.open(file) as unpacked:
+            yield from read_csv(unpacked, name)
+        return
+    for extension, reader in READERS.items():
+        if lower.endswith(extension):
+            yield from reader(file, name)
+            return
+    raise ValueError("неподдерживаемый формат")
+
+
+def iter_files(path, name):
+    """Файлы из загрузки: сам файл или файлы zip-архива, (имя, открытый файл)"""
+    if name.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if member.is_dir() or member.filename.startswith('__MACOSX/'):
+                    continue
+                with archive.open(member) as file:
+                    yield member.filename, io.BufferedReader(file)
+    else:
+        with open(path, 'rb') as file:
+            yield name, file
+
+
+class WorkoutImport:
+    """Импорт тренировок из файла с подсчетом результатов.
+
+    Файл читается потоком и отдается пачками проверенных строк
+    (пользователь, дата, дистанция, время), поэтому память не зависит
+    от размера файла. Без allow_usernames все тренировки записываются
+    на username, столбец пользователя в CSV игнорируется.
+    """
+    def __init__(self, path, name, username, allow_usernames=False):
+        self.path = path
+        self.name = name
+        self.username = username
+        self.allow_usernames = allow_usernames
+        self.read = 0
+        self.added = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.error_samples = []
+        self.now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    def validate(self, source, record_date, distance, duration, username):
+        """Проверенная строка для записи, ValueError при ошибке"""
+        if record_date is None:
+            raise ValueError("нет данных тренировки")
+        record_date = parse_date(record_date) if isinstance(record_date, str) else record_date
+        distance = round(float(str(distance).replace(',', '.')), 2)
+        duration = int(round(float(str(duration).replace(',', '.'))))
+        if not 0 < distance <= MAX_DISTANCE:
+            raise ValueError(f"дистанция {distance} км вне диапазона")
+        if not 0 < duration <= MAX_DURATION:
+            raise ValueError(f"время {duration} мин вне диапазона")
+        if record_date > self.now:
+            raise ValueError(f"дата {record_date} в будущем")
+        if not (self.allow_usernames and username):
+            username = self.username
+        return username.lstrip('@'), record_date, distance, duration
+
+    def batches(self, size=config.IMPORT_BATCH_SIZE):
+        """Проверенные строки пачками по size штук"""
+        batch = []
+        for name, file in iter_files(self.path, self.name):
+            records = read_file(file, name)
+            while True:
+                # Испорченный файл в архиве (битый CSV, gzip или XML) не
+                # прерывает импорт остальных и попадает в отчет об ошибках
+                try:
+                    source, *record = next(records)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    self.add_error(name, e)
+                    break
+                self.read += 1
+                try:
+                    batch.append(self.validate(source, *record))
+                except ValueError as e:
+                    self.add_error(source, e)
+                    continue
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def add_error(self, source, error):
+        """Учет ошибки файла или строки, первые ERROR_SAMPLES сохраняются для отчета"""
+        self.errors += 1
+        if len(self.error_samples) < ERROR_SAMPLES:
+            self.error_samples.append(f"{source}: {error}")
@@ -0,0 +1,289 @@
+"""Нагрузочная проверка бота через локальный Bot API
+
+Бот собирается так же, как в main(), и получает обновления от
+fake_telegram.FakeBotAPI. Симулированные участники записывают тренировки,
+открывают статистику и выгружают базу, дожидаясь ответа на каждый шаг.
+С --tenants участники распределяются по групповым чатам, у каждого из
+которых своя база клуба (MULTI_CLUB=1). --concurrency задает
+UPDATE_CONCURRENCY, --api-latency - задержку ответов Bot API, сценарий
+burst отправляет шаги диалога не дожидаясь ответов бота.
+    python loadtest.py [--users 200] [--duration 30] [--transport webhook] [--tenants 300] [--concurrency 16] [--api-latency 0.05] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from fake_telegram import FakeBotAPI
+
+# Кнопки меню статистики и личной статистики
+RATING_BUTTONS = ('rating_all', 'rating_year', 'rating_quarter', 'rating_month', 'rating_week')
+STATS_BUTTONS = (
+    'stats_week', 'stats_last_week', 'stats_month', 'stats_last_month', 'stats_quarter', 'stats_last_quarter',
+    'stats_year', 'stats_last_year', 'stats_all',
+)
+
+# Первый симулированный участник, остальные идут по порядку
+FIRST_USER_ID = 100000
+
+# Первый групповой чат клуба, остальные идут вниз по порядку
+FIRST_CLUB_CHAT_ID = -1000000
+
+
+class UnexpectedReply(Exception):
+    """Бот ответил не тем сообщением, которого ждет сценарий"""
+
+
+class SimulatedUser:
+    """Участник клуба: отправляет сообщения и замеряет время до ответа бота"""
+    def __init__(self, api, user_id, rng, latencies, reply_timeout=10, chat_id=None):
+        self.api = api
+        self.user_id = user_id
+        self.username = f"runner{user_id - FIRST_USER_ID}"
+        self.rng = rng
+        self.latencies = latencies
+        self.reply_timeout = reply_timeout
+        # Групповой чат клуба или None - личный чат с ботом
+        self.chat_id = chat_id
+
+    def send(self, text):
+        """Сообщение участника в его чат"""
+        return self.api.send_message(self.user_id, self.username, text, self.chat_id)
+
+    async def step(self, name, send):
+        """Отправка обновления и ожидание ответа в чат, возвращает сообщение бота"""
+        started = time.perf_counter()
+        await send
+        _, message, received = await self.api.wait_reply(self.user_id, self.reply_timeout)
+        self.latencies[name].append(received - started)
+        return message
+
+    async def record_training(self):
+        """Запись тренировки через диалог"""
+        await self.step('training.start', self.send('/записать_тренировку'))
+        distance = round(self.rng.lognormvariate(1.9, 0.35), 1)
+        minutes = int(distance * self.rng.gauss(6.0, 0.6))
+        await self.step('training.input', self.send(f"{distance} {minutes}"))
+
+    async def record_training_burst(self):
+        """Запись тренировки без ожидания вопроса бота: команда и ответ отправляются подряд.
+
+        Проверяет, что обновления участника обрабатываются по порядку:
+        иначе ответ приходит раньше, чем диалог ждет тренировку.
+        """
+        distance = round(self.rng.lognormvariate(1.9, 0.35), 1)
+        minutes = int(distance * self.rng.gauss(6.0, 0.6))
+        started = time.perf_counter()
+        await self.send('/записать_тренировку')
+        await self.send(f"{distance} {minutes}")
+        for _ in range(2):
+            _, message, received = await self.api.wait_reply(self.user_id, self.reply_timeout)
+        self.latencies['burst.training'].append(received - started)
+        if 'Тренировка записана' not in message.get('text', ''):
+            raise UnexpectedReply(message.get('text'))
+
+    async def statistics(self):
+        """Рейтинг или личная статистика через меню"""
+        menu = await self.step('statistics.menu', self.send('/статистика'))
+        if self.rng.random() < 0.5:
+            data = self.rng.choice(RATING_BUTTONS)
+            await self.step('statistics.rating', self.api.press_button(self.user_id, self.username, menu, data))
+        else:
+            menu = await self.step('statistics.my_stats', self.api.press_button(self.user_id, self.username, menu, 'my_stats'))
+            data = self.rng.choice(STATS_BUTTONS)
+            await self.step('statistics.personal', self.api.press_button(self.user_id, self.username, menu, data))
+
+    async def export(self):
+        """Выгрузка базы администратором"""
+        fmt = self.rng.choice(('csv', 'csv.gz', 'xlsx'))
+        await self.step(f'export.{fmt}', self.send(f'/database {fmt}'))
+
+
+SCENARIOS = {
+    'training': SimulatedUser.record_training,
+    'statistics': SimulatedUser.statistics,
+    'export': SimulatedUser.export,
+    'burst': SimulatedUser.record_training_burst,
+}
+
+
+def parse_mix(text):
+    """Доли сценариев из строки вида training=6,statistics=3.5,export=0.5"""
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+async def run_user(user, mix, deadline, think_time, errors):
+    """Сценарии одного участника с паузами до окончания прогона"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    # Участники начинают не одновременно
+    await asyncio.sleep(user.rng.uniform(0, think_time))
+    while time.perf_counter() < deadline:
+        name = user.rng.choices(names, weights)[0]
+        try:
+            await SCENARIOS[name](user)
+        except (asyncio.TimeoutError, UnexpectedReply):
+            errors[name] += 1
+        if think_time:
+            await asyncio.sleep(user.rng.expovariate(1 / think_time))
+
+
+def free_port():
+    """Свободный локальный порт для webhook"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def run_load(bot, api, users, duration, mix, think_time, admins, seed, reply_timeout, transport, clubs=0):
+    """Прогон нагрузки на приложение бота, возвращает задержки по шагам и счетчики"""
+    application = bot.build_application(token='123:loadtest', base_url=api.url)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    async with application:
+        await bot.post_init(application)
+        if transport == 'webhook':
+            # Обновления приходят POST-запросами с секретным заголовком, как от Telegram
+            port = free_port()
+            await application.updater.start_webhook(
+                listen='127.0.0.1', port=port, url_path='telegram',
+                webhook_url=f"http://127.0.0.1:{port}/telegram",
+                secret_token='loadtest-secret', allowed_updates=bot.ALLOWED_UPDATES
+            )
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=bot.ALLOWED_UPDATES)
+        await application.start()
+
+        rng = random.Random(seed)
+        simulated = []
+        for number in range(users):
+            chat_id = FIRST_CLUB_CHAT_ID - number % clubs if clubs else None
+            user = SimulatedUser(api, FIRST_USER_ID + number, random.Random(rng.random()),
+                                 latencies, reply_timeout, chat_id)
+            # Выгрузку базы делают только администраторы
+            user_mix = mix if user.user_id in admins else {name: weight for name, weight in mix.items() if name != 'export'}
+            simulated.append((user, user_mix))
+
+        started = time.perf_counter()
+        delivered = api.delivered
+        await asyncio.gather(*(
+            run_user(user, user_mix, started + duration, think_time, errors)
+            for user, user_mix in simulated if user_mix
+        ))
+        elapsed = time.perf_counter() - started
+        delivered = api.delivered - delivered
+
+        await application.updater.stop()
+        await application.stop()
+    await bot.shutdown(application)
+
+    return latencies, errors, delivered, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help='число симулированных участников')
+    parser.add_argument('--admins', type=int, default=2, help='сколько из них администраторов')
+    parser.add_argument('--duration', type=float, default=30, help='длительность прогона, секунды')
+    parser.add_argument('--think-time', type=float, default=1.0, help='средняя пауза между сценариями, секунды')
+    parser.add_argument('--transport', choices=('polling', 'webhook'), default='polling',
+                        help='доставка обновлений боту')
+    parser.add_argument('--reply-timeout', type=float, default=10, help='ожидание ответа бота, секунды')
+    parser.add_argument('--mix', type=parse_mix, default='training=6,statistics=3.5,export=0.5',
+                        help='доли сценариев')
+    parser.add_argument('--members', type=int, default=500, help='участников в синтетической истории клуба')
+    parser.add_argument('--years', type=float, default=1.0, help='лет синтетической истории клуба')
+    parser.add_argument('--tenants', type=int, default=0,
+                        help='число клубов в групповых чатах (0 - все в личных чатах с одной базой)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='обновлений разных участников в обработке одновременно (UPDATE_CONCURRENCY)')
+    parser.add_argument('--api-latency', type=float, default=0, help='задержка ответов Bot API, секунды')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='файл JSON с результатами')
+    parser.add_argument('--compare', help='файл JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        admins = set(range(FIRST_USER_ID, FIRST_USER_ID + args.admins))
+        db_name = os.path.join(tmp, 'loadtest.db')
+        os.environ['DATABASE_NAME'] = db_name
+        os.environ['BACKUP_DIR'] = os.path.join(tmp, 'backups')
+        os.environ['ADMIN_IDS'] = ','.join(map(str, sorted(admins)))
+        os.environ['UPDATE_CONCURRENCY'] = str(args.concurrency)
+        if args.tenants:
+            os.environ['MULTI_CLUB'] = '1'
+            os.environ['TENANTS_DIR'] = os.path.join(tmp, 'clubs')
+
+        # Бот читает настройки при импорте, поэтому импортируется после подмены окружения
+        import bot
+        from benchmark import generate_club, summarize, print_result, describe_environment, compare
+
+        generate_club(db_name, args.members, args.years, args.seed)
+        if args.tenants:
+            # У каждого клуба своя история, участники делятся между клубами
+            os.makedirs(os.environ['TENANTS_DIR'])
+            for number in range(args.tenants):
+                generate_club(os.path.join(os.environ['TENANTS_DIR'], f"{FIRST_CLUB_CHAT_ID - number}.db"),
+                              max(args.members // args.tenants, 10), args.years, args.seed + number)
+
+        async def run():
+            api = FakeBotAPI(latency=args.api_latency)
+            await api.start()
+            try:
+                return await run_load(bot, api, args.users, args.duration, args.mix, args.think_time, admins,
+                                      args.seed, args.reply_timeout, args.transport, args.tenants), dict(api.calls)
+            finally:
+                await api.stop()
+
+        (latencies, errors, delivered, elapsed), calls = asyncio.run(run())
+        environment = describe_environment(db_name)
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    results = {name: summarize(values, elapsed, None) for name, values in sorted(latencies.items())}
+    results['all'] = summarize(all_latencies, elapsed, None)
+    report = {
+        'environment': dict(environment, transport=args.transport, users=args.users, duration=args.duration,
+                            think_time=args.think_time, mix=args.mix, tenants=args.tenants,
+                            concurrency=args.concurrency, api_latency=args.api_latency),
+        'updates_per_sec': round(delivered / elapsed, 1),
+        'errors': dict(errors),
+        'api_calls': calls,
+        'tenants': bot.tenants.stats(),
+        'results': results,
+    }
+
+    print(f"\nУчастников: {args.users}, обновлений: {delivered} за {elapsed:.1f} с "
+          f"({report['updates_per_sec']} в секунду), без ответа: {sum(errors.values())}")
+    if args.tenants:
+        print(f"Клубов: {args.tenants}, открытий баз: {report['tenants']['opened']}, "
+              f"вытеснений: {report['tenants']['evicted']}")
+    for name, result in results.items():
+        print_result(name, result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(report, json.load(file))
+        return 1 if regressions else 0
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Служебные команды для базы данных
+
+Запуск: python manage.py <команда> [--db running_club.db | --chat <id группового чата>]
+"""
+import argparse
+import math
+import os
+import sys
+
+import config
+from database import Database, get_totals_query
+from periods import resolve_period
+from tenants import tenant_paths
+
+
+def rebuild_rollups(db, args):
+    """Пересчет помесячных итогов"""
+    db.rebuild_rollups()
+    print("✅ Помесячные итоги пересчитаны")
+
+
+def check_rollups(db, args):
+    """Сверка помесячных итогов с тренировками"""
+    mismatches = db.check_rollups()
+    for username, month, actual, expected in mismatches:
+        print(f"❌ {username} {month}: итоги {actual}, тренировки {expected}")
+    if mismatches:
+        print(f"Найдено расхождений: {len(mismatches)}")
+        return 1
+    print("✅ Итоги совпадают с тренировками")
+    return 0
+
+
+def explain_periods(db, args):
+    """Планы запросов итогов за периоды: границы должны читаться диапазоном индекса"""
+    conn = db.get_connection()
+    failed = False
+    for key in args.periods:
+        period = resolve_period(key)
+        for username in (None, 'username'):
+            query, params = get_totals_query(period, username)
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+            # Без границ ('all') таблица итогов читается целиком
+            ranged = (period.kind == 'all' and username is None) or any('SEARCH' in step for step in plan)
+            failed = failed or not ranged
+            print(f"{'✅' if ranged else '❌'} {key}{' (участник)' if username else ''}: {'; '.join(plan)}")
+    conn.close()
+    return 1 if failed else 0
+
+
+def same_values(expected, actual):
+    """Совпадение строк результатов с точностью до погрешности сумм дробных чисел"""
+    if len(expected) != len(actual):
+        return False
+    for a, b in zip(expected, actual):
+        if isinstance(a, float) or isinstance(b, float):
+            if a is None or b is None or not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6):
+                return False
+        elif a != b:
+            return False
+    return True
+
+
+def check_state(db, args):
+    """Сверка статистики из столбцов в памяти с запросами SQL"""
+    sql = Database(db.db_name, db.backup_dir, memory=False)
+    memory = Database(db.db_name, db.backup_dir, memory=True)
+    stats = memory.get_state().stats()
+    print(f"Загрузка: {stats['warmup_seconds']:.2f} с, тренировок {stats['rows']}, участников {stats['users']}")
+    print(f"Память: {stats['bytes'] / 1024 / 1024:.1f} МБ, {stats['bytes_per_row']:.1f} байт на тренировку")
+
+    mismatches = 0
+    for key in args.periods:
+        # Порядок равных дистанций в get_statistics не задан, сравниваются отсортированные строки
+        expected = sorted(sql.get_statistics(key))
+        actual = sorted(memory.get_statistics(key))
+        failed = len(expected) != len(actual) or not all(map(same_values, expected, actual))
+
+        pages = sql.get_leaderboard_page(key, 0, args.page_size).pages
+        for page in range(pages):
+            expected_page = sql.get_leaderboard_page(key, page, args.page_size)
+            actual_page = memory.get_leaderboard_page(key, page, args.page_size)
+            failed = failed or expected_page[1:4] != actual_page[1:4] or not all(
+                map(same_values, expected_page.rows, actual_page.rows)
+            ) or len(expected_page.rows) != len(actual_page.rows)
+
+        for row in expected:
+            username = row.telegram_username
+            failed = failed or not same_values(sql.get_statistics(key, username), memory.get_statistics(key, username))
+            failed = failed or sql.get_rank(key, username) != memory.get_rank(key, username)
+
+        mismatches += failed
+        print(f"{'❌' if failed else '✅'} {key}: участников {len(expected)}, страниц {pages}")
+
+    if mismatches:
+        print(f"Периодов с расхождениями: {mismatches}")
+        return 1
+    print("✅ Столбцы в памяти совпадают с базой")
+    return 0
+
+
+def archive_workouts(db, args):
+    """Перенос тренировок старых лет в годовые архивы"""
+    size = os.path.getsize(db.db_name)
+    moved = db.archive_workouts(keep_years=args.keep_years)
+    for year, count in sorted(moved.items()):
+        print(f"📦 {year}: {count} тренировок -> {db.archive_path(year)}")
+    if not moved:
+        print("✅ Переносить нечего")
+        return 0
+    print(f"✅ Размер базы: {size / 1024 / 1024:.1f} МБ -> {os.path.getsize(db.db_name) / 1024 / 1024:.1f} МБ")
+    return 0
+
+
+COMMANDS = {
+    'rebuild-rollups': rebuild_rollups,
+    'check-rollups': check_rollups,
+    'explain-periods': explain_periods,
+    'archive': archive_workouts,
+    'check-state': check_state,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--db', default=config.DATABASE_NAME)
+    parser.add_argument('--chat', type=int, help='база клуба группового чата (MULTI_CLUB=1)')
+    parser.add_argument('--page-size', type=int, default=config.LEADERBOARD_PAGE_SIZE,
+                        help='участников на странице рейтинга для check-state')
+    parser.add_argument('--periods', nargs='+', help='периоды для explain-periods и check-state',
+                        default=['week', 'month', 'quarter', 'year', 'all', '2025-03-01..2025-03-15'])
+    parser.add_argument('--keep-years', type=int, default=config.ARCHIVE_KEEP_YEARS,
+                        help='последних календарных лет в основной базе для archive')
+    args = parser.parse_args()
+
+    db = Database(*tenant_paths(args.chat)) if args.chat else Database(args.db)
+    return COMMANDS[args.command](db, args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
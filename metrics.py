@@ -0,0 +1,310 @@
+"""Метрики обработчиков и запросов к базе, профилирование медленных обновлений"""
+import asyncio
+import bisect
+import functools
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+# Функции, в которых потоки ждут работу
+IDLE_FUNCTIONS = {'_worker', 'wait'}
+
+# Метки метрик по видам замеров
+LABELS = {'handler': 'handler', 'db_query': 'query', 'update_wait': 'key'}
+
+# Описания метрик для Prometheus
+HELP = {
+    'handler': ('Время обработчиков бота', 'Необработанные исключения в обработчиках бота'),
+    'db_query': ('Время запросов к базе данных', 'Ошибки запросов к базе данных'),
+    # Ожидание не завершается ошибкой, поэтому счетчика ошибок нет
+    'update_wait': ('Ожидание обновлений от приема до начала обработки', None),
+}
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.count, histogram.sum, histogram.max = self.count, self.sum, self.max
+        return histogram
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейно внутри корзины, как histogram_quantile)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if BUCKETS[index] != math.inf else self.max
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+
+class Metrics:
+    """Реестр гистограмм задержки и счетчиков ошибок.
+
+    Замер задается видом ('handler', 'db_query' или 'update_wait') и именем
+    функции (у 'update_wait' - видом ключа очереди обновления).
+    Обновления приходят и из цикла событий, и из пула потоков базы
+    данных, поэтому изменения идут под блокировкой.
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.errors = Counter()
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def observe(self, kind, name, seconds, failed=False):
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.errors[(kind, name)] += 1
+
+    def add_collector(self, collector):
+        """Функция, возвращающая значения (имя, метки, значение) на момент выгрузки"""
+        self.collectors.append(collector)
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        with self.lock:
+            histograms = sorted((key, histogram.copy()) for key, histogram in self.histograms.items())
+            errors = dict(self.errors)
+
+        lines = []
+        for kind in LABELS:
+            rows = [(name, histogram) for (row_kind, name), histogram in histograms if row_kind == kind]
+            if not rows:
+                continue
+            metric = f'bot_{kind}_seconds'
+            lines.append(f"# HELP {metric} {HELP[kind][0]}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in rows:
+                label = f'{LABELS[kind]}="{name}"'
+                cumulative = 0
+                for bucket, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bucket == math.inf else repr(bucket)
+                    lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}}} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{{{label}}} {histogram.count}')
+
+            if HELP[kind][1] is None:
+                continue
+            metric = f'bot_{kind}_errors_total'
+            lines.append(f"# HELP {metric} {HELP[kind][1]}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, _ in rows:
+                lines.append(f'{metric}{{{LABELS[kind]}="{name}"}} {errors.get((kind, name), 0)}')
+
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, kind):
+        """Сводка: (имя, вызовы, ошибки, p50, p95, max), сначала занимающие больше всего времени"""
+        with self.lock:
+            rows = [
+                (name, histogram.count, self.errors[(kind, name)],
+                 histogram.quantile(0.5), histogram.quantile(0.95), histogram.max, histogram.sum)
+                for (row_kind, name), histogram in self.histograms.items()
+                if row_kind == kind
+            ]
+        return [row[:-1] for row in sorted(rows, key=lambda row: row[-1], reverse=True)]
+
+
+class SlowUpdateProfiler:
+    """Сэмплирующий профайлер медленных обновлений.
+
+    Пока обрабатывается хотя бы одно обновление, отдельный поток раз в
+    interval секунд снимает стеки всех потоков. Если обработка заняла
+    больше threshold секунд, снимки за это время сохраняются в каталог
+    в формате свернутых стеков (flamegraph.pl, speedscope). Снимки хранятся
+    в ограниченном буфере. При параллельной обработке в профиль попадают
+    и соседние обновления, выполнявшиеся в то же время.
+    """
+    def __init__(self, threshold=config.PROFILE_SLOW_UPDATE, interval=config.PROFILE_INTERVAL,
+                 directory=config.PROFILE_DIR, window=60):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.samples = deque(maxlen=max(int(window / interval), 1))
+        self.active = 0
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self):
+        """Запуск потока сэмплирования"""
+        if not self.enabled or self.thread is not None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.sample_loop, name='profiler', daemon=True)
+        self.thread.start()
+        logger.info(f"Profiling updates slower than {self.threshold}s into {self.directory}")
+
+    def stop(self):
+        """Остановка потока сэмплирования"""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def sample_loop(self):
+        own_id = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            if not self.active:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                # Простаивающие потоки пула в профиле не нужны
+                if names.get(thread_id) != 'MainThread' and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                functions = []
+                while frame is not None:
+                    code = frame.f_code
+                    functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stacks.append(';'.join([names.get(thread_id, str(thread_id))] + functions[::-1]))
+            self.samples.append((time.perf_counter(), stacks))
+
+    def begin(self):
+        self.active += 1
+
+    def end(self, name, started):
+        """Окончание обработки: сохранение профиля, если она была медленной"""
+        self.active -= 1
+        finished = time.perf_counter()
+        if finished - started < self.threshold:
+            return None
+
+        folded = Counter()
+        for sampled_at, stacks in list(self.samples):
+            if started <= sampled_at <= finished:
+                folded.update(stacks)
+        if not folded:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{int((finished - started) * 1000)}ms.folded"
+        )
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in folded.most_common():
+                file.write(f"{stack} {count}\n")
+        logger.warning(f"Slow update in {name}: {finished - started:.3f}s, profile saved to {path}")
+        return path
+
+
+# Общие для бота и базы данных реестр и профайлер
+metrics = Metrics()
+profiler = SlowUpdateProfiler()
+
+
+def track(kind, profile=False):
+    """Декоратор замера времени и ошибок функции (обработчика или запроса к базе).
+
+    kind - 'handler' или 'db_query'. С profile=True вызов считается обработкой
+    обновления и попадает в профайлер медленных обновлений.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                profiling = profile and profiler.enabled
+                if profiling:
+                    profiler.begin()
+                failed = False
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    metrics.observe(kind, name, time.perf_counter() - started, failed)
+                    if profiling:
+                        profiler.end(name, started)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                failed = False
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    metrics.observe(kind, name, time.perf_counter() - started, failed)
+        return wrapper
+    return decorator
+
+
+async def serve_metrics(port, host='127.0.0.1'):
+    """HTTP-сервер с метриками для Prometheus (GET /metrics)"""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Заголовки запроса не нужны
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', metrics.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics available on http://{host}:{port}/metrics")
+    return server
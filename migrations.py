@@ -0,0 +1,280 @@
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Версия схемы хранится в PRAGMA user_version.
+# Каждая миграция переводит базу из версии N-1 в версию N
+# и выполняется в отдельной транзакции вместе с обновлением версии.
+
+def create_tables(cursor):
+    """Версия 1: исходные таблицы никнеймов и тренировок"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS nicknames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_username TEXT NOT NULL,
+            nickname TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS workouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            distance REAL NOT NULL,
+            duration INTEGER NOT NULL,
+            telegram_username TEXT NOT NULL
+        )
+    ''')
+
+def add_indexes(cursor):
+    """Версия 2: индексы для статистики и уникальный никнейм на пользователя"""
+    # Дубликаты никнеймов могли появиться при гонке SELECT/INSERT,
+    # оставляем самую свежую запись пользователя
+    cursor.execute('''
+        DELETE FROM nicknames
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM nicknames GROUP BY telegram_username
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_nicknames_username
+        ON nicknames (telegram_username)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_workouts_username_date
+        ON workouts (telegram_username, record_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_workouts_date
+        ON workouts (record_date)
+    ''')
+
+def rebuild_monthly_stats(cursor):
+    """Пересчет помесячных итогов из таблицы тренировок"""
+    cursor.execute('DELETE FROM monthly_stats')
+    cursor.execute('''
+        INSERT INTO monthly_stats (telegram_username, month, workouts, distance, duration)
+        SELECT telegram_username, strftime('%Y-%m', record_date), COUNT(*), SUM(distance), SUM(duration)
+        FROM workouts
+        GROUP BY telegram_username, strftime('%Y-%m', record_date)
+    ''')
+
+def add_monthly_stats(cursor):
+    """Версия 3: помесячные итоги пользователей, обновляемые триггерами"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_stats (
+            telegram_username TEXT NOT NULL,
+            month TEXT NOT NULL,
+            workouts INTEGER NOT NULL,
+            distance REAL NOT NULL,
+            duration INTEGER NOT NULL,
+            PRIMARY KEY (telegram_username, month)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_monthly_stats_month
+        ON monthly_stats (month)
+    ''')
+
+    # Итоги меняются в той же транзакции, что и тренировки
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS workouts_monthly_stats_insert
+        AFTER INSERT ON workouts
+        BEGIN
+            INSERT INTO monthly_stats (telegram_username, month, workouts, distance, duration)
+            VALUES (NEW.telegram_username, strftime('%Y-%m', NEW.record_date), 1, NEW.distance, NEW.duration)
+            ON CONFLICT (telegram_username, month) DO UPDATE SET
+                workouts = workouts + 1,
+                distance = distance + excluded.distance,
+                duration = duration + excluded.duration;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS workouts_monthly_stats_delete
+        AFTER DELETE ON workouts
+        BEGIN
+            UPDATE monthly_stats SET
+                workouts = workouts - 1,
+                distance = distance - OLD.distance,
+                duration = duration - OLD.duration
+            WHERE telegram_username = OLD.telegram_username
+              AND month = strftime('%Y-%m', OLD.record_date);
+            DELETE FROM monthly_stats
+            WHERE telegram_username = OLD.telegram_username
+              AND month = strftime('%Y-%m', OLD.record_date)
+              AND workouts <= 0;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS workouts_monthly_stats_update
+        AFTER UPDATE OF telegram_username, record_date, distance, duration ON workouts
+        BEGIN
+            UPDATE monthly_stats SET
+                workouts = workouts - 1,
+                distance = distance - OLD.distance,
+                duration = duration - OLD.duration
+            WHERE telegram_username = OLD.telegram_username
+              AND month = strftime('%Y-%m', OLD.record_date);
+            DELETE FROM monthly_stats
+            WHERE telegram_username = OLD.telegram_username
+              AND month = strftime('%Y-%m', OLD.record_date)
+              AND workouts <= 0;
+            INSERT INTO monthly_stats (telegram_username, month, workouts, distance, duration)
+            VALUES (NEW.telegram_username, strftime('%Y-%m', NEW.record_date), 1, NEW.distance, NEW.duration)
+            ON CONFLICT (telegram_username, month) DO UPDATE SET
+                workouts = workouts + 1,
+                distance = distance + excluded.distance,
+                duration = duration + excluded.duration;
+        END
+    ''')
+
+    rebuild_monthly_stats(cursor)
+
+# Столбцы таблиц, изменения которых попадают в журнал
+CAPTURED_TABLES = {
+    'workouts': ['id', 'record_date', 'distance', 'duration', 'telegram_username'],
+    'nicknames': ['id', 'telegram_username', 'nickname', 'registration_date'],
+    'yearly_summaries': ['id', 'telegram_username', 'year', 'workouts', 'distance', 'duration'],
+}
+
+REAL_COLUMNS = {'distance'}
+
+def capture_changes(cursor, table):
+    """Триггеры записи изменений таблицы в журнал changes"""
+    columns = CAPTURED_TABLES[table]
+    # json_object печатает REAL с 15 значащими цифрами, поэтому дробные
+    # значения сохраняются строкой без потери точности
+    row_json = 'json_object(' + ', '.join(
+        f"'{column}', printf('%!.17g', NEW.{column})" if column in REAL_COLUMNS else f"'{column}', NEW.{column}"
+        for column in columns
+    ) + ')'
+    for event in ('INSERT', 'UPDATE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO changes (table_name, operation, row_id, data)
+                VALUES ('{table}', 'upsert', NEW.id, {row_json});
+            END
+        ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_changes_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO changes (table_name, operation, row_id, data)
+            VALUES ('{table}', 'delete', OLD.id, NULL);
+        END
+    ''')
+
+def add_change_capture(cursor):
+    """Версия 4: журнал изменений для инкрементальных резервных копий"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            table_name TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            data TEXT
+        )
+    ''')
+
+    for table in ('workouts', 'nicknames'):
+        capture_changes(cursor, table)
+
+def add_broadcasts(cursor):
+    """Версия 5: участники для рассылок и очередь исходящих сообщений"""
+    # Чат личной переписки с участником, куда можно присылать итоги
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS members (
+            telegram_username TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            notify INTEGER NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Подготовленные рассылки: ключ вида 'month:2025-03' защищает от повторной подготовки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            key TEXT PRIMARY KEY,
+            messages INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Очередь исходящих сообщений: строка остается 'pending', пока сообщение
+    # не отправлено, поэтому после перезапуска рассылка продолжается с места остановки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            broadcast TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP,
+            error TEXT,
+            UNIQUE (broadcast, chat_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (next_attempt) WHERE status = 'pending'
+    ''')
+
+def add_yearly_summaries(cursor):
+    """Версия 6: годовые итоги тренировок, перенесенных в архив"""
+    # Тренировки года после переноса в файл архива удаляются из workouts
+    # (а их помесячные итоги - триггерами), итоги года остаются здесь
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS yearly_summaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_username TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            workouts INTEGER NOT NULL,
+            distance REAL NOT NULL,
+            duration INTEGER NOT NULL,
+            UNIQUE (telegram_username, year)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_yearly_summaries_year
+        ON yearly_summaries (year)
+    ''')
+    # Итоги попадают в журнал, чтобы восстановление на момент после
+    # переноса в архив не теряло удаленные тренировки
+    capture_changes(cursor, 'yearly_summaries')
+
+MIGRATIONS = [
+    create_tables,
+    add_indexes,
+    add_monthly_stats,
+    add_change_capture,
+    add_broadcasts,
+    add_yearly_summaries,
+]
+
+def get_version(conn):
+    """Текущая версия схемы"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Применение всех недостающих миграций"""
+    version = get_version(conn)
+
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Database migrated to version {number}: {migration.__doc__}")
+
+    return get_version(conn)
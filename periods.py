@@ -0,0 +1,183 @@
+"""Календарные периоды статистики и их границы для запросов к базе"""
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# Период: ключ (как в callback_data), вид ('week', 'month', 'quarter', 'year',
+# 'range' или 'all'), начало включительно и конец не включительно.
+# Границы - datetime в UTC без tzinfo, у 'all' обе None
+Period = namedtuple('Period', ['key', 'kind', 'start', 'end'])
+
+# Относительные периоды: ключ -> (вид, сдвиг назад в единицах вида)
+RELATIVE_PERIODS = {
+    'week': ('week', 0),
+    'last_week': ('week', 1),
+    'month': ('month', 0),
+    'last_month': ('month', 1),
+    'quarter': ('quarter', 0),
+    'last_quarter': ('quarter', 1),
+    'year': ('year', 0),
+    'last_year': ('year', 1),
+}
+
+# Названия относительных периодов после "за"
+PERIOD_NAMES = {
+    'week': 'текущую неделю',
+    'last_week': 'прошлую неделю',
+    'month': 'текущий месяц',
+    'last_month': 'прошлый месяц',
+    'quarter': 'текущий квартал',
+    'last_quarter': 'прошлый квартал',
+    'year': 'текущий год',
+    'last_year': 'прошлый год',
+    'all': 'все время',
+}
+
+MONTH_NAMES = (
+    'январь', 'февраль', 'март', 'апрель', 'май', 'июнь',
+    'июль', 'август', 'сентябрь', 'октябрь', 'ноябрь', 'декабрь',
+)
+
+# Длина вида периода в месяцах (неделя считается отдельно)
+KIND_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+
+# Формат даты тренировки в базе
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+EXPLICIT_PATTERNS = (
+    (re.compile(r'^(\d{4})$'), 'year'),
+    (re.compile(r'^(\d{4})-(\d{2})$'), 'month'),
+    (re.compile(r'^(\d{4})-[qQ]([1-4])$'), 'quarter'),
+    (re.compile(r'^(\d{4})-[wW](\d{2})$'), 'week'),
+)
+
+
+def add_months(moment, months):
+    """Первое число месяца, отстоящего от месяца moment на months"""
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def period_start(kind, moment):
+    """Начало периода вида kind, в который попадает moment"""
+    if kind == 'week':
+        day = datetime(moment.year, moment.month, moment.day)
+        return day - timedelta(days=day.weekday())
+    month = moment.month
+    if kind == 'quarter':
+        month -= (month - 1) % 3
+    elif kind == 'year':
+        month = 1
+    return datetime(moment.year, month, 1)
+
+
+def shift(kind, start, count):
+    """Начало периода вида kind, отстоящего от start на count периодов"""
+    if kind == 'week':
+        return start + timedelta(weeks=count)
+    return add_months(start, KIND_MONTHS[kind] * count)
+
+
+def resolve_period(key, today=None):
+    """Границы периода по ключу.
+
+    Ключи: 'all', относительные ('week', 'last_month', 'quarter', 'year'...),
+    явные ('2025', '2025-03', '2025-q1', '2025-w09' - неделя ISO) и диапазон
+    дат 'YYYY-MM-DD..YYYY-MM-DD' (дата окончания включительно).
+    Неизвестный ключ - ValueError.
+    """
+    if key == 'all':
+        return Period(key, 'all', None, None)
+
+    if key in RELATIVE_PERIODS:
+        if today is None:
+            today = datetime.now(timezone.utc)
+        kind, back = RELATIVE_PERIODS[key]
+        start = shift(kind, period_start(kind, today), -back)
+        return Period(key, kind, start, shift(kind, start, 1))
+
+    for pattern, kind in EXPLICIT_PATTERNS:
+        match = pattern.match(key)
+        if not match:
+            continue
+        year, number = int(match.group(1)), int(match.group(2)) if match.lastindex > 1 else 1
+        if kind == 'week':
+            # 4 января всегда на первой неделе ISO
+            start = datetime.fromisocalendar(year, number, 1)
+        elif kind == 'quarter':
+            start = datetime(year, (number - 1) * 3 + 1, 1)
+        else:
+            start = datetime(year, number, 1)
+        return Period(key, kind, start, shift(kind, start, 1))
+
+    if '..' in key:
+        first, last = key.split('..', 1)
+        start = datetime.strptime(first, '%Y-%m-%d')
+        end = datetime.strptime(last, '%Y-%m-%d') + timedelta(days=1)
+        if end <= start:
+            raise ValueError(f"Пустой диапазон дат: {key}")
+        return Period(key, 'range', start, end)
+
+    raise ValueError(f"Неизвестный период: {key}")
+
+
+def previous_period(period):
+    """Предыдущий период того же вида (для диапазона - той же длины)"""
+    if period.kind == 'all':
+        return None
+    if period.kind == 'range':
+        start = period.start - (period.end - period.start)
+    else:
+        start = shift(period.kind, period.start, -1)
+    return Period(None, period.kind, start, period.start)
+
+
+def explicit_key(period):
+    """Явный ключ календарного периода: '2025', '2025-03', '2025-q1', '2025-w09'"""
+    if period.kind == 'year':
+        return f"{period.start.year}"
+    if period.kind == 'quarter':
+        return f"{period.start.year}-q{(period.start.month - 1) // 3 + 1}"
+    if period.kind == 'month':
+        return f"{period.start:%Y-%m}"
+    if period.kind == 'week':
+        year, week, _ = period.start.isocalendar()
+        return f"{year}-w{week:02d}"
+    return period.key
+
+
+def period_params(period):
+    """Границы периода строками в формате дат тренировок (None - без границы)"""
+    return tuple(moment.strftime(DATE_FORMAT) if moment else None for moment in (period.start, period.end))
+
+
+def month_range(period):
+    """Границы периода в месяцах 'YYYY-MM' или None, если период не кратен месяцу.
+
+    Для 'all' возвращает (None, None).
+    """
+    if period.kind == 'all':
+        return None, None
+    bounds = (period.start, period.end)
+    if any(moment != datetime(moment.year, moment.month, 1) for moment in bounds):
+        return None
+    return tuple(moment.strftime('%Y-%m') for moment in bounds)
+
+
+def period_title(period):
+    """Название периода после "за": 'текущий месяц', 'март 2025', '01.03.2025 - 15.03.2025'"""
+    if period.key in PERIOD_NAMES:
+        return PERIOD_NAMES[period.key]
+    if period.kind == 'year':
+        return f"{period.start.year} год"
+    if period.kind == 'quarter':
+        return f"{(period.start.month - 1) // 3 + 1} квартал {period.start.year}"
+    if period.kind == 'month':
+        return f"{MONTH_NAMES[period.start.month - 1]} {period.start.year}"
+    last = period.end - timedelta(days=1)
+    return f"{period.start:%d.%m.%Y} - {last:%d.%m.%Y}"
+
+
+def get_period_bounds(key, today=None):
+    """Границы периода по ключу строками в формате дат тренировок"""
+    return period_params(resolve_period(key, today))
@@ -0,0 +1,52 @@
+import bisect
+import math
+import threading
+from collections import namedtuple
+
+# Место участника за период: место (как RANK() в рейтинге), участников,
+# процент лучших, дистанция и отставание от ближайшего места выше (None для лидера)
+MemberRank = namedtuple('MemberRank', ['rank', 'total', 'top_percent', 'distance', 'gap'])
+
+
+class RankIndex:
+    """Отсортированные дистанции участников за период.
+
+    Место ищется двоичным поиском за O(log n) без обхода рейтинга.
+    Новые тренировки применяются к индексу сразу после записи в базу.
+    Дистанции округляются до метров, чтобы суммы, посчитанные в SQLite
+    и здесь, давали одинаковые равенства.
+    """
+    def __init__(self, start, end, totals):
+        self.start = start
+        self.end = end
+        self.totals = {username: round(distance, 3) for username, distance in totals}
+        self.distances = sorted(self.totals.values())
+        self.lock = threading.Lock()
+
+    def covers(self, record_date):
+        """Входит ли дата тренировки 'YYYY-MM-DD HH:MM:SS' в период индекса [start, end)"""
+        if self.start is None:
+            return True
+        return self.start <= record_date < self.end
+
+    def add(self, username, distance):
+        """Учет новой тренировки участника"""
+        with self.lock:
+            old = self.totals.get(username)
+            if old is not None:
+                del self.distances[bisect.bisect_left(self.distances, old)]
+            new = round((old or 0) + distance, 3)
+            self.totals[username] = new
+            bisect.insort(self.distances, new)
+
+    def rank(self, username):
+        """Место участника (MemberRank) или None, если за период тренировок нет"""
+        with self.lock:
+            distance = self.totals.get(username)
+            if distance is None:
+                return None
+            total = len(self.distances)
+            above = bisect.bisect_right(self.distances, distance)
+            rank = total - above + 1
+            gap = self.distances[above] - distance if above < total else None
+        return MemberRank(rank, total, max(math.ceil(rank / total * 100), 1), distance, gap)
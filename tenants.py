@@ -0,0 +1,129 @@
+"""Базы клубов: у каждого группового чата свой файл базы данных"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import re
+from collections import OrderedDict
+
+import config
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Клуб обрабатываемого обновления или задачи: id группового чата, None - основная база
+current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+# Файл базы клуба в TENANTS_DIR
+TENANT_FILE = re.compile(r'^(-?\d+)\.db$')
+
+# Типы чатов, у которых в режиме нескольких клубов своя база
+GROUP_CHATS = ('group', 'supergroup')
+
+
+def tenant_for_chat(chat):
+    """Клуб чата: id группы или None (основная база для личных чатов и режима одного клуба)"""
+    if config.MULTI_CLUB and chat is not None and chat.type in GROUP_CHATS:
+        return chat.id
+    return None
+
+
+def tenant_paths(tenant):
+    """Файл базы и каталог резервных копий клуба"""
+    if tenant is None:
+        return config.DATABASE_NAME, config.BACKUP_DIR
+    return os.path.join(config.TENANTS_DIR, f"{tenant}.db"), os.path.join(config.BACKUP_DIR, str(tenant))
+
+
+class TenantRegistry:
+    """Открытые базы клубов с ограничением их числа.
+
+    База клуба открывается при первом обращении и закрывается, когда
+    открытых баз больше max_open и к ней дольше всех не обращались.
+    У каждой базы свой файл, пул потоков, очередь записи и кэши, поэтому
+    записи одного клуба не занимают блокировку и потоки другого.
+    """
+    def __init__(self, max_open=config.TENANTS_MAX_OPEN):
+        self.max_open = max_open
+        self.handles = OrderedDict()
+        # Закрытие вытесненных баз: запись их очередей идет в фоне
+        self.closing = set()
+        self.opened = 0
+        self.evicted = 0
+
+    def get(self, tenant=None):
+        """База клуба, при необходимости открывается с вытеснением самой давней"""
+        handle = self.handles.get(tenant)
+        if handle is not None:
+            self.handles.move_to_end(tenant)
+            return handle
+
+        db_name, backup_dir = tenant_paths(tenant)
+        if tenant is not None:
+            os.makedirs(config.TENANTS_DIR, exist_ok=True)
+        handle = self.handles[tenant] = AsyncDatabase(db_name, backup_dir=backup_dir)
+        self.opened += 1
+
+        while len(self.handles) > self.max_open:
+            evicted_tenant, evicted = self.handles.popitem(last=False)
+            self.evicted += 1
+            logger.info(f"Closing database of tenant {evicted_tenant}")
+            task = asyncio.get_running_loop().create_task(evicted.close(wait=False))
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
+        return handle
+
+    def current(self):
+        """База клуба текущего обновления"""
+        return self.get(current_tenant.get())
+
+    @contextlib.contextmanager
+    def use(self, tenant):
+        """Работа с базой клуба tenant через общий db, например в задачах по расписанию"""
+        token = current_tenant.set(tenant)
+        try:
+            yield self.get(tenant)
+        finally:
+            current_tenant.reset(token)
+
+    def tenants(self):
+        """Все клубы: основная база и базы групп из TENANTS_DIR"""
+        tenants = [None]
+        if config.MULTI_CLUB and os.path.isdir(config.TENANTS_DIR):
+            for name in sorted(os.listdir(config.TENANTS_DIR)):
+                match = TENANT_FILE.match(name)
+                if match:
+                    tenants.append(int(match.group(1)))
+        return tenants
+
+    def open_handles(self):
+        """Открытые сейчас базы"""
+        return list(self.handles.values())
+
+    def stats(self):
+        """Счетчики открытых и вытесненных баз"""
+        return {'open': len(self.handles), 'opened': self.opened, 'evicted': self.evicted}
+
+    async def close(self):
+        """Запись очередей и закрытие всех баз"""
+        handles = list(self.handles.values())
+        self.handles.clear()
+        for handle in handles:
+            await handle.close()
+        if self.closing:
+            await asyncio.gather(*self.closing)
+
+
+class TenantDatabase:
+    """База клуба текущего обновления под видом одной AsyncDatabase.
+
+    Обработчики обращаются к общему db, а запрос уходит в базу клуба,
+    выбранного для обновления по чату. Клуб ищется при каждом обращении,
+    поэтому вытесненная база при следующем обращении просто открывается снова.
+    """
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __getattr__(self, name):
+        return getattr(self.registry.current(), name)
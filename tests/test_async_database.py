@@ -0,0 +1,36 @@
+"""Запросы AsyncDatabase в пуле потоков не задерживают другие обновления"""
+import asyncio
+import threading
+
+from database import AsyncDatabase
+
+
+def test_slow_query_does_not_block_other_updates(tmp_path):
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'club.db'), backup_dir=str(tmp_path / 'backups'))
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_query():
+            # Долгий запрос держит поток пула, пока тест его не отпустит
+            started.set()
+            release.wait(10)
+            return 'slow'
+
+        slow = asyncio.create_task(db.run(slow_query))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        try:
+            # Другое обновление: запись и чтение через тот же AsyncDatabase
+            await asyncio.wait_for(db.add_workout('runner', 5.0, 1800), 5)
+            stats = await asyncio.wait_for(db.get_statistics('all', 'runner'), 5)
+            # И обычная корутина цикла событий
+            await asyncio.wait_for(asyncio.sleep(0.01), 1)
+            assert not slow.done()
+        finally:
+            release.set()
+        assert await slow == 'slow'
+        await db.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert (stats.workouts, stats.distance, stats.duration) == (1, 5.0, 1800)
@@ -0,0 +1,99 @@
+"""Резервные копии: имена, ключи для кнопок и восстановление"""
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from backup import BackupManager, backup_key, backup_time
+from database import Database
+
+
+def make_club(tmp_path):
+    db = Database(str(tmp_path / 'club.db'), str(tmp_path / 'backups'), memory=False)
+    db.add_workout('anna', 5.0, 1800)
+    return db, BackupManager(db.db_name, db.backup_dir)
+
+
+def test_backups_in_the_same_second_get_distinct_names(tmp_path):
+    _, manager = make_club(tmp_path)
+    names = [manager.create_backup() for _ in range(3)]
+
+    assert len(set(names)) == 3
+    assert manager.list_backups() == sorted(names, reverse=True)
+    assert len({backup_key(name) for name in names}) == 3
+    for name in names:
+        assert manager.find_backup(backup_key(name)) == name
+
+
+def test_callback_data_fits_telegram_limit(tmp_path):
+    # Длинное имя базы не влияет на длину ключа
+    db = Database(str(tmp_path / ('club-' + 'x' * 80 + '.db')), str(tmp_path / 'backups'), memory=False)
+    name = BackupManager(db.db_name, db.backup_dir).create_backup()
+
+    for action in ('restore_select_', 'restore_confirm_'):
+        assert len((action + backup_key(name)).encode()) <= 64
+
+
+def test_backup_time_reads_old_and_new_names():
+    assert backup_time('club-20250131-183005.db.gz') == datetime(2025, 1, 31, 18, 30, 5, tzinfo=timezone.utc)
+    assert backup_time('club-20250131-183005-000250.db.gz') == datetime(
+        2025, 1, 31, 18, 30, 5, 250, tzinfo=timezone.utc
+    )
+    assert backup_key('club-20250131-183005.db.gz') == '20250131183005'
+
+
+def test_restore_by_key(tmp_path):
+    db, manager = make_club(tmp_path)
+    name = manager.create_backup()
+    db.add_workout('anna', 7.0, 2400)
+
+    db.restore_from_backup(db.find_backup(backup_key(name)))
+
+    conn = sqlite3.connect(db.db_name)
+    assert conn.execute('SELECT distance FROM workouts').fetchall() == [(5.0,)]
+    conn.close()
+
+
+def snapshot_tables(path):
+    """Содержимое таблиц, которые восстанавливаются из копии и журнала изменений"""
+    conn = sqlite3.connect(path)
+    tables = {
+        table: conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2').fetchall()
+        for table in ('workouts', 'nicknames', 'monthly_stats')
+    }
+    conn.close()
+    return tables
+
+
+def wait_next_second():
+    """Пауза до начала следующей секунды: until задается с точностью до секунды"""
+    time.sleep(1.01 - time.time() % 1)
+
+
+def test_point_in_time_restore_matches_live_database(tmp_path):
+    db, manager = make_club(tmp_path)
+    db.add_nickname('anna', 'Аня')
+    manager.create_backup()
+
+    # Несколько выгруженных файлов изменений после копии
+    for number in range(3):
+        db.add_workout('boris', 3.0 + number, 1000 + number)
+        db.add_nickname('boris', f'Боря {number}')
+        assert manager.ship_delta() is not None
+    conn = sqlite3.connect(db.db_name)
+    with conn:
+        conn.execute("DELETE FROM workouts WHERE telegram_username = 'anna'")
+        conn.execute("UPDATE workouts SET distance = 42.2 WHERE distance = 4.0")
+    conn.close()
+    # Последнее изменение до until еще не выгружено
+    db.add_workout('vera', 10.0, 3000)
+    expected = snapshot_tables(db.db_name)
+    until = datetime.now(timezone.utc).replace(microsecond=0)
+
+    # Изменения после until, тоже еще не выгруженные, не должны попасть в восстановленную базу
+    wait_next_second()
+    db.add_workout('vera', 99.0, 9999)
+    db.add_nickname('anna', 'Анна')
+
+    manager.restore(until=until)
+
+    assert snapshot_tables(db.db_name) == expected
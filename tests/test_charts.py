@@ -0,0 +1,161 @@
+"""Графики: отрисовка в пуле и кэш изображений"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import pytest
+
+from charts import ChartRenderer
+
+WEEKLY = [(date(2024, 5, 6), 12.5), (date(2024, 5, 13), 0.0), (date(2024, 5, 20), 21.1)]
+PACES = [(datetime(2024, 5, day, 7, 30), 5.0 + day / 100) for day in range(1, 12)]
+LEADERBOARD = [('Анна', 120.5), ('@boris', 98.0), ('Вера', 12.25)]
+CHARTS = [
+    ('weekly', 'anna', WEEKLY),
+    ('pace', 'anna', PACES),
+    ('leaderboard', None, LEADERBOARD),
+]
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """Пул потоков вместо пула процессов, считает отправленные отрисовки"""
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def new_renderer():
+    """Отрисовщик с пулом потоков: процессы для тестов не нужны"""
+    renderer = ChartRenderer(workers=2, cache_size=8)
+    renderer.executor = CountingExecutor()
+    return renderer
+
+
+def test_render_caches_png():
+    renderer = new_renderer()
+    try:
+        key, photo = asyncio.run(renderer.render('weekly', 'anna', None, 'anna: км по неделям', WEEKLY))
+    finally:
+        renderer.close()
+    assert photo.startswith(b'\x89PNG')
+    assert renderer.cache.entries[key] == photo
+
+
+def test_render_racing_invalidate_is_not_cached():
+    renderer = new_renderer()
+    executor = renderer.executor
+    started = threading.Event()
+    release = threading.Event()
+    submit = executor.submit
+
+    def slow_submit(function, *args):
+        def slow():
+            started.set()
+            release.wait()
+            return function(*args)
+        return submit(slow)
+
+    executor.submit = slow_submit
+
+    async def scenario():
+        task = asyncio.create_task(renderer.render('weekly', 'anna', None, 'anna: км по неделям', WEEKLY))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        # Кэш сброшен, пока график рисуется: изображение не сохраняется
+        renderer.cache.invalidate()
+        release.set()
+        return await task
+
+    try:
+        key, photo = asyncio.run(scenario())
+    finally:
+        renderer.close()
+    assert photo.startswith(b'\x89PNG')
+    assert key not in renderer.cache.entries
+
+
+@pytest.mark.parametrize('kind, owner, data', CHARTS)
+def test_second_render_is_cache_hit(kind, owner, data):
+    renderer = new_renderer()
+    executor = renderer.executor
+    bounds = (date(2024, 5, 1), date(2024, 6, 1))
+
+    async def scenario():
+        first = await renderer.render(kind, owner, bounds, f"{kind} за май", data)
+        second = await renderer.render(kind, owner, bounds, f"{kind} за май", data)
+        return first, second
+
+    try:
+        (key, photo), second = asyncio.run(scenario())
+    finally:
+        renderer.close()
+    assert photo.startswith(b'\x89PNG')
+    assert second == (key, photo)
+    assert executor.submitted == 1
+    assert renderer.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'rendered': 1}
+
+
+def test_concurrent_requests_share_one_render():
+    renderer = new_renderer()
+    executor = renderer.executor
+
+    async def scenario():
+        return await asyncio.gather(*(renderer.render('pace', 'anna', None, 'темп', PACES) for _ in range(3)))
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        renderer.close()
+    assert len({photo for _, photo in results}) == 1
+    assert executor.submitted == 1
+    assert renderer.rendered == 1
+
+
+def test_changed_data_is_rendered_again():
+    renderer = new_renderer()
+    executor = renderer.executor
+
+    async def scenario():
+        first, _ = await renderer.render('leaderboard', None, None, 'рейтинг', LEADERBOARD)
+        second, _ = await renderer.render('leaderboard', None, None, 'рейтинг', LEADERBOARD + [('Глеб', 1.0)])
+        return first, second
+
+    try:
+        first, second = asyncio.run(scenario())
+    finally:
+        renderer.close()
+    assert first != second
+    assert executor.submitted == 2
+
+
+def test_remember_file_id_replaces_png():
+    renderer = new_renderer()
+    executor = renderer.executor
+
+    async def scenario():
+        key, _ = await renderer.render('weekly', 'anna', None, 'км по неделям', WEEKLY)
+        renderer.remember_file_id(key, 'AgACAgIAAxk')
+        return key, await renderer.render('weekly', 'anna', None, 'км по неделям', WEEKLY)
+
+    try:
+        key, again = asyncio.run(scenario())
+    finally:
+        renderer.close()
+    # Повторная отправка берет file_id, изображение не перерисовывается и не загружается
+    assert again == (key, 'AgACAgIAAxk')
+    assert executor.submitted == 1
+
+
+def test_remember_file_id_after_invalidate_does_nothing():
+    renderer = new_renderer()
+    try:
+        key, _ = asyncio.run(renderer.render('weekly', 'anna', None, 'км по неделям', WEEKLY))
+    finally:
+        renderer.close()
+    renderer.cache.invalidate()
+    renderer.remember_file_id(key, 'AgACAgIAAxk')
+    assert key not in renderer.cache.entries
@@ -0,0 +1,143 @@
+"""Статистика из столбцов в памяти (ClubState) совпадает с запросами SQL"""
+import random
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+import pytest
+
+import database
+from columnar import ClubState
+from database import Database
+from manage import same_values
+from periods import RELATIVE_PERIODS
+
+PAGE_SIZE = 3
+
+# Относительные, явные периоды и диапазоны через границу архивного года
+PERIODS = [
+    'all', *RELATIVE_PERIODS,
+    '2023', '2024', '2024-q4', '2024-12', '2025-w01', '2025-03', '2024-12-20..2025-01-10',
+]
+
+
+def now():
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def club_workouts(rng, usernames, count):
+    """Тренировки (пользователь, дата, дистанция, время) с 2023 года по сегодня"""
+    first = datetime(2023, 1, 1)
+    seconds = int((now() - first).total_seconds())
+    workouts = []
+    for _ in range(count):
+        record_date = first + timedelta(seconds=rng.randrange(seconds))
+        distance = round(rng.uniform(1, 25), 2)
+        workouts.append((rng.choice(usernames), f"{record_date:%Y-%m-%d %H:%M:%S}", distance, int(distance * 330)))
+    return workouts
+
+
+def edge_workouts(username):
+    """Тренировки на первой и последней секунде периодов"""
+    today = now()
+    week = datetime(today.year, today.month, today.day) - timedelta(days=today.weekday())
+    moments = [
+        datetime(2024, 12, 31, 23, 59, 59), datetime(2025, 1, 1),
+        datetime(2025, 3, 1), datetime(2025, 3, 31, 23, 59, 59),
+        datetime(today.year, 1, 1), datetime(today.year, today.month, 1), week, week - timedelta(seconds=1),
+    ]
+    return [(username, f"{moment:%Y-%m-%d %H:%M:%S}", 4.2, 1500) for moment in moments]
+
+
+def fill(db, rng):
+    """База клуба: участники с никнеймами и без, равные дистанции, тренировки на границах"""
+    usernames = [f"runner{number}" for number in range(10)]
+    db.import_workouts(club_workouts(rng, usernames, 400))
+    db.import_workouts(edge_workouts('edge'))
+    # Одинаковые тренировки: равные дистанции делят место
+    db.import_workouts([(username, '2025-03-10 07:00:00', 10.0, 3000) for username in ('twin_a', 'twin_b')])
+    for username in usernames[:6]:
+        db.add_nickname(username, f"Бегун {username[-1]}")
+    return usernames
+
+
+def assert_same(memory):
+    """Статистика, страницы рейтинга и места по всем периодам из памяти и из SQL"""
+    # Свежая база без кэшей и индексов мест, заполненных до последних записей
+    sql = Database(memory.db_name, memory.backup_dir, memory=False)
+    for key in PERIODS:
+        # Порядок равных дистанций в get_statistics не задан
+        expected = sorted(sql.get_statistics(key))
+        actual = sorted(memory.get_statistics(key))
+        assert len(actual) == len(expected), key
+        for expected_row, actual_row in zip(expected, actual):
+            assert same_values(expected_row, actual_row), (key, expected_row, actual_row)
+
+        first = sql.get_leaderboard_page(key, 0, PAGE_SIZE)
+        for page in range(first.pages + 1):
+            # Страница за пределами рейтинга заменяется последней
+            expected_page = sql.get_leaderboard_page(key, page, PAGE_SIZE)
+            actual_page = memory.get_leaderboard_page(key, page, PAGE_SIZE)
+            assert actual_page[1:4] == expected_page[1:4], (key, page)
+            assert len(actual_page.rows) == len(expected_page.rows), (key, page)
+            for expected_row, actual_row in zip(expected_page.rows, actual_page.rows):
+                assert same_values(expected_row, actual_row), (key, page, expected_row, actual_row)
+
+        for username in [row.telegram_username for row in expected] + ['nobody']:
+            assert same_values(sql.get_statistics(key, username), memory.get_statistics(key, username)), (key, username)
+            assert memory.get_rank(key, username) == sql.get_rank(key, username), (key, username)
+
+
+@pytest.fixture
+def memory_db(tmp_path, monkeypatch):
+    # Маленький хвост: записи после загрузки несколько раз пересобирают столбцы
+    monkeypatch.setattr(database, 'ClubState', partial(ClubState, tail_size=8))
+    return Database(str(tmp_path / 'club.db'), backup_dir=str(tmp_path / 'backups'), memory=True)
+
+
+def test_loaded_state_matches_sql(memory_db):
+    fill(memory_db, random.Random(24))
+    assert_same(memory_db)
+    assert memory_db.get_state().stats()['rows'] == 400 + 8 + 2
+
+
+def test_writes_after_load_match_sql(memory_db):
+    rng = random.Random(7)
+    usernames = fill(memory_db, rng)
+    state = memory_db.get_state()
+    assert_same(memory_db)
+
+    # Тренировки на границах периодов только в хвосте
+    memory_db.import_workouts(edge_workouts('edge_late'))
+    assert state.tail_rows == state.tail_size
+    assert_same(memory_db)
+
+    # Новая тренировка, новый участник и смена никнейма: новая тренировка, новый участник и смена никнейма
+    memory_db.add_workout('runner1', 5.5, 1900)
+    memory_db.add_workout('newcomer', 3.0, 1100)
+    memory_db.add_nickname('runner9', 'Последний')
+    assert 0 < state.tail_rows < state.tail_size
+    assert_same(memory_db)
+
+    # Импорт прошлых дат больше хвоста: столбцы пересобираются
+    memory_db.import_workouts(club_workouts(rng, usernames + ['newcomer', 'late'], 30))
+    memory_db.add_workout('late', 10.0, 3000)
+    assert len(state.main.timestamps) > 410
+    assert_same(memory_db)
+    assert memory_db.get_state() is state
+
+
+def test_archived_years_match_sql(memory_db):
+    fill(memory_db, random.Random(2024))
+    keep_years = now().year - 2024
+
+    # Архив до загрузки: в память читаются и архивные тренировки
+    loaded_later = Database(memory_db.db_name, memory_db.backup_dir, memory=True)
+    memory_db.get_state()
+    moved = loaded_later.archive_workouts(keep_years=keep_years, vacuum=False)
+    assert set(moved) == {2023, 2024}
+    assert_same(loaded_later)
+
+    # Архив после загрузки: в памяти остаются все тренировки, SQL читает годовые итоги
+    assert_same(memory_db)
+    memory_db.add_workout('runner3', 7.0, 2400)
+    assert_same(memory_db)
@@ -0,0 +1,186 @@
+"""Параллельная обработка обновлений: порядок для участника, очередь приема, диалоги"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.ext import Application, ConversationHandler, MessageHandler, filters
+
+from dispatch import KeyedUpdateProcessor, update_key
+from fake_telegram import FakeBotAPI, chat_dict, user_dict
+
+
+def fake_update(user_id=None, chat_id=None):
+    """Обновление с участником и чатом, как их видит процессор"""
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id) if user_id is not None else None,
+        effective_chat=SimpleNamespace(id=chat_id) if chat_id is not None else None,
+    )
+
+
+def test_update_key():
+    assert update_key(fake_update(7, -100)) == ('user', 7)
+    assert update_key(fake_update(None, -100)) == ('chat', -100)
+    assert update_key(fake_update()) is None
+    assert update_key(object()) is None
+
+
+def test_same_user_updates_run_in_order_one_at_a_time():
+    events = []
+    active = {'count': 0, 'max': 0}
+
+    async def handle(number):
+        active['count'] += 1
+        active['max'] = max(active['max'], active['count'])
+        events.append(number)
+        # Поздние обновления короче: без очереди участника они бы обогнали ранние
+        await asyncio.sleep((20 - number) / 2000)
+        active['count'] -= 1
+
+    async def scenario():
+        processor = KeyedUpdateProcessor(concurrency=8, max_pending=64)
+        await asyncio.gather(*(processor.process_update(fake_update(1), handle(number)) for number in range(20)))
+        return processor
+
+    processor = asyncio.run(scenario())
+    assert events == list(range(20))
+    assert active['max'] == 1
+    assert processor.stats() == {'queued': 0, 'waiting': 0, 'running': 0, 'keys': 0, 'processed': 20}
+
+
+def test_other_users_are_not_blocked_by_a_busy_user():
+    async def scenario():
+        processor = KeyedUpdateProcessor(concurrency=2, max_pending=64)
+        release = asyncio.Event()
+        finished = []
+
+        async def blocked(number):
+            await release.wait()
+            finished.append(('busy', number))
+
+        async def quick(user_id):
+            finished.append(('other', user_id))
+
+        # У занятого участника очередь из пяти обновлений, слот занимает только первое
+        busy = [asyncio.create_task(processor.process_update(fake_update(1), blocked(number))) for number in range(5)]
+        others = [asyncio.create_task(processor.process_update(fake_update(user_id), quick(user_id)))
+                  for user_id in range(2, 12)]
+        await asyncio.wait_for(asyncio.gather(*others), 1)
+        stats = processor.stats()
+        release.set()
+        await asyncio.gather(*busy)
+        return finished, stats
+
+    finished, stats = asyncio.run(scenario())
+    assert finished[:10] == [('other', user_id) for user_id in range(2, 12)]
+    assert finished[10:] == [('busy', number) for number in range(5)]
+    assert (stats['running'], stats['waiting'], stats['keys']) == (1, 4, 1)
+
+
+def test_concurrency_limits_running_handlers():
+    async def scenario():
+        processor = KeyedUpdateProcessor(concurrency=3, max_pending=64)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(processor.process_update(fake_update(user_id), release.wait()))
+                 for user_id in range(10)]
+        await asyncio.sleep(0.01)
+        stats = processor.stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return stats, processor.stats()
+
+    during, after = asyncio.run(scenario())
+    assert (during['running'], during['waiting'], during['keys']) == (3, 7, 10)
+    assert (after['running'], after['waiting'], after['processed']) == (0, 0, 10)
+
+
+def test_admission_queue_holds_updates_beyond_max_pending():
+    async def scenario():
+        processor = KeyedUpdateProcessor(concurrency=2, max_pending=2)
+        queue = processor.queue
+        release = asyncio.Event()
+
+        # Как Application._update_fetcher: взять из очереди и запустить обработку
+        for user_id in (1, 2):
+            queue.put_nowait(user_id)
+        tasks = []
+        for _ in range(2):
+            user_id = await queue.get()
+            tasks.append(asyncio.create_task(processor.process_update(fake_update(user_id), release.wait())))
+
+        # Принято max_pending обновлений: следующее остается в очереди
+        for user_id in (3, 4):
+            queue.put_nowait(user_id)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.get(), 0.05)
+        # Очередь приема тоже заполнена: Updater ждет на put и не забирает новые обновления
+        with pytest.raises(asyncio.QueueFull):
+            queue.put_nowait(5)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.put(5), 0.05)
+        stats = processor.stats()
+
+        release.set()
+        await asyncio.gather(*tasks)
+        admitted = await asyncio.wait_for(queue.get(), 1)
+        return stats, admitted, queue.qsize()
+
+    stats, admitted, left = asyncio.run(scenario())
+    assert (stats['queued'], stats['running'], stats['waiting']) == (2, 2, 0)
+    assert admitted == 3
+    assert left == 1
+
+
+WAITING_ANSWER = 1
+
+
+def message_update(bot, update_id, user_id, text):
+    """Сообщение участника в личном чате в виде обновления Telegram"""
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': chat_dict(user_id),
+        'from': user_dict(user_id, f"runner{user_id}"),
+        'text': text,
+    }}, bot)
+
+
+def test_conversation_state_survives_interleaved_updates():
+    async def scenario():
+        api = FakeBotAPI()
+        await api.start()
+        processor = KeyedUpdateProcessor(concurrency=4, max_pending=64)
+        application = Application.builder().token('123:test').base_url(api.url).concurrent_updates(processor).build()
+        answers = []
+
+        async def start(update, context):
+            # У первого участника вопрос задается дольше: его ответ приходит, пока диалог еще не в WAITING_ANSWER
+            await asyncio.sleep(0.05 if update.effective_user.id == 1 else 0)
+            return WAITING_ANSWER
+
+        async def answer(update, context):
+            answers.append((update.effective_user.id, update.message.text))
+            return ConversationHandler.END
+
+        application.add_handler(ConversationHandler(
+            entry_points=[MessageHandler(filters.Regex('^записать$'), start)],
+            states={WAITING_ANSWER: [MessageHandler(filters.TEXT, answer)]},
+            fallbacks=[],
+        ))
+        try:
+            async with application:
+                texts = [(1, 'записать'), (2, 'записать'), (1, '5 30'), (2, '10 55'), (1, 'записать'), (1, '3 20')]
+                updates = [message_update(application.bot, number, user_id, text)
+                           for number, (user_id, text) in enumerate(texts, 1)]
+                # Как Application._update_fetcher в режиме concurrent_updates: задача на обновление
+                await asyncio.gather(*(
+                    processor.process_update(update, application.process_update(update)) for update in updates
+                ))
+        finally:
+            await api.stop()
+        return answers
+
+    answers = asyncio.run(scenario())
+    # Второй участник не ждал медленный диалог первого, ответы первого не потерялись
+    assert answers == [(2, '10 55'), (1, '5 30'), (1, '3 20')]
@@ -0,0 +1,79 @@
+"""Импорт тренировок: испорченные файлы архива не прерывают импорт остальных"""
+import gzip
+import io
+import zipfile
+
+from importer import WorkoutImport, iterparse_pruned
+
+GOOD_CSV = 'record_date,distance,duration\n2025-01-10 07:00:00,5.0,30\n2025-01-12 07:00:00,10.0,60\n'
+
+GPX = '''<?xml version="1.0"?>
+<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>{points}</trkseg></trk></gpx>'''
+
+POINT = '<trkpt lat="{lat}" lon="37.6"><time>2025-01-{day:02d}T07:{minute:02d}:00Z</time></trkpt>'
+
+
+def gpx(count, day=15):
+    return GPX.format(points=''.join(
+        POINT.format(lat=55.75 + index * 0.001, day=day, minute=index % 60) for index in range(count)
+    ))
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return str(path)
+
+
+def run_import(path, name):
+    workout_import = WorkoutImport(path, name, 'runner')
+    rows = [row for batch in workout_import.batches() for row in batch]
+    return workout_import, rows
+
+
+def test_broken_files_in_zip_do_not_stop_the_rest(tmp_path):
+    path = make_zip(tmp_path / 'workouts.zip', {
+        'a_good.csv': GOOD_CSV,
+        # csv.Error: поле длиннее csv.field_size_limit()
+        'b_malformed.csv': 'record_date,distance,duration\n"' + 'x' * 200000 + '",5,30\n',
+        'c_corrupt.csv.gz': b'\x1f\x8b\x08\x00not really gzip',
+        'd_no_coordinates.gpx': GPX.format(points='<trkpt lat="55.7"><time>2025-01-01T07:00:00Z</time></trkpt>'),
+        'e_broken.gpx': '<gpx><trk><trkseg><trkpt',
+        'f_good.csv.gz': gzip.compress(GOOD_CSV.replace('2025-01-1', '2025-02-1').encode()),
+        'g_good.gpx': gpx(11, day=20),
+    })
+
+    workout_import, rows = run_import(path, 'workouts.zip')
+
+    assert sorted(row[1] for row in rows) == [
+        '2025-01-10 07:00:00', '2025-01-12 07:00:00', '2025-01-20 07:00:00',
+        '2025-02-10 07:00:00', '2025-02-12 07:00:00',
+    ]
+    assert workout_import.errors == 4
+    failed = sorted(sample.split(':', 1)[0] for sample in workout_import.error_samples)
+    assert failed == ['b_malformed.csv', 'c_corrupt.csv.gz', 'd_no_coordinates.gpx', 'e_broken.gpx']
+    assert 'без координат' in next(s for s in workout_import.error_samples if s.startswith('d_'))
+
+
+def test_gpx_point_without_time_is_reported(tmp_path):
+    path = tmp_path / 'track.gpx'
+    path.write_text(GPX.format(points='<trkpt lat="55.7" lon="37.6"><time></time></trkpt>'))
+
+    workout_import, rows = run_import(str(path), 'track.gpx')
+
+    assert rows == []
+    assert workout_import.errors == 1
+    assert 'без времени' in workout_import.error_samples[0]
+
+
+def test_processed_points_are_removed_from_tree():
+    root = None
+    seen = 0
+    for event, element, name in iterparse_pruned(io.BytesIO(gpx(5000).encode()), {'trkpt'}):
+        if root is None:
+            root = element
+        if event == 'end' and name == 'trkpt':
+            seen += 1
+    assert seen == 5000
+    assert not any(element.tag.endswith('trkpt') for element in root.iter())
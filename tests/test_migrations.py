@@ -0,0 +1,96 @@
+"""Обновление базы старой схемы до последней версии"""
+import sqlite3
+
+import pytest
+
+from migrations import MIGRATIONS, get_version, migrate
+
+WORKOUTS = [
+    ('2024-12-31 23:59:59', 5.0, 1800, 'anna'),
+    ('2025-01-01 00:00:00', 10.5, 3600, 'anna'),
+    ('2025-01-15 07:30:00', 3.25, 1200, 'boris'),
+    ('2025-02-01 06:00:00', 21.1, 7300, 'boris'),
+    ('2025-02-28 19:00:00', 7.0, 2500, 'vera'),
+]
+
+# Дубликаты появлялись при гонке SELECT/INSERT в старом add_nickname
+NICKNAMES = [
+    ('anna', 'Аня'),
+    ('boris', 'Боря'),
+    ('anna', 'Анна'),
+    ('vera', None),
+    ('boris', 'Борис'),
+]
+
+
+def create_old_database(path):
+    """База в том виде, в каком ее создавал Database до миграций (user_version 0)"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE nicknames (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_username TEXT NOT NULL,
+            nickname TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE workouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            distance REAL NOT NULL,
+            duration INTEGER NOT NULL,
+            telegram_username TEXT NOT NULL
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO workouts (record_date, distance, duration, telegram_username) VALUES (?, ?, ?, ?)', WORKOUTS
+    )
+    conn.executemany('INSERT INTO nicknames (telegram_username, nickname) VALUES (?, ?)', NICKNAMES)
+    conn.commit()
+    return conn
+
+
+def test_old_database_keeps_all_rows(tmp_path):
+    conn = create_old_database(str(tmp_path / 'old.db'))
+    workouts_before = conn.execute('SELECT * FROM workouts ORDER BY id').fetchall()
+    assert get_version(conn) == 0
+
+    assert migrate(conn) == len(MIGRATIONS)
+
+    assert conn.execute('SELECT * FROM workouts ORDER BY id').fetchall() == workouts_before
+    # Помесячные итоги пересчитаны из перенесенных тренировок
+    assert conn.execute('''
+        SELECT telegram_username, month, workouts, distance, duration
+        FROM monthly_stats ORDER BY telegram_username, month
+    ''').fetchall() == [
+        ('anna', '2024-12', 1, 5.0, 1800),
+        ('anna', '2025-01', 1, 10.5, 3600),
+        ('boris', '2025-01', 1, 3.25, 1200),
+        ('boris', '2025-02', 1, 21.1, 7300),
+        ('vera', '2025-02', 1, 7.0, 2500),
+    ]
+    conn.close()
+
+
+def test_duplicate_nicknames_collapse_to_latest(tmp_path):
+    conn = create_old_database(str(tmp_path / 'old.db'))
+    migrate(conn)
+
+    assert conn.execute(
+        'SELECT telegram_username, nickname FROM nicknames ORDER BY telegram_username'
+    ).fetchall() == [('anna', 'Анна'), ('boris', 'Борис'), ('vera', None)]
+    # Уникальный индекс не дает появиться новым дубликатам
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO nicknames (telegram_username, nickname) VALUES ('anna', 'Ещё')")
+    conn.close()
+
+
+def test_migrate_is_idempotent(tmp_path):
+    conn = create_old_database(str(tmp_path / 'old.db'))
+    migrate(conn)
+    rows = conn.execute('SELECT * FROM workouts ORDER BY id').fetchall()
+
+    assert migrate(conn) == len(MIGRATIONS)
+    assert conn.execute('SELECT * FROM workouts ORDER BY id').fetchall() == rows
+    conn.close()
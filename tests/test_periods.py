@@ -0,0 +1,238 @@
+"""Границы периодов на краях месяцев, кварталов, лет, 29 февраля и 53-й недели ISO"""
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from database import Database, get_totals_query, split_archived
+from periods import month_range, period_params, previous_period, resolve_period
+
+
+def bounds(key, today=None):
+    period = resolve_period(key, today)
+    return period.kind, period.start, period.end
+
+
+@pytest.mark.parametrize('key, today, expected', [
+    # Последняя и первая секунды месяца
+    ('month', datetime(2024, 1, 31, 23, 59, 59), ('month', datetime(2024, 1, 1), datetime(2024, 2, 1))),
+    ('month', datetime(2024, 2, 1), ('month', datetime(2024, 2, 1), datetime(2024, 3, 1))),
+    ('last_month', datetime(2025, 1, 1), ('month', datetime(2024, 12, 1), datetime(2025, 1, 1))),
+    ('last_month', datetime(2024, 3, 1), ('month', datetime(2024, 2, 1), datetime(2024, 3, 1))),
+    # 29 февраля
+    ('month', datetime(2024, 2, 29, 12), ('month', datetime(2024, 2, 1), datetime(2024, 3, 1))),
+    ('week', datetime(2024, 2, 29), ('week', datetime(2024, 2, 26), datetime(2024, 3, 4))),
+    # Кварталы
+    ('quarter', datetime(2025, 3, 31, 23, 59, 59), ('quarter', datetime(2025, 1, 1), datetime(2025, 4, 1))),
+    ('quarter', datetime(2025, 4, 1), ('quarter', datetime(2025, 4, 1), datetime(2025, 7, 1))),
+    ('quarter', datetime(2025, 12, 31), ('quarter', datetime(2025, 10, 1), datetime(2026, 1, 1))),
+    ('last_quarter', datetime(2025, 1, 15), ('quarter', datetime(2024, 10, 1), datetime(2025, 1, 1))),
+    # Годы
+    ('year', datetime(2024, 12, 31, 23, 59, 59), ('year', datetime(2024, 1, 1), datetime(2025, 1, 1))),
+    ('last_year', datetime(2025, 1, 1), ('year', datetime(2024, 1, 1), datetime(2025, 1, 1))),
+    # Недели через границу года и 53-я неделя ISO 2020 года
+    ('week', datetime(2021, 1, 3, 23, 59), ('week', datetime(2020, 12, 28), datetime(2021, 1, 4))),
+    ('week', datetime(2021, 1, 4), ('week', datetime(2021, 1, 4), datetime(2021, 1, 11))),
+    ('last_week', datetime(2021, 1, 4), ('week', datetime(2020, 12, 28), datetime(2021, 1, 4))),
+])
+def test_relative_periods(key, today, expected):
+    assert bounds(key, today) == expected
+
+
+@pytest.mark.parametrize('key, expected', [
+    ('2024', ('year', datetime(2024, 1, 1), datetime(2025, 1, 1))),
+    ('2024-02', ('month', datetime(2024, 2, 1), datetime(2024, 3, 1))),
+    ('2023-02', ('month', datetime(2023, 2, 1), datetime(2023, 3, 1))),
+    ('2024-12', ('month', datetime(2024, 12, 1), datetime(2025, 1, 1))),
+    ('2024-q4', ('quarter', datetime(2024, 10, 1), datetime(2025, 1, 1))),
+    ('2025-Q1', ('quarter', datetime(2025, 1, 1), datetime(2025, 4, 1))),
+    ('2020-w53', ('week', datetime(2020, 12, 28), datetime(2021, 1, 4))),
+    ('2021-w01', ('week', datetime(2021, 1, 4), datetime(2021, 1, 11))),
+    ('2025-w01', ('week', datetime(2024, 12, 30), datetime(2025, 1, 6))),
+    # Диапазон включает дату окончания: конец - следующая полночь
+    ('2024-02-29..2024-02-29', ('range', datetime(2024, 2, 29), datetime(2024, 3, 1))),
+    ('2024-12-31..2025-01-01', ('range', datetime(2024, 12, 31), datetime(2025, 1, 2))),
+])
+def test_explicit_periods(key, expected):
+    assert bounds(key) == expected
+
+
+@pytest.mark.parametrize('key', [
+    '2021-w53',  # в 2021 году 52 недели ISO
+    '2024-w00',
+    '2024-13',
+    '2023-02-29..2023-03-01',
+    '2025-03-02..2025-03-01',
+    'yesterday',
+])
+def test_invalid_periods(key):
+    with pytest.raises(ValueError):
+        resolve_period(key)
+
+
+@pytest.mark.parametrize('key, expected', [
+    ('2024-03', (datetime(2024, 2, 1), datetime(2024, 3, 1))),
+    ('2025-01', (datetime(2024, 12, 1), datetime(2025, 1, 1))),
+    ('2025-q1', (datetime(2024, 10, 1), datetime(2025, 1, 1))),
+    ('2025', (datetime(2024, 1, 1), datetime(2025, 1, 1))),
+    ('2021-w01', (datetime(2020, 12, 28), datetime(2021, 1, 4))),
+    ('2020-w53', (datetime(2020, 12, 21), datetime(2020, 12, 28))),
+    # Диапазон той же длины сразу перед началом
+    ('2024-03-01..2024-03-02', (datetime(2024, 2, 28), datetime(2024, 3, 1))),
+])
+def test_previous_period(key, expected):
+    previous = previous_period(resolve_period(key))
+    assert (previous.start, previous.end) == expected
+    assert previous.kind == resolve_period(key).kind
+
+
+def test_previous_period_of_all_time():
+    assert previous_period(resolve_period('all')) is None
+
+
+@pytest.mark.parametrize('key, expected', [
+    ('all', (None, None)),
+    ('2024-02', ('2024-02', '2024-03')),
+    ('2024-12', ('2024-12', '2025-01')),
+    ('2024-q4', ('2024-10', '2025-01')),
+    ('2024', ('2024-01', '2025-01')),
+    # Диапазон из целых месяцев считается по помесячным итогам
+    ('2024-01-01..2024-02-29', ('2024-01', '2024-03')),
+    ('2024-01-01..2024-02-28', None),
+    ('2024-02-29..2024-02-29', None),
+    ('2020-w53', None),
+])
+def test_month_range(key, expected):
+    assert month_range(resolve_period(key)) == expected
+
+
+# Тренировки на самых краях периодов: (дата, дистанция)
+EDGE_WORKOUTS = [
+    ('2020-12-27 23:59:59', 1.0),
+    ('2020-12-28 00:00:00', 2.0),
+    ('2021-01-03 23:59:59', 4.0),
+    ('2021-01-04 00:00:00', 8.0),
+    ('2024-02-28 23:59:59', 16.0),
+    ('2024-02-29 00:00:00', 32.0),
+    ('2024-02-29 23:59:59', 64.0),
+    ('2024-03-01 00:00:00', 128.0),
+    ('2024-12-31 23:59:59', 256.0),
+    ('2025-01-01 00:00:00', 512.0),
+]
+
+
+@pytest.fixture
+def edge_db(tmp_path):
+    db = Database(str(tmp_path / 'club.db'), str(tmp_path / 'backups'), memory=False)
+    conn = sqlite3.connect(db.db_name)
+    with conn:
+        conn.executemany(
+            "INSERT INTO workouts (record_date, distance, duration, telegram_username) VALUES (?, ?, 60, 'anna')",
+            EDGE_WORKOUTS
+        )
+    yield conn
+    conn.close()
+
+
+def period_distance(conn, key):
+    query, params = get_totals_query(resolve_period(key), 'anna')
+    row = conn.execute(f'SELECT SUM(distance), SUM(workouts) FROM ({query})', params).fetchone()
+    return row[0] or 0
+
+
+@pytest.mark.parametrize('key, expected', [
+    # Неделя и 53-я неделя: конец не включается
+    ('2020-w53', 2.0 + 4.0),
+    ('2021-w01', 8.0),
+    # Месяцы по помесячным итогам
+    ('2024-02', 16.0 + 32.0 + 64.0),
+    ('2024-03', 128.0),
+    ('2024-q4', 256.0),
+    ('2025', 512.0),
+    # Диапазоны по тренировкам: день окончания включается целиком
+    ('2024-02-29..2024-02-29', 32.0 + 64.0),
+    ('2024-02-28..2024-02-28', 16.0),
+    ('2024-12-31..2025-01-01', 256.0 + 512.0),
+    ('2024-01-01..2024-02-29', 16.0 + 32.0 + 64.0),
+    ('all', sum(distance for _, distance in EDGE_WORKOUTS)),
+])
+def test_totals_query_bounds(edge_db, key, expected):
+    assert period_distance(edge_db, key) == expected
+
+
+def test_totals_query_params_are_half_open():
+    period = resolve_period('2024-02-29..2024-02-29')
+    _, params = get_totals_query(period, 'anna')
+    assert params == ('anna', '2024-02-29 00:00:00', '2024-03-01 00:00:00')
+    assert period_params(period) == ('2024-02-29 00:00:00', '2024-03-01 00:00:00')
+
+    _, params = get_totals_query(resolve_period('2024-q4'))
+    assert params == ('2024-10', '2025-01')
+
+
+@pytest.mark.parametrize('key, whole, partial', [
+    ('2024', [2024], []),
+    ('2024-12', [], [2024]),
+    ('2024-12-31..2025-01-01', [], [2024, 2025]),
+    ('2023-01-01..2024-12-31', [2023, 2024], []),
+    ('2025-w01', [], [2024, 2025]),
+    ('all', [2023, 2024, 2025], []),
+])
+def test_split_archived_at_year_edges(key, whole, partial):
+    assert split_archived(resolve_period(key), [2025, 2023, 2024]) == (whole, partial)
+
+
+@pytest.mark.parametrize('key, expected', [
+    ('2020-w53', 2.0 + 4.0),
+    ('2024-02', 16.0 + 32.0 + 64.0),
+    ('2024-02-29..2024-02-29', 32.0 + 64.0),
+    ('2024-12-31..2025-01-01', 256.0 + 512.0),
+    ('2024', 16.0 + 32.0 + 64.0 + 128.0 + 256.0),
+    ('all', sum(distance for _, distance in EDGE_WORKOUTS)),
+])
+def test_archived_years_keep_the_same_bounds(tmp_path, key, expected):
+    db = Database(str(tmp_path / 'club.db'), str(tmp_path / 'backups'), memory=False)
+    conn = sqlite3.connect(db.db_name)
+    with conn:
+        conn.executemany(
+            "INSERT INTO workouts (record_date, distance, duration, telegram_username) VALUES (?, ?, 60, 'anna')",
+            EDGE_WORKOUTS
+        )
+    conn.close()
+    # 2020, 2021 и 2024 уходят в архив, 2025 остается в основной базе
+    db.archive_workouts(keep_years=datetime.now().year - 2024, vacuum=False)
+    assert db.archive_files()
+
+    assert db.get_statistics(key, 'anna').distance == expected
+
+
+def test_statistics_close_connection_when_archive_is_missing(tmp_path):
+    db = Database(str(tmp_path / 'club.db'), str(tmp_path / 'backups'), memory=False)
+    conn = sqlite3.connect(db.db_name)
+    with conn:
+        conn.executemany(
+            "INSERT INTO workouts (record_date, distance, duration, telegram_username) VALUES (?, ?, 60, 'anna')",
+            EDGE_WORKOUTS
+        )
+    conn.close()
+    db.archive_workouts(keep_years=datetime.now().year - 2024, vacuum=False)
+    os.remove(db.archive_path(2024))
+
+    opened = []
+    get_connection = db.get_connection
+
+    def tracked_connection():
+        opened.append(get_connection())
+        return opened[-1]
+
+    db.get_connection = tracked_connection
+    # Без файла архива запрос падает, соединение все равно закрывается
+    with pytest.raises(sqlite3.Error):
+        db.get_statistics('2024-02')
+    with pytest.raises(sqlite3.Error):
+        db.get_statistics('2024-02', 'anna')
+    assert len(opened) == 2
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
@@ -0,0 +1,51 @@
+"""Кэш отчетов не сохраняет результат чтения, пересекшегося с записью"""
+import asyncio
+import threading
+
+from cache import ReportCache
+from database import AsyncDatabase
+
+
+def test_put_skips_value_read_before_invalidate():
+    cache = ReportCache()
+    generation = cache.generation
+    cache.invalidate()
+    cache.put('key', 'stale', generation)
+    assert cache.get('key') is None
+
+    cache.put('key', 'fresh', cache.generation)
+    assert cache.get('key') == 'fresh'
+
+
+def test_leaderboard_read_racing_write_is_not_cached(tmp_path):
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'club.db'), backup_dir=str(tmp_path / 'backups'))
+        await db.add_workout('anna', 5.0, 1800)
+
+        read_done = threading.Event()
+        release = threading.Event()
+        read_page = db.db.get_leaderboard_page
+
+        def slow_page(*args):
+            # Чтение закончено до записи, а результат возвращается после нее
+            page = read_page(*args)
+            read_done.set()
+            release.wait(10)
+            return page
+
+        db.db.get_leaderboard_page = slow_page
+        loop = asyncio.get_running_loop()
+        stale_read = asyncio.create_task(db.get_leaderboard_page('all'))
+        await loop.run_in_executor(None, read_done.wait, 5)
+        await db.add_workout('anna', 7.0, 2400)
+        release.set()
+        stale = await stale_read
+        db.db.get_leaderboard_page = read_page
+
+        fresh = await db.get_leaderboard_page('all')
+        await db.close()
+        return stale, fresh
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale.rows[0].distance == 5.0
+    assert fresh.rows[0].distance == 12.0
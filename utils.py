@@ -1,5 +1,3 @@
-from datetime import datetime
-
 def format_time(minutes_total):
     """Форматирование времени в минуты:секунды"""
     minutes = int(minutes_total)
@@ -12,29 +10,6 @@ def format_duration(minutes):
     mins = minutes % 60
     return f"{hours} часов {mins} минут"
 
-def get_current_quarter():
-    """Получение текущего квартала"""
-    month = datetime.now().month
-    return (month - 1) // 3 + 1
-
-def get_quarter_dates(quarter=None, year=None):
-    """Получение дат начала и конца квартала"""
-    if year is None:
-        year = datetime.now().year
-    if quarter is None:
-        quarter = get_current_quarter()
-    
-    quarter_start_month = (quarter - 1) * 3 + 1
-    quarter_end_month = quarter_start_month + 2
-    
-    start_date = datetime(year, quarter_start_month, 1)
-    if quarter_end_month == 12:
-        end_date = datetime(year + 1, 1, 1)
-    else:
-        end_date = datetime(year, quarter_end_month + 1, 1)
-    
-    return start_date, end_date
-
 def validate_input(text):
     """Проверка формата ввода тренировки"""
     try:
@@ -48,3 +23,11 @@ def validate_input(text):
         return distance, duration
     except:
         return None, None
+
+def format_sparkline(values):
+    """Мини-график ряда значений символами блоков"""
+    blocks = "▁▂▃▄▅▆▇█"
+    top = max(values, default=0)
+    if top <= 0:
+        return blocks[0] * len(values)
+    return ''.join(blocks[min(int(value / top * len(blocks)), len(blocks) - 1)] for value in values)